@@ -1,196 +1,861 @@
-# cython: profile=True
-from libc.stdio cimport fopen, fclose, fseek, fread, FILE, SEEK_SET, ftell
+import os
+import mmap
+import struct
+import datetime
+import collections
+import gzip
+import shutil
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+import multiprocessing
+import multiprocessing.pool
 
 import numpy
 cimport numpy
+cimport cython
+from libc.math cimport fabs
+from libc.stdlib cimport qsort
 
-cdef extern from "arpa/inet.h":
-    int ntohl(int)
-    short ntohs(short)
-
-ctypedef struct DirEntry:
-    char[4] name
-    int number
-    short elementtype
-    short elementsize
-    int numelements
-    int datasize
-    int dataoffset
-    int datahandle
-
-cdef short fread_short(FILE *p):
-    cdef short s = 0
-    fread(&s, 2, 1, p)
-    host_s = ntohs(s)
-    return host_s
-
-cdef char fread_byte(FILE *p):
-    cdef char c = 0
-    fread(&c, 1, 1, p)
-    return c
-
-cdef numpy.ndarray fread_byte_array_at(FILE *p, int N, int offset):
-    cdef long return_to = ftell(p)
-    fseek(p, offset, SEEK_SET)
-    cdef numpy.ndarray[numpy.int8_t, ndim=1] arr = numpy.zeros(N, dtype=numpy.byte)
-    cdef int j
-    for j in range(N):
-        arr[j] = fread_byte(p)
-    fseek(p, return_to, SEEK_SET)
-    return arr
-
-cdef numpy.ndarray fread_short_array_at(FILE *p, int N, int offset):
-    cdef long return_to = ftell(p)
-    fseek(p, offset, SEEK_SET)
-    cdef numpy.ndarray[numpy.int16_t, ndim=1] arr = numpy.zeros(N, dtype=numpy.short)
-    cdef int j
-    for j in range(N):
-        arr[j] = fread_short(p)
-    fseek(p, return_to, SEEK_SET)
-    return arr
-
-cdef DirEntry fread_direntry(FILE *p):
-    cdef DirEntry td
-    fread(&td, sizeof(DirEntry), 1, p)
-    td.number = ntohl(td.number)
-    td.elementtype = ntohs(td.elementtype)
-    td.elementsize = ntohs(td.elementsize)
-    td.numelements = ntohl(td.numelements)
-    td.datasize = ntohl(td.datasize)
-    td.dataoffset = ntohl(td.dataoffset)
-    td.datahandle = ntohl(td.datahandle)
-    return td
-
-def read(filename):
-    tmp = filename.encode('UTF-8')
-    cdef char* c_filename = tmp
-    cdef FILE *p
-    p = fopen(c_filename, "rb")
-    if p == NULL:
+from seqlab.traces import TraceArray
+from seqlab import diskcache
+
+# An ABIF directory entry is 28 bytes, all fields big endian:
+#     name (4 chars), number (i4), elementtype (i2), elementsize (i2),
+#     numelements (i4), datasize (i4), dataoffset (i4), datahandle (i4)
+# When an entry's data fits in four bytes or less, it is stored in
+# place of dataoffset instead of elsewhere in the file.
+DEF ENTRY_SIZE = 28
+
+# The spans of the file read() decodes, in the order walk() fills
+# them in: PBAS for bases, PCON for confidences, and for traces PLOC
+# for centers, FWO_ to give base order, and the last four DATA fields
+# of 12.
+DEF NSPANS = 8
+DEF PBAS_SPAN = 0
+DEF PCON_SPAN = 1
+DEF PLOC_SPAN = 2
+DEF FWO_SPAN = 3
+DEF DATA_SPAN = 4
+span_tags = ('PBAS', 'PCON', 'PLOC', 'FWO_', 'DATA', 'DATA', 'DATA', 'DATA')
+
+cdef struct Span:
+    Py_ssize_t offset
+    Py_ssize_t count
+
+cdef enum WalkError:
+    OK = 0
+    BAD_MAGIC
+    BAD_VERSION
+    BAD_DIRECTORY
+    TRUNCATED
+    MISSING_TAG
+
+walk_errors = {BAD_MAGIC: "Not a valid ABI file: bad magic number.",
+               BAD_VERSION: "ABI file version not supported by this library.",
+               BAD_DIRECTORY: "Not a valid ABI file: bad directory entry.",
+               TRUNCATED: "Not a valid ABI file: data runs past the end of the file."}
+
+# Callers of be32 and be16 check that the bytes they read are in b.
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline unsigned int be32(const unsigned char[:] b, Py_ssize_t i) noexcept nogil:
+    return (<unsigned int>b[i] << 24) | (<unsigned int>b[i+1] << 16) | \
+        (<unsigned int>b[i+2] << 8) | <unsigned int>b[i+3]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline short be16(const unsigned char[:] b, Py_ssize_t i) noexcept nogil:
+    return <short>((b[i] << 8) | b[i+1])
+
+cdef inline unsigned int tag(const char* name) noexcept nogil:
+    return (<unsigned int><unsigned char>name[0] << 24) | \
+        (<unsigned int><unsigned char>name[1] << 16) | \
+        (<unsigned int><unsigned char>name[2] << 8) | \
+        <unsigned int><unsigned char>name[3]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int set_span(const unsigned char[:] b, Py_ssize_t entry, Py_ssize_t itemsize,
+                  Span* span) noexcept nogil:
+    cdef Py_ssize_t count = <int>be32(b, entry+12)
+    cdef Py_ssize_t datasize = <int>be32(b, entry+16)
+    if count < 0:
+        return TRUNCATED
+    if datasize <= 4:
+        span.offset = entry + 20
+    else:
+        span.offset = <int>be32(b, entry+20)
+    span.count = count
+    if span.offset < 0 or span.offset + count*itemsize > b.shape[0]:
+        return TRUNCATED
+    return OK
+
+cdef int check_header(const unsigned char[:] b, Py_ssize_t* nentries,
+                      Py_ssize_t* diroffset) noexcept nogil:
+    # Check the header of the ABIF file in b, and set the number of
+    # directory entries and the directory's offset.
+    cdef int version
+    if b.shape[0] < 6 + ENTRY_SIZE or be32(b, 0) != tag('ABIF'):
+        return BAD_MAGIC
+    version = be16(b, 4)
+    if version < 100 or version > 199:
+        return BAD_VERSION
+    if be32(b, 6) != tag('tdir') or <int>be32(b, 10) != 1 or \
+            be16(b, 14) != 1023 or be16(b, 16) != ENTRY_SIZE:
+        return BAD_DIRECTORY
+    nentries[0] = <int>be32(b, 18)
+    diroffset[0] = <int>be32(b, 26)
+    if nentries[0] < 0 or diroffset[0] < 0 or \
+            diroffset[0] + nentries[0]*ENTRY_SIZE > b.shape[0]:
+        return TRUNCATED
+    return OK
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int walk(const unsigned char[:] b, bint traces, Span* spans) noexcept nogil:
+    # Check the header of the ABIF file in b and find the spans of
+    # the tags we decode in its directory. For PBAS, PCON, and PLOC we
+    # want the second entry, the BaseCaller's entry. Spans which are
+    # not found are left with a count of -1; the trace spans are only
+    # looked for if traces is set.
+    cdef Py_ssize_t nentries, diroffset, i, e
+    cdef unsigned int name
+    cdef int npbas = 0, npcon = 0, nploc = 0, ndata = 0, err
+    cdef int k
+    for k in range(NSPANS):
+        spans[k].count = -1
+    err = check_header(b, &nentries, &diroffset)
+    if err != OK:
+        return err
+    for i in range(nentries):
+        e = diroffset + i*ENTRY_SIZE
+        name = be32(b, e)
+        if name == tag('PBAS'):
+            npbas += 1
+            if npbas == 2:
+                err = set_span(b, e, 1, &spans[PBAS_SPAN])
+        elif name == tag('PCON'):
+            npcon += 1
+            if npcon == 2:
+                err = set_span(b, e, 1, &spans[PCON_SPAN])
+        elif not traces:
+            continue
+        elif name == tag('PLOC'):
+            nploc += 1
+            if nploc == 2:
+                err = set_span(b, e, 2, &spans[PLOC_SPAN])
+        elif name == tag('FWO_'):
+            err = set_span(b, e, 1, &spans[FWO_SPAN])
+        elif name == tag('DATA'):
+            ndata += 1
+            if 9 <= ndata <= 12:
+                err = set_span(b, e, 2, &spans[DATA_SPAN + ndata - 9])
+        if err != OK:
+            return err
+    return OK
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void copy_be16(const unsigned char[:] b, Py_ssize_t offset, short[:] out) noexcept nogil:
+    # Byte swap out.shape[0] big endian shorts starting at offset into out.
+    cdef Py_ssize_t i
+    for i in range(out.shape[0]):
+        out[i] = be16(b, offset + 2*i)
+
+# The fields of a read that read() can decode.
+all_fields = ('sequence', 'confidences', 'traces')
+
+class AB1Record(object):
+    """A read decoded from an AB1 file.
+
+    The bases and confidences are available as the attributes
+    ``sequence`` and ``confidences``. The trace geometry in
+    ``traces`` is expensive to compute, so the record keeps the
+    processed DATA channels and base centers, and only runs
+    ``tracify`` the first time ``traces`` is accessed. Fields which
+    were not decoded are ``None``.
+
+    For compatibility with code written against the old dictionary
+    return value of ``read``, decoded fields can also be fetched as
+    ``record['sequence']``, and so on.
+    """
+    __slots__ = ('sequence', 'confidences', '_channels', '_centers', '_traces')
+    def __init__(self, sequence=None, confidences=None, channels=None,
+                 centers=None, traces=None):
+        self.sequence = sequence
+        self.confidences = confidences
+        self._channels = channels
+        self._centers = centers
+        self._traces = traces
+    @property
+    def traces(self):
+        if self._traces is None and self._channels is not None:
+            self._traces = tracify(centers=self._centers, **self._channels)
+            self._channels = self._centers = None
+        return self._traces
+    def hastraces(self):
+        """Are traces available, computed or not?"""
+        return self._traces is not None or self._channels is not None
+    def keys(self):
+        """Return the names of the decoded fields."""
+        return [f for f in all_fields if f in self]
+    def __contains__(self, key):
+        if key == 'traces':
+            return self.hastraces()
+        else:
+            return key in all_fields and getattr(self, key) is not None
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    def __repr__(self):
+        return 'AB1Record(%s)' % ', '.join(self.keys())
+    def __getstate__(self):
+        # Confidences go over the wire as one int8 array rather than a
+        # list of ints, so a pickled record is a handful of buffers.
+        confidences = self.confidences
+        if confidences is not None:
+            confidences = numpy.asarray(confidences, dtype=numpy.int8)
+        return (self.sequence, confidences, self._channels, self._centers,
+                self._traces)
+    def __setstate__(self, state):
+        self.sequence, confidences, self._channels, self._centers, \
+            self._traces = state
+        self.confidences = confidences.tolist() if confidences is not None else None
+
+def _check_fields(fields):
+    # Return fields as a tuple in the order of all_fields, or raise
+    # ValueError for any field we don't know.
+    for f in fields:
+        if f not in all_fields:
+            raise ValueError("Unknown field %s: must be one of %s" % \
+                                 (repr(f), ', '.join(all_fields)))
+    return tuple(f for f in all_fields if f in fields)
+
+def read(source, fields=all_fields):
+    """Read an AB1 file from *source*.
+
+    *source* is usually a filename, but may also be the contents of
+    an AB1 file, as a string, bytearray, memoryview, or buffer, or a
+    file object to read to its end. A string is taken to be contents
+    rather than a filename if it starts with the ABIF magic number and
+    contains a NUL byte, which no filename can.
+
+    Returns an AB1Record with the fields 'sequence', 'confidences',
+    and 'traces'. Only the tags needed for the fields listed in
+    *fields* are decoded, so callers which need only bases and
+    confidences should pass ``fields=('sequence', 'confidences')`` to
+    skip the trace channels entirely. Even when they are decoded,
+    traces are not computed until first used.
+    """
+    if not isfilename(source):
+        return decode(contents(source), fields)
+    if iscompressed(source):
+        return decode(decompress(source), fields)
+    buf = _map(source)
+    try:
+        return decode(buf, fields)
+    finally:
+        buf.close()
+
+def isfilename(source):
+    """Is *source*, as passed to ``read``, a filename?"""
+    if isinstance(source, unicode):
+        return True
+    return isinstance(source, str) and not \
+        (source.startswith(b'ABIF') and b'\x00' in source)
+
+def contents(source):
+    """Return a buffer of the AB1 data in *source*, which is not a filename.
+
+    Buffers are returned as they are. File objects are read to their end.
+    """
+    if isinstance(source, (str, bytearray, buffer)):
+        return source
+    elif isinstance(source, memoryview):
+        # NumPy under Python 2 can only take memoryviews through
+        # asarray, which still does not copy.
+        return numpy.asarray(source).reshape(-1).view(numpy.uint8)
+    elif hasattr(source, 'read'):
+        return source.read()
+    else:
+        raise ValueError("Cannot read AB1 data from a %s." % (type(source).__name__,))
+
+# Suffixes of the files read() handles.
+ab1_suffixes = ('.ab1', '.ab1.gz', '.ab1.xz')
+compressed_suffixes = ('.gz', '.xz')
+
+def is_ab1(filename):
+    """Does *filename* name an AB1 file, compressed or not?"""
+    return filename.endswith(ab1_suffixes)
+
+def iscompressed(filename):
+    """Does *filename* name a compressed file?"""
+    return filename.endswith(compressed_suffixes)
+
+def open_compressed(filename, mode='rb'):
+    """Open *filename*, compressing or decompressing if it ends in .gz or .xz.
+
+    .xz files need the lzma module, from backports.lzma under Python 2.
+    """
+    if filename.endswith('.gz'):
+        return gzip.GzipFile(filename, mode)
+    elif filename.endswith('.xz'):
+        if lzma is None:
+            raise ValueError("Cannot open %s: .xz files need the lzma module." % (filename,))
+        return lzma.LZMAFile(filename, mode)
+    else:
+        return open(filename, mode)
+
+def decompress(filename):
+    """Return the decompressed contents of the compressed file *filename*."""
+    try:
+        h = open_compressed(filename)
+    except IOError:
         raise ValueError("Failed to open file %s" % filename)
+    try:
+        return h.read()
+    except (IOError, EOFError) as e:
+        raise ValueError("Failed to decompress %s: %s" % (filename, e))
+    except Exception as e:
+        if lzma is not None and isinstance(e, lzma.LZMAError):
+            raise ValueError("Failed to decompress %s: %s" % (filename, e))
+        raise
+    finally:
+        h.close()
 
-    cdef char* magic_number = b'0000'
-    fread(magic_number, 4, 1, p)
-    if magic_number != b'ABIF':
-        raise ValueError("Not a valid ABI file: bad magic number.")
-
-    host_version = fread_short(p)
-    if host_version < 100 or host_version > 199:
-        raise ValueError("ABI file version not supported by this library.")
-
-    td = fread_direntry(p)
-    assert td.name[:4] == b'tdir'.encode()
-    assert td.number == 1
-    assert td.elementtype == 1023
-    assert td.elementsize == 28
-    
-    # Find the entries for eight fields: FWO_ to give base order, the
-    # last four DATA fields of 12, PBAS for basis, PLOC for ceners,
-    # and PCON for confidences.
-    
-    fseek(p, td.dataoffset, SEEK_SET)
-    entries = {}
-    cdef short data_index = 0, pbas_index = 0, pcon_index = 0, ploc_index = 0
-    cdef int i, j
-    cdef char ctmp
-    cdef long return_to
-    cdef numpy.ndarray bases_array, confidences, centers
-    cdef str bases
-    data = []
-    raw_data = []
-    processed_data = []
-    cdef int c, q
-    for i in range(td.numelements):
-        d = fread_direntry(p)
-        name = d.name[:4]
-        if name == b'PBAS':
-            if pbas_index == 1: # We want the second entry, the BaseCaller's entry
-                bases_array = fread_byte_array_at(p, d.numelements, d.dataoffset)
-                bases = ''.join(chr(x) for x in bases_array)
-            pbas_index += 1
-        if name == b'PCON':
-            if pcon_index == 1:
-                confidences = fread_byte_array_at(p, d.numelements, d.dataoffset)
-            pcon_index += 1
-        if name == b'PLOC':
-            if ploc_index == 1:
-                centers = fread_short_array_at(p, d.numelements, d.dataoffset)
-            ploc_index += 1
-        if name == b'FWO_':
-            base_order = []
-            for q,sh in enumerate([24, 16, 8, 0]):
-                c = 255 & (d.dataoffset >> sh)
-                base_order.append((chr(c), q))
-            base_order = dict(base_order)
-        if name == b'DATA':
-            if data_index < 4:
-                raw_data.append(fread_short_array_at(p, d.numelements, d.dataoffset))
-            elif data_index < 8:
-                pass
-            else:
-                data.append(fread_short_array_at(p, d.numelements, d.dataoffset))
-                processed_data.append(fread_short_array_at(p, d.numelements, d.dataoffset))
-            data_index += 1
-
-    # confidences and bases are numpy arrays
-    traces = tracify(A=data[base_order['A']],
-                     C=data[base_order['C']],
-                     T=data[base_order['T']],
-                     G=data[base_order['G']],
-                     centers=centers)
-    val = {'sequence': bases,
-           'confidences': [int(x) for x in confidences],
-           'traces': traces}
-    return val
+def compress(filename, target):
+    """Write a compressed copy of *filename* to *target*.
+
+    The compression is chosen by the suffix of *target*, .gz or .xz.
+    """
+    if not iscompressed(target):
+        raise ValueError("Don't know how to compress to %s" % (target,))
+    try:
+        with open(filename, 'rb') as src:
+            out = open_compressed(target, 'wb')
+            try:
+                shutil.copyfileobj(src, out)
+            finally:
+                out.close()
+    except:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+
+def _map(filename):
+    # Return a read only mmap of filename.
+    try:
+        h = open(filename, 'rb')
+    except IOError:
+        raise ValueError("Failed to open file %s" % filename)
+    with h:
+        # mmap refuses empty files, which are simply not ABIF.
+        if os.fstat(h.fileno()).st_size == 0:
+            raise ValueError(walk_errors[BAD_MAGIC])
+        return mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+
+def default_cache():
+    """Return the DiskCache of parsed AB1 files, or None if caching is off.
+
+    The cache lives in the ``ab1`` directory under
+    ``diskcache.cache_root()``. Caching is off unless a cache
+    directory has been configured.
+    """
+    return diskcache.named_cache('ab1', suffix='.npz')
+
+def cached_read(filename, fields=all_fields, cache=None):
+    """Read the AB1 file *filename* as ``read`` does, through a cache.
+
+    *cache* is a DiskCache, by default ``default_cache()``. Entries
+    are keyed by the absolute path of *filename* and *fields*, and are
+    only used while the file's inode, size, and mtime are unchanged.
+    Traces are computed before they are stored, so a hit skips
+    tracify as well as decoding. If *filename* is not a filename but
+    something else ``read`` accepts, it is read without the cache.
+    """
+    fields = _check_fields(fields)
+    if cache is None:
+        cache = default_cache()
+    if cache is None or not isfilename(filename):
+        return read(filename, fields)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        raise ValueError("Failed to open file %s" % filename)
+    stamp = '%d:%d:%r' % (st.st_ino, st.st_size, st.st_mtime)
+    key = '%s:%s' % (os.path.abspath(filename), ','.join(fields))
+    record = cache.get(key, lambda f: _load_record(f, stamp))
+    if record is None:
+        record = read(filename, fields)
+        record.traces
+        cache.put(key, lambda h: _save_record(h, record, stamp))
+    return record
+
+def _save_record(handle, record, stamp):
+    arrays = {'stamp': numpy.array(stamp)}
+    if record.sequence is not None:
+        arrays['sequence'] = numpy.array(record.sequence)
+    if record.confidences is not None:
+        arrays['confidences'] = numpy.array(record.confidences, dtype=numpy.int8)
+    if record.traces is not None:
+        arrays['points'] = record.traces.points
+        arrays['offsets'] = record.traces.offsets
+    numpy.savez(handle, **arrays)
 
+def _load_record(filename, stamp):
+    # Returns None if the entry is for another version of the file.
+    with numpy.load(filename, allow_pickle=False) as npz:
+        if npz['stamp'][()] != stamp:
+            return None
+        record = AB1Record()
+        if 'sequence' in npz.files:
+            record.sequence = npz['sequence'][()]
+        if 'confidences' in npz.files:
+            record.confidences = npz['confidences'].tolist()
+        if 'points' in npz.files:
+            record._traces = TraceArray(npz['points'], npz['offsets'])
+        return record
+
+def _read_computed(args):
+    # Worker for read_many. Traces are computed here, in the worker,
+    # since that is most of the cost of reading a file.
+    filename, fields, cache = args
+    if cache is not None:
+        r = cached_read(filename, fields, cache)
+    else:
+        r = read(filename, fields)
+    r.traces
+    return filename, r
+
+def read_many(filenames, fields=all_fields, workers=None, threads=False,
+              cache=None):
+    """Read the AB1 files *filenames* across *workers* processes.
+
+    Yields (filename, record) pairs in the order the files finish, not
+    the order given. *fields* is as for ``read``, but traces are
+    computed eagerly in the workers. *workers* defaults to the number
+    of CPUs. With one worker, files are read in this process.
+    Records come back from the workers as a few NumPy buffers each
+    (see ``AB1Record.__getstate__``), not as lists of Python objects.
+    An error reading any file is raised here, ending the iteration.
+
+    If *threads* is set, the workers are threads in this process
+    instead. Decoding and tracify release the GIL for their heavy
+    lifting, so this avoids forking and pickling for small batches
+    or inside a long running daemon.
+
+    If *cache* is a DiskCache, files are read through it with
+    ``cached_read``. The hit and miss counts of *cache* are only
+    updated when using threads.
+    """
+    fields = _check_fields(fields)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers < 1:
+        raise ValueError("workers must be at least 1, got %d" % (workers,))
+    tasks = [(f, fields, cache) for f in filenames]
+    if workers == 1 or len(tasks) <= 1:
+        for t in tasks:
+            yield _read_computed(t)
+        return
+    if threads:
+        pool = multiprocessing.pool.ThreadPool(min(workers, len(tasks)))
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+    # Pool.terminate can deadlock under Python 2, so even on errors
+    # the pool is closed and left to finish the tasks it has.
+    try:
+        for result in pool.imap_unordered(_read_computed, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def decode(buf, fields=all_fields):
+    """Decode *fields* of the ABIF file contained in the buffer *buf*.
+
+    The directory walk and the extraction of the trace channels run
+    without the GIL. Python objects are only built once they are
+    done, so several threads can decode files at once.
+    """
+    _check_fields(fields)
+    if len(buf) < 6 + ENTRY_SIZE:
+        raise ValueError(walk_errors[BAD_MAGIC])
+    view = numpy.frombuffer(buf, dtype=numpy.uint8)
+    cdef const unsigned char[:] b = view
+    cdef Span spans[NSPANS]
+    cdef bint traces = 'traces' in fields
+    cdef int err
+    cdef short[:] cv, d0, d1, d2, d3
+    with nogil:
+        err = walk(b, traces, spans)
+    if err != OK:
+        raise ValueError(walk_errors[err])
+    wanted = [PBAS_SPAN] if 'sequence' in fields else []
+    wanted += [PCON_SPAN] if 'confidences' in fields else []
+    wanted += range(PLOC_SPAN, NSPANS) if traces else []
+    for k in wanted:
+        if spans[k].count < 0:
+            raise ValueError("Not a valid ABI file: no %s entry." % (span_tags[k],))
+
+    record = AB1Record()
+    if 'sequence' in fields:
+        o, c = spans[PBAS_SPAN].offset, spans[PBAS_SPAN].count
+        record.sequence = view[o:o+c].tostring()
+    if 'confidences' in fields:
+        o, c = spans[PCON_SPAN].offset, spans[PCON_SPAN].count
+        record.confidences = view[o:o+c].view(numpy.int8).tolist()
+    if traces:
+        o, c = spans[FWO_SPAN].offset, spans[FWO_SPAN].count
+        base_order = view[o:o+c].tostring()
+        centers = numpy.empty(spans[PLOC_SPAN].count, dtype=numpy.int16)
+        data = [numpy.empty(spans[DATA_SPAN+k].count, dtype=numpy.int16)
+                for k in range(4)]
+        cv, d0, d1, d2, d3 = centers, data[0], data[1], data[2], data[3]
+        with nogil:
+            copy_be16(b, spans[PLOC_SPAN].offset, cv)
+            copy_be16(b, spans[DATA_SPAN].offset, d0)
+            copy_be16(b, spans[DATA_SPAN+1].offset, d1)
+            copy_be16(b, spans[DATA_SPAN+2].offset, d2)
+            copy_be16(b, spans[DATA_SPAN+3].offset, d3)
+        record._centers = centers
+        record._channels = dict(zip(base_order, data))
+    return record
+
+direntry = numpy.dtype([('name', 'S4'),
+                        ('number', '>i4'),
+                        ('elementtype', '>i2'),
+                        ('elementsize', '>i2'),
+                        ('numelements', '>i4'),
+                        ('datasize', '>i4'),
+                        ('dataoffset', '>i4'),
+                        ('datahandle', '>i4')])
+
+DirEntry = collections.namedtuple('DirEntry', ['name', 'number', 'elementtype',
+                                               'elementsize', 'numelements',
+                                               'datasize', 'offset'])
+
+# Entries with at most this many bytes of data are read into an
+# AB1Index. That covers every scalar and string tag, but none of the
+# arrays.
+index_max_datasize = 256
+
+def index(source):
+    """Read the tag directory of the AB1 file *source*.
+
+    *source* is a filename, or anything else ``read`` accepts.
+    Returns an AB1Index. Only the header, the directory, and the data
+    of small entries are read, so indexing a file never touches its
+    bases or trace channels. Compressed files have to be decompressed
+    whole, so lose most of that advantage.
+    """
+    if not isfilename(source):
+        return decode_index(contents(source))
+    if iscompressed(source):
+        return decode_index(decompress(source))
+    buf = _map(source)
+    try:
+        return decode_index(buf)
+    finally:
+        buf.close()
+
+def decode_index(buf):
+    """Read the tag directory of the ABIF file contained in the buffer *buf*."""
+    if len(buf) < 6 + ENTRY_SIZE:
+        raise ValueError(walk_errors[BAD_MAGIC])
+    view = numpy.frombuffer(buf, dtype=numpy.uint8)
+    cdef const unsigned char[:] b = view
+    cdef Py_ssize_t nentries, diroffset
+    cdef int err = check_header(b, &nentries, &diroffset)
+    if err != OK:
+        raise ValueError(walk_errors[err])
+    rows = numpy.frombuffer(buf, dtype=direntry, count=nentries, offset=diroffset)
+    entries = []
+    data = {}
+    for i, row in enumerate(rows.tolist()):
+        name, number, elementtype, elementsize, numelements, datasize, offset, _ = row
+        if datasize <= 4:
+            offset = diroffset + i*ENTRY_SIZE + 20
+        entry = DirEntry(name, number, elementtype, elementsize, numelements,
+                         datasize, offset)
+        entries.append(entry)
+        if 0 <= datasize <= index_max_datasize and 0 <= offset <= len(buf) - datasize:
+            data[(name, number)] = (entry, view[offset:offset+datasize].tostring())
+    return AB1Index(entries, data)
+
+# NumPy types of the numeric ABIF element types.
+element_dtypes = {1: '>u1', 3: '>u2', 4: '>i2', 5: '>i4', 7: '>f4', 8: '>f8'}
+
+def decode_element(elementtype, numelements, raw):
+    """Decode the bytes *raw* of an entry with *elementtype*.
+
+    Numbers come back as Python numbers, or lists of them if there is
+    more than one. Dates (type 10) and times (type 11) come back as
+    ``datetime.date`` and ``datetime.time``, chars (2) and strings
+    (18 and 19) as strings. Other types are returned as raw bytes.
+    """
+    if elementtype in element_dtypes:
+        values = numpy.frombuffer(raw, dtype=element_dtypes[elementtype],
+                                  count=numelements).tolist()
+        return values[0] if numelements == 1 else values
+    elif elementtype == 2:
+        return raw
+    elif elementtype == 10:
+        year, month, day = struct.unpack('>hBB', raw[:4])
+        return datetime.date(year, month, day)
+    elif elementtype == 11:
+        hour, minute, second, hundredths = struct.unpack('>BBBB', raw[:4])
+        return datetime.time(hour, minute, second, hundredths*10000)
+    elif elementtype == 18:
+        return raw[1:1+ord(raw[0])] if raw else ''
+    elif elementtype == 19:
+        return raw.split('\x00', 1)[0]
+    else:
+        return raw
+
+class AB1Index(object):
+    """The tag directory of an AB1 file.
+
+    ``entries`` is a list of DirEntry giving the name, number, type,
+    and data offset of every entry in the file, in directory order.
+    The data of entries no bigger than ``index_max_datasize`` bytes
+    is kept, and can be decoded with ``value``. The properties
+    ``sample_name``, ``well``, ``run_start``, ``run_stop``,
+    ``instrument``, and ``model`` give common metadata, or ``None`` if
+    the file lacks it.
+    """
+    __slots__ = ('entries', '_data')
+    def __init__(self, entries, data):
+        self.entries = entries
+        self._data = data
+    def __len__(self):
+        return len(self.entries)
+    def __contains__(self, key):
+        name, number = key
+        return any(e.name == name and e.number == number for e in self.entries)
+    def entry(self, name, number=1):
+        """Return the DirEntry of tag *name* with *number*."""
+        for e in self.entries:
+            if e.name == name and e.number == number:
+                return e
+        raise KeyError((name, number))
+    def value(self, name, number=1):
+        """Return the decoded data of tag *name* with *number*.
+
+        Raises KeyError if there is no such entry, and ValueError if
+        its data is too large to have been kept in the index.
+        """
+        if (name, number) not in self._data:
+            e = self.entry(name, number)
+            raise ValueError("Entry %s %d has %d bytes of data, too many to index." % \
+                                 (name, number, e.datasize))
+        e, raw = self._data[(name, number)]
+        return decode_element(e.elementtype, e.numelements, raw)
+    def get(self, name, number=1, default=None):
+        """Return ``value(name, number)``, or *default* if there is no such entry."""
+        try:
+            return self.value(name, number)
+        except KeyError:
+            return default
+    def _timestamp(self, number):
+        date, time = self.get('RUND', number), self.get('RUNT', number)
+        if date is None or time is None:
+            return None
+        return datetime.datetime.combine(date, time)
+    @property
+    def sample_name(self):
+        return self.get('SMPL')
+    @property
+    def well(self):
+        return self.get('TUBE')
+    @property
+    def run_start(self):
+        return self._timestamp(1)
+    @property
+    def run_stop(self):
+        return self._timestamp(2)
+    @property
+    def instrument(self):
+        return self.get('MCHN')
+    @property
+    def model(self):
+        return self.get('MODL')
+    def __repr__(self):
+        return 'AB1Index(%d entries)' % (len(self.entries),)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def tracify(A, C, T, G, centers):
     assert len(A) == len(C) 
     assert len(A) == len(T)
     assert len(A) == len(G)
     assert len(A) > 0
     assert len(centers) > 0
-    assert all(centers >= 0) and all(centers < len(A)) and all(sorted(centers) == centers)
-    # Left and right limits of each base
-    _limits = [int(numpy.ceil((centers[i]+centers[i-1])/2.0))
-               for i in range(1, len(centers))]
-    limits = zip([0] + _limits, [x+1 for x in _limits] + [len(A)])
-
-    maxima = numpy.array(sorted([max(numpy.concatenate([A[i:j],C[i:j],T[i:j],G[i:j]]))
-                                 for i,j in limits]))
+    centers = numpy.asarray(centers, dtype=numpy.int_)
+    assert (centers >= 0).all() and (centers < len(A)).all() and \
+        (numpy.diff(centers) >= 0).all()
+    # Everything is allocated up front so that the rest of the work
+    # can run without the GIL. Neighboring windows share the sample on
+    # their boundary, so the windows cover n + nwindows - 1 samples.
+    scaled = numpy.vstack([A, C, T, G]).astype(numpy.float64)
+    cdef Py_ssize_t n = scaled.shape[1], nwindows = len(centers), m
+    lefts = numpy.empty(nwindows, dtype=numpy.int_)
+    rights = numpy.empty(nwindows, dtype=numpy.int_)
+    points = numpy.empty(((n + nwindows - 1) * 4, 2), dtype=numpy.float32)
+    offsets = numpy.zeros(nwindows*4 + 1, dtype=numpy.int_)
+    cdef long[:] cv = centers, lv = lefts, rv = rights, ov = offsets
+    cdef double[:, ::1] sv = scaled
+    cdef double[:] maxima = numpy.empty(nwindows, dtype=numpy.float64)
+    cdef double[:] xs = numpy.empty(n, dtype=numpy.float64)
+    cdef float[:, ::1] pv = points
+    with nogil:
+        # Left and right limits of each base, at the ceiling of the
+        # midpoint between neighboring centers.
+        lv[0] = 0
+        for m in range(1, nwindows):
+            lv[m] = (cv[m-1] + cv[m] + 1) // 2
+            rv[m-1] = lv[m] + 1
+        rv[nwindows-1] = n
+        normalize(sv, lv, rv, maxima)
+        m = sparsify_windows_into(sv, lv, rv, xs, pv, ov)
+    return TraceArray(points[:m].copy(), offsets)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef double normalize(double[:, ::1] channels, long[:] lefts, long[:] rights,
+                      double[:] maxima) noexcept nogil:
+    # Scale channels in place to 1 - raw/rmax, with rmax chosen by
+    # cutoff from the maximum of each window across all channels.
+    # maxima is scratch space with room for one value per window.
+    cdef Py_ssize_t i, j, c, nrows = channels.shape[0], n = channels.shape[1]
+    cdef double mx, rmax
+    for i in range(lefts.shape[0]):
+        mx = channels[0, lefts[i]]
+        for j in range(lefts[i], rights[i]):
+            for c in range(nrows):
+                if channels[c, j] > mx:
+                    mx = channels[c, j]
+        maxima[i] = mx
+    qsort(&maxima[0], maxima.shape[0], sizeof(double), compare_doubles)
     rmax = cutoff(maxima)
-    result = []
-    for l,r in limits:
-        xs = numpy.arange(0, r-l) / float(r-l-1)
-        assert len(xs) == len(A[l:r]) == len(C[l:r]) \
-            == len(T[l:r]) == len(G[l:r])
-        result.append({'A': sparsify(xs, 1-A[l:r]/rmax), 
-                       'C': sparsify(xs, 1-C[l:r]/rmax),
-                       'T': sparsify(xs, 1-T[l:r]/rmax),
-                       'G': sparsify(xs, 1-G[l:r]/rmax)})
-    return result
-
-cdef list sparsify(numpy.ndarray xs, numpy.ndarray ys):
-    cdef double Lx, Ly, Rx, Ry, nextx, nexty
-    new_points = [(xs[0], ys[0])]
-    i = 0
-    while i < len(ys)-1:
-        Lx, Ly, Rx, Ry = xs[i], ys[i], xs[i+1], ys[i+1]
-        skipped = []
-        while i < len(ys)-2 and len(skipped) < 10:
-            nextx, nexty = xs[i+2], ys[i+2]
-            if all([close_enough(Lx,Ly, nextx,nexty, px,py)
-                    for px,py in skipped + [(Rx,Ry)]]):
-                skipped += [(Rx,Ry)]
-                Rx,Ry = nextx,nexty
+    for c in range(nrows):
+        for j in range(n):
+            channels[c, j] = 1 - channels[c, j] / rmax
+    return rmax
+
+cdef int compare_doubles(const void* a, const void* b) noexcept nogil:
+    cdef double x = (<const double*>a)[0], y = (<const double*>b)[0]
+    return (x > y) - (x < y)
+
+def sparsify(xs, ys):
+    """Simplify the polyline through *xs* and *ys*.
+
+    Returns a float32 array of shape (n,2) of the (x,y) points kept.
+    Runs of points close enough (see ``close_enough``) to the line
+    between the points on either side of them are dropped, up to ten
+    points at a time.
+    """
+    cdef double[:] xv = numpy.asarray(xs, dtype=numpy.float64)
+    cdef double[:] yv = numpy.asarray(ys, dtype=numpy.float64)
+    assert xv.shape[0] == yv.shape[0]
+    out = numpy.empty((xv.shape[0], 2), dtype=numpy.float32)
+    cdef float[:, ::1] outv = out
+    cdef Py_ssize_t m
+    with nogil:
+        m = sparsify_into(xv, yv, outv)
+    return out[:m].copy()
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sparsify_windows(scaled, lefts, rights):
+    """Sparsify every row of *scaled* over every window.
+
+    *scaled* is a 2D array with one channel per row, and window i
+    covers the columns [lefts[i], rights[i]), with x running from 0 to
+    1 across the window. Returns a float32 array of (x,y) points and an
+    array of offsets into it, so the points of window i in row c are
+    ``points[offsets[i*nrows+c]:offsets[i*nrows+c+1]]``.
+    """
+    cdef double[:, :] sv = numpy.asarray(scaled, dtype=numpy.float64)
+    cdef long[:] lv = numpy.asarray(lefts, dtype=numpy.int_)
+    cdef long[:] rv = numpy.asarray(rights, dtype=numpy.int_)
+    cdef Py_ssize_t nrows = sv.shape[0], nwindows = lv.shape[0], m
+    widths = numpy.asarray(rights) - numpy.asarray(lefts)
+    cdef double[:] xs = numpy.empty(max(widths.max(), 1) if nwindows else 1,
+                                    dtype=numpy.float64)
+    points = numpy.empty((max(widths.sum() * nrows, 1), 2), dtype=numpy.float32)
+    offsets = numpy.zeros(nwindows*nrows + 1, dtype=numpy.int_)
+    cdef float[:, ::1] pv = points
+    cdef long[:] ov = offsets
+    with nogil:
+        m = sparsify_windows_into(sv, lv, rv, xs, pv, ov)
+    return points[:m].copy(), offsets
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t sparsify_windows_into(double[:, :] sv, long[:] lv, long[:] rv,
+                                      double[:] xs, float[:, ::1] pv,
+                                      long[:] ov) noexcept nogil:
+    # The work of sparsify_windows, writing to pv and ov. xs is
+    # scratch space as long as the widest window. Returns the number
+    # of points written.
+    cdef Py_ssize_t nrows = sv.shape[0], i, c, k, w, m = 0
+    for i in range(lv.shape[0]):
+        w = rv[i] - lv[i]
+        if w == 1:
+            # Equal adjacent peak centers give a window of one column.
+            xs[0] = 0
+        else:
+            for k in range(w):
+                xs[k] = k / <double>(w-1)
+        for c in range(nrows):
+            m += sparsify_into(xs[:w], sv[c, lv[i]:rv[i]], pv[m:])
+            ov[i*nrows + c + 1] = m
+    return m
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t sparsify_into(double[:] xs, double[:] ys, float[:, ::1] out) noexcept nogil:
+    # Write the points of xs,ys which sparsify keeps to out, and
+    # return how many there are. out must have room for all of them.
+    cdef Py_ssize_t n = ys.shape[0], m, i = 0, start, j
+    cdef bint ok
+    if n == 0:
+        return 0
+    out[0,0] = xs[0]
+    out[0,1] = ys[0]
+    m = 1
+    while i < n-1:
+        # The segment runs from point start, the last point kept, to
+        # point i+1. Points start+1 through i have been skipped.
+        start = i
+        while i < n-2 and i - start < 10:
+            ok = True
+            for j in range(start+1, i+2):
+                if not close_enough(xs[start], ys[start], xs[i+2], ys[i+2], xs[j], ys[j]):
+                    ok = False
+                    break
+            if ok:
                 i += 1
             else:
                 break
-        new_points.append((Rx,Ry))
+        out[m,0] = xs[i+1]
+        out[m,1] = ys[i+1]
+        m += 1
         i += 1
-    return new_points
-
+    return m
 
-cdef bint close_enough(double Lx, double Ly, double Rx, double Ry, double px, double py):
+@cython.cdivision(True)
+cdef bint close_enough(double Lx, double Ly, double Rx, double Ry, double px, double py) noexcept nogil:
     """Is px,py close enough to the line given by L and R to be approximated by it?"""
     # Find the vertical distance of px,py from the line through Lx,Ly
     # and Rx,Ry.  px,py is defined to be "close enough" if it no more
@@ -199,39 +864,50 @@ cdef bint close_enough(double Lx, double Ly, double Rx, double Ry, double px, do
     # output by eye and taking the highest value that left the curves
     # still looking reasonably smooth.
     cdef double alpha = 0.005
-    return abs(py - ((Ry-Ly)/float(Rx-Lx))*(px-Lx) - Ly) < alpha * (Ly + Ry)/2.0
-
+    return fabs(py - ((Ry-Ly)/(Rx-Lx))*(px-Lx) - Ly) < alpha * (Ly + Ry)/2.0
 
 
-
-cdef double cutoff(numpy.ndarray xs):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double cutoff(double[:] xs) noexcept nogil:
     # Calculate the scaling factor, so that
     #     scaled = raw / rmax
     # Ideally 0.25 <= scaled <= 1, but that is not in general possible
     # with one degree of freedom. Instead, we will take the largest
     # rmax such that P(scaled < 0.25) = P(scaled > 1).
     # Assume xs is already sorted ascending.
-    cdef double ratio = 1/8.0
-    cdef double righti = -1
-    cdef double rmax = xs[righti]
-    cdef double lefti = 0
-    while xs[lefti] < rmax*ratio:
-        lefti += 1
-    while lefti > -righti:
-        righti -= 1
-        rmax = xs[righti]
-        while xs[lefti] > rmax*ratio:
-            lefti -= 1
-    return rmax
+    cdef double ratio = 1/8.0, threshold
+    cdef Py_ssize_t n = xs.shape[0], k, left, lowest = n
+    # Trying rmax = xs[-k] for k = 1, 2, ..., left is the index of the
+    # largest value at or below rmax*ratio, except for k = 1, where it
+    # is the number of values strictly below it. Since the thresholds
+    # only shrink, the index can never move back up. Take the first k
+    # with no more values below the threshold than above rmax.
+    for k in range(1, n+1):
+        threshold = xs[n-k] * ratio
+        if k == 1:
+            left = bisect(xs, threshold, False)
+        else:
+            left = bisect(xs, threshold, True) - 1
+        if left < lowest:
+            lowest = left
+        if lowest <= k:
+            return xs[n-k]
+    return xs[0]
 
-def psparsify(xs, ys):
-    return sparsify(xs, ys)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t bisect(double[:] xs, double x, bint right) noexcept nogil:
+    # Index to insert x at in the sorted xs, after any equal values
+    # if right is set, before them otherwise.
+    cdef Py_ssize_t lo = 0, hi = xs.shape[0], mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if xs[mid] < x or (right and xs[mid] == x):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
 def pcutoff(vals):
-    return cutoff(vals)
-    
-
-
-
-
-    
+    return cutoff(numpy.asarray(vals, dtype=numpy.float64))
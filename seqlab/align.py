@@ -1,17 +1,26 @@
 """
-fasta.py - Module to run and parse FASTA alignment
+align.py - Module to run and parse FASTA alignment
 
-This module only binds the ssearch36 program, which does pairwise,
-global alignment with Smith-Waterman.
+This module binds the ssearch36 program, which does pairwise, local
+alignment with Smith-Waterman, and the same alignment done in process
+by swalign. Callers should use align(), which runs whichever aligner
+is configured. Results are kept in a disk cache, so aligning the same
+pair again is a lookup.
 """
 import re
 import os
+import json
 import shutil
 import tempfile
 import subprocess
+import time
 import contextlib
+import collections
+import multiprocessing
 import Bio.SeqIO
 import Bio.Seq
+import swalign
+import diskcache
 
 @contextlib.contextmanager
 def as_fasta(seq, tmpdir=None, label='sequence'):
@@ -32,20 +41,264 @@ def as_fasta(seq, tmpdir=None, label='sequence'):
     finally:
         os.unlink(db_name)
 
+def write_fasta(records, tmpdir=None):
+    """Write *records*, a list of (label, seq), to a new temporary FASTA file.
+
+    Returns the file's name. The caller must delete it.
+    """
+    (db_fd, db_name) = tempfile.mkstemp(text=True, dir=tmpdir)
+    with os.fdopen(db_fd, 'w') as db_handle:
+        Bio.SeqIO.write([Bio.SeqIO.SeqRecord(id=label, seq=Bio.Seq.Seq(seq))
+                         for label, seq in records], db_handle, 'fasta')
+    return db_name
+
 def ssearch36(seq1, seq2, ssearch36_path="ssearch36", tmpdir='/tmp'):
     if len(seq1) == 0:
         return (0, ''), (0, seq2)
     if len(seq2) == 0:
         return (0, seq1), (0, '')
     with as_fasta(seq1, tmpdir) as fasta1, as_fasta(seq2, tmpdir) as fasta2:
-        command = ' '.join([ssearch36_path, '-a', '-d','1','-m','10', fasta1, fasta2])
-        pipe = subprocess.Popen(str(command), shell=True, 
-                                stdout=subprocess.PIPE)
+        try:
+            pipe = subprocess.Popen([ssearch36_path, '-a', '-d', '1', '-m', '10', fasta1, fasta2],
+                                    stdout=subprocess.PIPE)
+        except OSError, e:
+            raise ValueError("Could not run %s: %s" % (ssearch36_path, e))
         (alignment, _) = pipe.communicate()
         res = parse_ssearch36m10(alignment)
         return res
 
 
+def ssearch36_batch(pairs, ssearch36_path="ssearch36", tmpdir='/tmp',
+                    workers=None, timeout=None):
+    """Align every (seq1, seq2) in *pairs* as ssearch36 would.
+
+    Returns a list of results in the same order as *pairs*. Rather
+    than one run of ssearch36 per pair, pairs sharing a sequence are
+    aligned in one run, with the shared sequence as the library and
+    the others written to one query file. Pairs are grouped on
+    whichever side has fewer distinct sequences, so adding many
+    sequences to one contig is a single run. At most *workers* runs,
+    by default the number of CPUs, go at once. Runs taking more than
+    *timeout* seconds are killed, and a ValueError is raised.
+    """
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    todo = []
+    for k, (seq1, seq2) in enumerate(pairs):
+        if len(seq1) == 0 or len(seq2) == 0:
+            results[k] = ssearch36(seq1, seq2)
+        else:
+            todo.append(k)
+    # ssearch36 puts the query first in its output, so if the pairs
+    # are grouped on seq1, each result is swapped back.
+    swap = len(set(pairs[k][0] for k in todo)) < len(set(pairs[k][1] for k in todo))
+    groups = collections.OrderedDict()
+    for k in todo:
+        query, library = pairs[k][::-1] if swap else pairs[k]
+        groups.setdefault(library, []).append((k, query))
+    pool = AlignmentPool(workers, timeout, ssearch36_path=ssearch36_path, tmpdir=tmpdir)
+    jobs = [(members, pool.submit_group([q for _, q in members], library))
+            for library, members in groups.iteritems()]
+    pool.wait()
+    for members, job in jobs:
+        for (k, _), result in zip(members, job.result()):
+            results[k] = result[::-1] if swap else result
+    return results
+
+
+class AlignmentJob(object):
+    """A run of ssearch36 aligning *queries* against *library*.
+
+    Jobs are made by AlignmentPool, which starts and finishes them.
+    ``done()`` says whether it has finished, and ``result()`` then
+    gives the alignments, or raises the ValueError the job failed
+    with, for instance because it ran past its timeout.
+    """
+    def __init__(self, queries, library, timeout=None, single=False):
+        self.queries = queries
+        self.library = library
+        self.timeout = timeout
+        self.single = single
+        self.results = None
+        self.error = None
+        self.process = None
+        self.deadline = None
+        self.files = []
+        self.output = None
+        # Where the pool saves the result when the job finishes, if
+        # it was made by submit().
+        self.cache = None
+        self.key = None
+
+    def done(self):
+        return self.results is not None or self.error is not None
+
+    def result(self):
+        """Return the job's alignment, or a list of them for a group.
+
+        Raises ValueError if the job failed or has not finished.
+        """
+        if self.error is not None:
+            raise self.error
+        if self.results is None:
+            raise ValueError("Alignment job has not finished.")
+        return self.results[0] if self.single else self.results
+
+    def __repr__(self):
+        return 'AlignmentJob(%d queries, %s)' % \
+            (len(self.queries), 'done' if self.done() else 'pending')
+
+
+class AlignmentPool(object):
+    """Runs ssearch36 in the background, at most *limit* processes at a time.
+
+    submit() and submit_group() return an AlignmentJob at once,
+    starting its process if fewer than *limit* (by default the number
+    of CPUs) are running and queueing it otherwise. Nothing blocks
+    until wait(). A caller with its own loop, such as a daemon's
+    event loop, calls poll() from it instead, which collects finished
+    processes and starts queued jobs in their place.
+
+    Jobs still running after *timeout* seconds (or the timeout given
+    to submit) are killed and fail with ValueError.
+    """
+    def __init__(self, limit=None, timeout=None, ssearch36_path="ssearch36",
+                 tmpdir='/tmp'):
+        if limit is None:
+            limit = multiprocessing.cpu_count()
+        if limit < 1:
+            raise ValueError("limit must be at least 1, got %d" % (limit,))
+        self.limit = limit
+        self.timeout = timeout
+        self.ssearch36_path = ssearch36_path
+        self.tmpdir = tmpdir
+        self.running = []
+        self.queued = collections.deque()
+
+    def submit(self, seq1, seq2, timeout=None):
+        """Start aligning *seq1* and *seq2*. The job's result is as from ssearch36."""
+        job = AlignmentJob([seq1], seq2, timeout, single=True)
+        if len(seq1) == 0 or len(seq2) == 0:
+            job.results = [ssearch36(seq1, seq2)]
+            return job
+        return self._enqueue(job)
+
+    def submit_group(self, queries, library, timeout=None):
+        """Start aligning each sequence in *queries* against *library* in one run.
+
+        The job's result is a list with one alignment per query. None
+        of the sequences may be empty.
+        """
+        return self._enqueue(AlignmentJob(list(queries), library, timeout))
+
+    def _enqueue(self, job):
+        if job.timeout is None:
+            job.timeout = self.timeout
+        self.queued.append(job)
+        self._fill()
+        return job
+
+    def _fill(self):
+        while self.queued and len(self.running) < self.limit:
+            job = self.queued.popleft()
+            try:
+                self._start(job)
+            except (OSError, IOError), e:
+                self._cleanup(job)
+                job.error = ValueError("Could not run %s: %s" % (self.ssearch36_path, e))
+            else:
+                self.running.append(job)
+
+    def _start(self, job):
+        labels = ['q%d' % i for i in range(len(job.queries))]
+        job.files.append(write_fasta(zip(labels, job.queries), self.tmpdir))
+        job.files.append(write_fasta([('library', job.library)], self.tmpdir))
+        # Output goes to a file rather than a pipe, so ssearch36 never
+        # stalls on a full pipe while nobody is reading it.
+        job.output = tempfile.TemporaryFile(dir=self.tmpdir)
+        job.process = subprocess.Popen([self.ssearch36_path, '-a', '-d', '1', '-m', '10'] + job.files,
+                                       stdout=job.output)
+        if job.timeout is not None:
+            job.deadline = time.time() + job.timeout
+
+    def poll(self):
+        """Collect finished jobs and start queued ones without blocking.
+
+        Returns the jobs that finished since the last call.
+        """
+        finished = []
+        now = time.time()
+        for job in list(self.running):
+            if job.process.poll() is not None:
+                self._finish(job)
+                if job.results is not None and job.cache is not None:
+                    job.cache.put(job.key, lambda h: json.dump(job.results[0], h))
+            elif job.deadline is not None and now > job.deadline:
+                job.process.kill()
+                job.process.wait()
+                job.error = ValueError("ssearch36 ran for more than %g seconds" % (job.timeout,))
+            else:
+                continue
+            self.running.remove(job)
+            self._cleanup(job)
+            finished.append(job)
+        self._fill()
+        return finished
+
+    def _finish(self, job):
+        if job.process.returncode != 0:
+            job.error = ValueError("ssearch36 exited with status %d" % (job.process.returncode,))
+            return
+        job.output.seek(0)
+        sections = split_ssearch36m10(job.output.read())
+        results = []
+        for i in range(len(job.queries)):
+            if 'q%d' % i not in sections:
+                job.error = ValueError("ssearch36 gave no alignment for query %d" % (i,))
+                return
+            results.append(parse_ssearch36m10(sections['q%d' % i]))
+        job.results = results
+
+    def _cleanup(self, job):
+        for filename in job.files:
+            os.unlink(filename)
+        job.files = []
+        if job.output is not None:
+            job.output.close()
+            job.output = None
+
+    def wait(self, jobs=None, interval=0.01):
+        """Block until every job in *jobs*, by default every job, is done.
+
+        Polls every *interval* seconds. Returns *jobs*.
+        """
+        if jobs is None:
+            jobs = list(self.running) + list(self.queued)
+        while not all(job.done() for job in jobs):
+            if self.poll() == []:
+                time.sleep(interval)
+        return jobs
+
+
+def split_ssearch36m10(output):
+    """Split the -m 10 output of a multiple query run into one per query.
+
+    Returns a dictionary from query label to the part of *output* for
+    that query, which parse_ssearch36m10 can read.
+    """
+    sections = {}
+    label = None
+    for line in output.split('\n'):
+        if line.startswith('>>>///'):
+            break
+        if line.startswith('>>>') and not line.startswith('>>><<<'):
+            label = re.match(r'>>>([^\s,]*)', line).group(1)
+            sections[label] = []
+        if label is not None:
+            sections[label].append(line)
+    return dict((k, '\n'.join(v)) for k, v in sections.iteritems())
+
+
 def spliton(f, xs):
     i = 0
     while not(f(xs[i])) and i < len(xs):
@@ -68,8 +321,135 @@ def parse_ssearch36m10(alignment):
     gaps, seq2 = spliton(lambda s: s!='-', seq2)
     offset2 = len(gaps)
     return ((offset1,seq1), (offset2,seq2))
-    
 
 
-            
 
+# Aligners by name. Each takes two sequences and returns
+# ((offset1, aligned1), (offset2, aligned2)).
+aligners = {'ssearch36': ssearch36,
+            'smithwaterman': swalign.align,
+            'seeded': swalign.seeded_align}
+default_aligner = 'ssearch36'
+
+# Aligners that can do many pairs at once better than one at a time.
+# Each takes a list of (seq1, seq2) and returns a list of results.
+batch_aligners = {'ssearch36': ssearch36_batch}
+
+def set_default(name):
+    """Make the aligner called *name* the one align() uses.
+
+    This sets module-level state for the whole process. Every later
+    call to align or align_many that does not name an aligner uses
+    it, as does everything built on them, such as contig.assemble and
+    Assembly.add_sequence, including calls from other threads. The
+    subcommands and sequencereportd call this once at startup, from
+    their --aligner option or configuration. Code that only wants
+    one aligner for a few calls should pass *aligner* to align or
+    align_many instead.
+    """
+    global default_aligner
+    if name not in aligners:
+        raise ValueError("No such aligner: %s" % (name,))
+    default_aligner = name
+
+# What each aligner's results depend on besides the two sequences.
+# These are part of the cache key, so changing an aligner's scoring
+# here stops its old results being reused.
+parameters = {'ssearch36': '-a -d 1 -m 10',
+              'smithwaterman': 'match=%d mismatch=%d open=%d extend=%d' % \
+                  (swalign.default_match, swalign.default_mismatch,
+                   swalign.default_gap_open, swalign.default_gap_extend)}
+parameters['seeded'] = parameters['smithwaterman'] + ' k=%d hits=%d band=%d' % \
+    (swalign.default_k, swalign.default_min_hits, swalign.default_band)
+
+def default_cache():
+    """Return the DiskCache of alignments, or None if caching is off.
+
+    The cache lives in the ``align`` directory under
+    ``diskcache.cache_root()``. Caching is off unless a cache
+    directory has been configured.
+    """
+    return diskcache.named_cache('align', suffix='.json')
+
+def align(seq1, seq2, aligner=None, cache=None, timeout=None):
+    """Align *seq1* and *seq2* with *aligner*, or the default aligner.
+
+    Results are looked up in and saved to *cache*, a DiskCache which
+    defaults to ``default_cache()``. *timeout* is as for align_many.
+    """
+    return align_many([(seq1, seq2)], aligner, cache, timeout)[0]
+
+def align_many(pairs, aligner=None, cache=None, timeout=None):
+    """Align every (seq1, seq2) in *pairs*, returning a list of results.
+
+    Pairs found in *cache* (as for align) are not aligned again. The
+    rest are aligned with the batch form of *aligner* if it has one.
+    *timeout* is passed to the batch form, which raises ValueError if
+    an external aligner runs longer than that many seconds. Aligners
+    that run in process have no timeout.
+    """
+    name = _aligner_name(aligner)
+    if cache is None:
+        cache = default_cache()
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    keys = [cache_key(name, seq1, seq2) for seq1, seq2 in pairs]
+    if cache is not None:
+        for k, key in enumerate(keys):
+            results[k] = cache.get(key, _load_alignment)
+    todo = [k for k, r in enumerate(results) if r is None]
+    if name in batch_aligners and todo and (len(todo) > 1 or timeout is not None):
+        aligned = batch_aligners[name]([pairs[k] for k in todo], timeout=timeout)
+    else:
+        aligned = [aligners[name](*pairs[k]) for k in todo]
+    for k, result in zip(todo, aligned):
+        results[k] = result
+        if cache is not None:
+            cache.put(keys[k], lambda h: json.dump(result, h))
+    return results
+
+def submit(pool, seq1, seq2, aligner=None, cache=None, timeout=None):
+    """Start aligning *seq1* and *seq2* in *pool*, returning an AlignmentJob.
+
+    This is align for callers with their own event loop, which poll
+    *pool* until the job is done. *cache* is looked up first, as for
+    align, and aligners that run in process are run at once, so the
+    job may already be done. ssearch36 runs in *pool*, with *timeout*,
+    and its result is saved to *cache* when the pool finishes it.
+    """
+    name = _aligner_name(aligner)
+    if cache is None:
+        cache = default_cache()
+    key = cache_key(name, seq1, seq2)
+    result = cache.get(key, _load_alignment) if cache is not None else None
+    if result is None and name in batch_aligners:
+        job = pool.submit(seq1, seq2, timeout)
+        if not job.done():
+            job.cache, job.key = cache, key
+        return job
+    job = AlignmentJob([seq1], seq2, timeout, single=True)
+    if result is None:
+        result = aligners[name](seq1, seq2)
+        if cache is not None:
+            cache.put(key, lambda h: json.dump(result, h))
+    job.results = [result]
+    return job
+
+def cache_key(aligner, seq1, seq2):
+    """Return the cache key for aligning *seq1* and *seq2* with *aligner*."""
+    if not isinstance(seq1, basestring):
+        seq1 = ''.join(seq1)
+    if not isinstance(seq2, basestring):
+        seq2 = ''.join(seq2)
+    return '%s:%s:%s:%s' % (aligner, parameters[aligner], seq1, seq2)
+
+def _load_alignment(filename):
+    with open(filename) as h:
+        (offset1, seq1), (offset2, seq2) = json.load(h)
+    return (offset1, str(seq1)), (offset2, str(seq2))
+
+def _aligner_name(aligner):
+    name = aligner or default_aligner
+    if name not in aligners:
+        raise ValueError("No such aligner: %s" % (name,))
+    return name
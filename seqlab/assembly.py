@@ -17,9 +17,11 @@ try:
 except:
     from ordereddict import OrderedDict
 import bz2
+import numpy
 import templet
 import ab1
 import align
+from traces import TraceArray
 
 # Utility methods
 def max(a, b):
@@ -154,6 +156,7 @@ neginf = NegInf()
 
 # Intervals
 class Affine(object):
+    __slots__ = ()
     def __init__(self, **kwargs):
         self.metadata = kwargs
     def left(self):
@@ -339,6 +342,7 @@ class Feature(object):
         """<div class="feature" id="${self.name}" style="background-color: rgba(${self.red}, ${self.green}, ${self.blue}, ${self.alpha});"></div>"""
 
 class AffineList(Affine):
+    __slots__ = ()
     def appendfeature(self, feature):
         if 'features' not in self.metadata:
             self.metadata['features'] = []
@@ -346,11 +350,14 @@ class AffineList(Affine):
 
 class EmptyList(AffineList):
     """Object representing an empty AffineList."""
+    __slots__ = ('gap', 'metadata')
     def __init__(self, gap=None, **kwargs):
         self.gap = None
         self.metadata = kwargs
     def __getslice__(self, left, right):
         return self
+    def insertgaps(self, coords):
+        return self
     def __getitem__(self, i):
         if isinstance(i, int) or i is None or \
                 i == posinf or i == neginf:
@@ -387,12 +394,15 @@ class ProperList(AffineList):
     ``enumerate()`` on a normal list, but returns the coordinates
     instead of the indices.
     """
+    __slots__ = ('offset', 'values', 'gap', 'metadata')
     def __init__(self, offset, values, gap=None, **kwargs):
         if len(values) == 0:
             raise ValueError("Cannot create a ProperList with no contents.")
         self.metadata = kwargs
         self.offset = offset
-        self.values = list(values)
+        # A TraceArray gets a view of its own, so inserting into one
+        # list never changes another built from the same traces.
+        self.values = values.view() if isinstance(values, TraceArray) else list(values)
         self.gap = gap
     def isempty(self):
         return False
@@ -406,7 +416,7 @@ class ProperList(AffineList):
         newmetadata = self.metadata.copy()
         if 'features' in newmetadata:
             newmetadata['features'] = [f >> n for f in self.metadata['features']]
-        return ProperList(self.offset+n, self.values, self.gap, **newmetadata)
+        return self.__class__(self.offset+n, self.values, self.gap, **newmetadata)
     def __getitem__(self, i):
         if isinstance(i, int):
             if i < self.left():
@@ -432,7 +442,7 @@ class ProperList(AffineList):
         if len(body) == 0:
             return EmptyList(self.gap, **self.metadata)
         else:
-            return ProperList(offset, body, self.gap, **self.metadata)
+            return self.__class__(offset, body, self.gap, **self.metadata)
     def featureson(self, left=None, right=None):
         if 'features' not in self.metadata:
             return []
@@ -449,6 +459,8 @@ class ProperList(AffineList):
         return [f for f in self.metadata['features'] if f.overlaps(pos)]
     def iter(self, start=None, end=None):
         """Return an iterator over the elements in the support of this list."""
+        if start is None and end is None:
+            return iter(self.values)
         return it.imap(lambda (a,b): b, self.itercoords(start=start, end=end))
     def __iter__(self):
         return self.iter()
@@ -466,14 +478,14 @@ class ProperList(AffineList):
         for i in range(start, end):
             yield (i,self[i])
     def __repr__(self):
-        return 'ProperList(offset=%d, values=%s, gap=%s' % (self.offset, repr(self.values), repr(self.gap)) + \
+        return '%s(offset=%d, values=%s, gap=%s' % (self.__class__.__name__, self.offset,
+                                                  repr(aslist(self)), repr(self.gap)) + \
             "".join(", %s=%s" % (k, repr(v)) for k,v in self.metadata.iteritems()) + ")"
     def __len__(self):
         return len(self.values)
     def append(self, x):
         """Append *x* as an item to the end of this list."""
-        self.values.append(x)
-        return self
+        return self.extend([x])
     def insert(self, i, x):
         """Insert *x* at coordinate *i*.
 
@@ -494,9 +506,40 @@ class ProperList(AffineList):
         elif i in self.support():
             self.insert(i, self.gap)
         return self
+    def insertgaps(self, coords):
+        """Insert a gap at each of the increasing coordinates *coords*.
+
+        The result is the same as calling ``insertgap`` on each in
+        turn, but the values are rebuilt once instead of once per gap.
+        """
+        where = []
+        for i in coords:
+            if i == self.offset:
+                self.offset += 1
+            elif self.offset < i < self.offset + len(self.values) + len(where):
+                where.append(i - self.offset - len(where))
+        if where:
+            self.values = self._withgaps(where)
+        return self
+    def _withgaps(self, where):
+        # The values with a gap inserted before each index in where.
+        if isinstance(self.values, TraceArray):
+            v = self.values
+            return TraceArray(v.points, v.offsets, numpy.insert(v.index, where, -1), v.flipped)
+        result = []
+        previous = 0
+        for k in where:
+            result.extend(self.values[previous:k])
+            result.append(self.gap)
+            previous = k
+        result.extend(self.values[previous:])
+        return result
     def extend(self, vals):
         """Append all items in *vals* to the end of the list."""
-        self.values.extend(vals)
+        if isinstance(self.values, TraceArray):
+            self.values = self.values + list(vals)
+        else:
+            self.values.extend(vals)
         return self
     def find(self, template, all=False, start=None, end=None):
         """Find the coordinates matching *template*.
@@ -526,6 +569,8 @@ class ProperList(AffineList):
         return coords
     def __setitem__(self, i, x):
         if i in self.support():
+            if isinstance(self.values, TraceArray):
+                self.values = self.values.tolist()
             self.values[i-self.offset] = x
         elif i < self.offset:
             self.values = [x] + [None]*(self.offset-i-1) + self.values
@@ -534,15 +579,214 @@ class ProperList(AffineList):
             self.values = self.values + [None]*(i - (self.offset+len(self.values))) + [x]
         return x
     def __eq__(self, other):
-        return self.offset == other.offset and self.values == other.values and \
+        return self.offset == other.offset and \
+            aslist(self) == aslist(other) and \
             self.metadata == other.metadata
 
+
+class ArrayList(ProperList):
+    """ProperList whose values are a numpy array.
+
+    Slicing an ArrayList, restricting it to an interval, or shifting
+    it returns another ArrayList viewing the same array, so taking
+    pieces of a long track copies nothing. Strings become arrays of
+    single characters. Items are returned as Python objects, as from
+    a ProperList.
+
+    The array is never written through: ``insert``, ``append``,
+    ``extend`` and assignment build a new array for this list, and
+    leave any other views of the old one alone. If a new item, such
+    as a string among integers, does not fit the array's dtype, the
+    array becomes an array of objects.
+
+    Numbers keep their dtype when gaps are inserted among them, as
+    when GapMap.trace lays confidences along a track. ``isgap`` is
+    then a boolean array marking the items that are the list's gap,
+    whatever the array holds there, and is None when there are no
+    such items. Gaps only become the gap value when items are read
+    out, by indexing, iterating, ``tolist`` or serializing.
+    """
+    __slots__ = ('isgap',)
+    def __init__(self, offset, values, gap=None, isgap=None, **kwargs):
+        if isinstance(values, unicode):
+            values = values.encode('ascii')
+        if isinstance(values, str):
+            values = numpy.frombuffer(values, dtype='S1')
+        elif not isinstance(values, numpy.ndarray):
+            values, isgap = self._masked(list(values), gap)
+        if len(values) == 0:
+            raise ValueError("Cannot create a ProperList with no contents.")
+        self.metadata = kwargs
+        self.offset = offset
+        self.values = values
+        self.gap = gap
+        self.isgap = isgap
+    @classmethod
+    def _masked(cls, xs, gap):
+        # xs as an array and a mask of its gaps. Numbers with gaps
+        # among them stay numbers; anything else has no mask.
+        isgap = numpy.array([x is None or x == gap for x in xs], dtype=bool) \
+            if gap is None or None in xs else None
+        if isgap is not None and isgap.any() and not isgap.all():
+            present = cls._asarray([x for x, g in zip(xs, isgap) if not g])
+            if present.dtype.kind in 'biuf':
+                values = numpy.zeros(len(xs), dtype=present.dtype)
+                values[~isgap] = present
+                return values, isgap
+        return cls._asarray(xs), None
+    @staticmethod
+    def _asarray(xs, dtype=None):
+        # numpy.array would turn a list of tuples into a 2-D array.
+        xs = list(xs)
+        if dtype != object:
+            try:
+                if all(x is not None for x in xs):
+                    a = numpy.array(xs, dtype=dtype)
+                    if a.ndim == 1:
+                        return a
+            except (TypeError, ValueError):
+                pass
+        return objectarray(xs)
+    def _items(self, xs):
+        # *xs* as an array that can be joined to self.values, turning
+        # self.values into objects if its dtype cannot hold them.
+        a = self._asarray(xs, self.values.dtype)
+        if a.dtype != self.values.dtype:
+            a = self._asarray(xs, object)
+            self.values = self.values.astype(object)
+        return a
+    def __getitem__(self, i):
+        if isinstance(i, int):
+            if i < self.left() or i >= self.right():
+                return None
+            if self.isgap is not None and self.isgap[i - self.offset]:
+                return self.gap
+            return self.values.item(i - self.offset)
+        return ProperList.__getitem__(self, i)
+    def __getslice__(self, left, right):
+        result = ProperList.__getslice__(self, left, right)
+        if self.isgap is not None and not result.isempty():
+            i = result.offset - self.offset
+            result.isgap = self.isgap[i:i+len(result)]
+        return result
+    def __rshift__(self, n):
+        result = ProperList.__rshift__(self, n)
+        result.isgap = self.isgap
+        return result
+    def iter(self, start=None, end=None):
+        if start is None and end is None:
+            return iter(self.tolist())
+        return ProperList.iter(self, start, end)
+    def tolist(self, i=None, j=None):
+        """Return the items from index *i* to *j* as a list, with gaps as the gap."""
+        values = self.values[i:j].tolist()
+        if self.isgap is not None:
+            for k in numpy.flatnonzero(self.isgap[i:j]):
+                values[k] = self.gap
+        return values
+    def _unmask(self):
+        # Writes other than inserting gaps put the gaps into the
+        # array, as objects, before changing it.
+        if self.isgap is not None:
+            self.values = objectarray(self.tolist())
+            self.isgap = None
+    def append(self, x):
+        """Append *x* as an item to the end of this list."""
+        return self.extend([x])
+    def extend(self, vals):
+        """Append all items in *vals* to the end of the list."""
+        self._unmask()
+        vals = self._items(vals)
+        self.values = numpy.concatenate([self.values, vals])
+        return self
+    def insert(self, i, x):
+        """Insert *x* at coordinate *i*.
+
+        The list is extended with its gap if *i* is outside the
+        list's support.
+        """
+        self._unmask()
+        if i in self.support():
+            self.values = numpy.insert(self.values, i-self.offset, self._items([x]))
+        elif i < self.offset:
+            pad = self._items([x] + [self.gap]*(self.offset-i-1))
+            self.values = numpy.concatenate([pad, self.values])
+            self.offset = i
+        else:
+            self.extend([self.gap]*(i - self.right()) + [x])
+        return self
+    def __setitem__(self, i, x):
+        self._unmask()
+        if i in self.support():
+            item = self._items([x])
+            self.values = self.values.copy()
+            self.values[i-self.offset] = item[0]
+        elif i < self.offset:
+            pad = self._items([x] + [None]*(self.offset-i-1))
+            self.values = numpy.concatenate([pad, self.values])
+            self.offset = i
+        else:
+            self.extend([None]*(i - self.right()) + [x])
+        return x
+    def _withgaps(self, where):
+        if self.isgap is not None or \
+                (self.gap is None and self.values.dtype.kind in 'biuf'):
+            # Numbers stay numbers, and the mask marks the new gaps.
+            isgap = self.isgap if self.isgap is not None else \
+                numpy.zeros(len(self.values), dtype=bool)
+            self.isgap = numpy.insert(isgap, where, True)
+            return numpy.insert(self.values, where, 0)
+        gap = self._items([self.gap])
+        return numpy.insert(self.values, where, gap[0])
+
+def objectarray(values):
+    """Return *values* as a 1-D array of objects, one per item."""
+    a = numpy.empty(len(values), dtype=object)
+    try:
+        a[:] = values
+    except ValueError:
+        # numpy would make a 2-D array of a list of tuples.
+        for k, x in enumerate(values):
+            a[k] = x
+    return a
+
+def span(track, start, end, fill=None):
+    """Return the values of *track* from coordinate *start* to *end*.
+
+    Coordinates outside the support of *track* give *fill*. If there
+    are none, this is a slice of ``track.values``, not a copy.
+    """
+    if track.isempty():
+        return [fill]*max(0, end - start)
+    if end <= start:
+        return track.values[:0]
+    before = max(0, min(end, track.left()) - start)
+    after = max(0, end - max(start, track.right()))
+    body = track.values[max(0, start - track.left()):max(0, end - track.left())]
+    isgap = getattr(track, 'isgap', None)
+    if isgap is not None and isgap[max(0, start - track.left()):max(0, end - track.left())].any():
+        body = track.tolist(max(0, start - track.left()), max(0, end - track.left()))
+    if before == 0 and after == 0:
+        return body
+    return [fill]*before + list(body) + [fill]*after
+
+def aslist(track):
+    """Return the items of ProperList *track* in a form that compares as a list."""
+    return track.tolist() if isinstance(track, ArrayList) else track.values
+
 def aflist(offset, values, gap, **metadata):
     if len(values) == 0:
         return EmptyList(gap, **metadata)
     else:
         return ProperList(offset, values, gap, **metadata)
 
+def arraylist(offset, values, gap, **metadata):
+    """As aflist, but returning an ArrayList."""
+    if len(values) == 0:
+        return EmptyList(gap, **metadata)
+    else:
+        return ArrayList(offset, values, gap, **metadata)
+
 
 class Assembly(OrderedDict, Affine):
     """Class representing an assembly of sequences.
@@ -621,8 +865,9 @@ class Assembly(OrderedDict, Affine):
             start = self.left()
         if end is None:
             end = self.right()
-        for i in range(start,end):
-            yield (i,OrderedDict([(k,v[i]) for k,v in self.iteritems()]))
+        keys = self.keys()
+        for i, column in it.izip(xrange(start, end), zipspans(self.values(), start, end)):
+            yield (i, OrderedDict(it.izip(keys, column)))
     def subset(self, start=0, end=None):
         """Return an Assembly of a subset of columns.
 
@@ -670,8 +915,31 @@ class Assembly(OrderedDict, Affine):
             self[label] = aflist(0, seq, '-')
             return self
         template = ''.join(self[align_to].values)
+        return self._add_aligned(label, align_to, align.align(template, seq))
+    def add_sequences(self, sequences, align_to=None):
+        """Append each (label, seq) in *sequences*, aligned to *align_to*.
+
+        All the alignments are done in one batch with align.align_many,
+        against *align_to* as it is before any of the sequences are
+        added. Each is then fitted into the gaps that the earlier ones
+        put into *align_to*. add_sequence, called once per sequence,
+        aligns each against *align_to* with those gaps already in it.
+        So where two sequences insert bases at the same place, the
+        results can differ: a read with a shorter insertion may have
+        its gap on the other side of the inserted bases."""
+        if align_to is None or align_to not in self:
+            for label, seq in sequences:
+                self[label] = aflist(0, seq, '-')
+            return self
+        template = ''.join(self[align_to].values)
+        alignments = align.align_many([(template, seq) for _, seq in sequences])
+        assem = self
+        for (label, _), alignment in zip(sequences, alignments):
+            assem = assem._add_aligned(label, align_to, alignment)
+        return assem
+    def _add_aligned(self, label, align_to, alignment):
         ((contig_offset, aligned_contig), 
-         (seq_offset, aligned_seq)) = align.ssearch36(template, seq)
+         (seq_offset, aligned_seq)) = alignment
         aligned1 = aflist(self[align_to].offset, aligned_contig, gap='-')
         aligned2 = aflist(self[align_to].offset + seq_offset - contig_offset,
                           aligned_seq, '-')
@@ -680,34 +948,81 @@ class Assembly(OrderedDict, Affine):
         return assem
 
 def conform_gaps(assembly, label, aligned1, aligned2):
-    template = assembly[label]
-    start = min(min(template.left(), aligned1.left()), aligned2.left())
-    end = max(max(template.right(), aligned1.right()), aligned2.right())
-    it = start; ia1 = start; ia2 = start
-    while it < end and ia1 < end and ia2 < end:
-        tthis = template[it]
-        a1this = aligned1[ia1]
-        a2this = aligned2[ia2]
-        if tthis == template.gap and \
-                a1this != aligned1.gap:
-            aligned1.insertgap(ia1)
-            aligned2.insertgap(ia2)
-        elif (tthis == template.gap) == \
-                (a1this == aligned1.gap):
+    """Insert gaps so that *aligned1* lines up with the track *label* of *assembly*.
+
+    *aligned1* and *aligned2* are an alignment of the sequence in
+    *label* to a new sequence. Where the track has a gap that
+    *aligned1* does not, a gap goes into both aligned lists. Where
+    *aligned1* has a gap against a base of the track, a gap goes into
+    every track of *assembly*. The columns are found first, from the
+    gaps of the three lists, and then each list gets all its gaps in
+    one pass. The lists are changed in place.
+    """
+    template, al1, al2 = GapCursor(assembly[label]), GapCursor(aligned1), GapCursor(aligned2)
+    start = min(min(template.left(), al1.left()), al2.left())
+    end = max(max(template.right(), al1.right()), al2.right())
+    columns, paired = [], []
+    i = start
+    while i < end:
+        tgap, a1gap, a2gap = template.gapat(i), al1.gapat(i), al2.gapat(i)
+        if tgap and not a1gap:
+            al1.insertgap(i)
+            al2.insertgap(i)
+            paired.append(i)
+        elif tgap == a1gap:
             pass
-        elif tthis != template.gap and \
-                a1this == aligned1.gap and \
-                a2this != aligned2.gap:
-            for t in assembly.itervalues():
-                t.insertgap(it)
+        elif not a2gap:
+            template.insertgap(i)
+            columns.append(i)
         else:
             raise ValueError("Unhandled case.")
-        it += 1; ia1 += 1; ia2 += 1
-        end = max(max(template.right(), aligned1.right()), aligned2.right())
+        i += 1
+        end = max(max(template.right(), al1.right()), al2.right())
 
+    for t in assembly.itervalues():
+        t.insertgaps(columns)
+    aligned1.insertgaps(paired)
+    aligned2.insertgaps(paired)
     return (assembly, aligned1, aligned2)
-            
-    
+
+
+class GapCursor(object):
+    """Where the gaps of an AffineList lie as gaps are inserted into it.
+
+    Used by conform_gaps to follow a list through the gaps it will
+    get, without inserting them. Gaps must be inserted at increasing
+    coordinates, and ``gapat`` only asked about coordinates past the
+    last one. Outside the list, there is a gap only if its gap is
+    None, as when comparing its items to its gap.
+    """
+    __slots__ = ('offset', 'inserted', 'isgap', 'outside')
+
+    def __init__(self, track):
+        self.offset = track.left()
+        self.inserted = 0
+        self.isgap = [] if track.isempty() else \
+            GapMap.fromtrack(track, track.gap).isgap.tolist()
+        self.outside = track.gap is None
+
+    def left(self):
+        return self.offset
+
+    def right(self):
+        if self.offset is None:
+            return None
+        return self.offset + len(self.isgap) + self.inserted
+
+    def gapat(self, i):
+        if self.offset is not None and self.offset <= i < self.right():
+            return self.isgap[i - self.offset - self.inserted]
+        return self.outside
+
+    def insertgap(self, i):
+        if i == self.offset:
+            self.offset += 1
+        elif self.offset is not None and self.offset < i < self.right():
+            self.inserted += 1
+
 
 def affine_hooks(dct):
     classkeys = [k[2:] for k in dct if k.startswith('__')]
@@ -724,8 +1039,15 @@ class AffineEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ProperInterval):
             v = {'left': obj.left(), 'right': obj.right()}
+        elif isinstance(obj, ArrayList):
+            # Written as a ProperList, so older readers can load it.
+            # affine_hooks still reads the __ArrayList some versions wrote.
+            return dictunion({'offset': obj.left(), 'values': obj.tolist(),
+                              '__ProperList': True}, obj.metadata)
         elif isinstance(obj, ProperList):
             v = {'offset': obj.left(), 'values': obj.values}
+        elif isinstance(obj, (TraceArray, numpy.ndarray)):
+            return obj.tolist()
         elif isinstance(obj, Affine):
             v = {}
         elif obj == neginf:
@@ -764,7 +1086,7 @@ def rendernucleotide(coord, val):
     """<span style="color: ${base_color(val)};">$val</span>"""
 
 def path(coords, stroke="black", strokeWidth="0.03", fill="none"):
-    d = "M%0.3f,%0.3f" % coords[0] + ''.join("L%0.3f,%0.3f" % c for c in coords[1:])
+    d = "M%0.3f,%0.3f" % tuple(coords[0]) + ''.join("L%0.3f,%0.3f" % tuple(c) for c in coords[1:])
     return """<path stroke="%s" stroke-width="%s" fill="%s" d="%s" />""" % (stroke, strokeWidth, fill, d)
 
 def rendersvg(coord, val):
@@ -825,7 +1147,14 @@ def renderassembly(assembly):
 </div>"""
 
 def ab1tohtml(ab1filename):
-    r = ab1.read(ab1filename)
+    """Render the AB1 file *ab1filename* as a standalone HTML page.
+
+    *ab1filename* may also be anything else ``ab1.read`` accepts.
+    """
+    return recordtohtml(ab1.cached_read(ab1filename))
+
+def recordtohtml(r):
+    """Render the AB1Record *r* as a standalone HTML page."""
     a = Assembly([('traces', aflist(0, r['traces'], gap=None, trackclass='svg')),
                   ('confidences', aflist(0, r['confidences'], gap=None,
                                          trackclass='integer')),
@@ -845,20 +1174,114 @@ def tracealong(target, template, targetgap=None, templategap='-'):
     """
     if template.isempty():
         raise ValueError("Can't trace along an empty list.")
-    result = []
-    i = template.left()
-    j = 0
-    while i < template.right() and j < len(target):
-        if template[i] == templategap:
-            i += 1
-            result.append(targetgap)
+    return GapMap.fromtrack(template, templategap).trace(target, targetgap)
+
+
+class GapMap(object):
+    """The gaps of an aligned track, for mapping between coordinates.
+
+    A GapMap translates between positions in a read (counting only
+    its bases) and coordinates in the assembly (counting gaps too),
+    and lays parallel arrays, such as a read's confidences or traces,
+    along the track with gaps inserted. ``isgap[k]`` says whether the
+    k-th position of the track, starting at ``offset``, is a gap.
+    ``before[k]`` is the number of bases before it, and ``bases``
+    lists the positions that are not gaps. Everything is computed
+    once, from a cumulative count of bases, so translating a
+    coordinate is a lookup.
+
+    Past the right end of the track, read positions and coordinates
+    continue one for one, as tracealong lays out reads longer than
+    their track.
+    """
+    __slots__ = ('offset', 'isgap', 'before', 'bases')
+
+    def __init__(self, isgap, offset=0):
+        self.offset = offset
+        self.isgap = numpy.asarray(isgap, dtype=bool)
+        self.before = numpy.zeros(len(self.isgap) + 1, dtype=numpy.int_)
+        numpy.cumsum(~self.isgap, out=self.before[1:])
+        self.bases = numpy.flatnonzero(~self.isgap)
+
+    @classmethod
+    def fromtrack(cls, track, gap='-'):
+        """Build the GapMap of the AffineList *track*, whose gaps are *gap*."""
+        if track.isempty():
+            return cls(numpy.zeros(0, dtype=bool))
+        values = track.values
+        isgap = None
+        if isinstance(values, numpy.ndarray) and values.dtype.kind in 'SU' and \
+                isinstance(gap, basestring):
+            isgap = values == gap
+        elif isinstance(gap, basestring) and len(gap) == 1:
+            try:
+                joined = str(''.join(values))
+            except (TypeError, UnicodeError):
+                joined = None
+            if joined is not None and len(joined) == len(values):
+                isgap = numpy.frombuffer(joined, dtype=numpy.uint8) == ord(gap)
+        if isgap is None:
+            isgap = [v == gap for v in track]
+        return cls(isgap, track.left())
+
+    def __len__(self):
+        return len(self.isgap)
+
+    def toalignment(self, j):
+        """Return the assembly coordinate of read position *j* (an int or array)."""
+        j = numpy.asarray(j)
+        n = len(self.bases)
+        inside = self.bases[numpy.clip(j, 0, max(n-1, 0))] if n else numpy.zeros_like(j)
+        result = self.offset + numpy.where(j < n, inside, len(self) + j - n)
+        return int(result) if result.ndim == 0 else result
+
+    def toread(self, i):
+        """Return the read position at assembly coordinate *i* (an int or array).
+
+        Gaps, and coordinates left of the track, give -1.
+        """
+        k = numpy.asarray(i) - self.offset
+        inside = numpy.clip(k, 0, max(len(self)-1, 0))
+        ongap = self.isgap[inside] if len(self) else numpy.ones_like(k, dtype=bool)
+        result = numpy.where(k >= len(self), self.before[-1] + k - len(self),
+                             numpy.where((k < 0) | ongap, -1, self.before[inside]))
+        return int(result) if result.ndim == 0 else result
+
+    def positions(self, n):
+        """Return the read position of each column when a read of *n* values is laid along the track.
+
+        Gaps are -1. As in tracealong, the result stops at the read's
+        last value, dropping any trailing gaps, and extends past the
+        end of the track if the read is longer than it.
+        """
+        if n <= 0:
+            return numpy.zeros(0, dtype=numpy.int_)
+        if n <= len(self.bases):
+            cut = self.bases[n-1] + 1
+            return numpy.where(self.isgap[:cut], -1, self.before[:cut])
+        return numpy.concatenate([numpy.where(self.isgap, -1, self.before[:-1]),
+                                  numpy.arange(len(self.bases), n)])
+
+    def trace(self, target, gap=None):
+        """Lay *target*, a gapless list, TraceArray, or array, along the track.
+
+        Returns a ProperList at the track's offset, with *gap* in the
+        gaps. Numbers come back as an ArrayList of the same dtype, with
+        the gaps marked in its ``isgap``.
+        """
+        positions = self.positions(len(target))
+        if isinstance(target, TraceArray) and gap is None:
+            result = target.take(positions)
         else:
-            result.append(target[j])
-            i += 1
-            j += 1
-    if j < len(target):
-        result.extend(target[j:])
-    return ProperList(template.left(), result, targetgap)
+            values = numpy.asarray(target)
+            if values.ndim == 1 and values.dtype.kind in 'biuf' and len(values) == len(target):
+                isgap = positions < 0
+                return ArrayList(self.offset, values[positions], gap,
+                                 isgap=isgap if isgap.any() else None)
+            else:
+                padded = list(target) + [gap]
+                result = [padded[j] for j in positions.tolist()]
+        return ProperList(self.offset, result, gap)
 
 def alzipinterval(interval, *als):
     """Zip AffineLists *als* over *interval*.
@@ -867,11 +1290,14 @@ def alzipinterval(interval, *als):
     """
     if interval.isempty():
         return EmptyList()
-    offset = interval.left()
-    body = []
-    for i in range(interval.left(), interval.right()):
-        body.append(tuple(a[i] for a in als))
-    return ProperList(offset, body, gap=tuple())
+    body = list(zipspans(als, interval.left(), interval.right()))
+    return ProperList(interval.left(), body, gap=tuple())
+
+def zipspans(als, start, end):
+    """Iterate over tuples of the items of *als* at each coordinate from *start* to *end*."""
+    if len(als) == 0:
+        return it.repeat((), max(0, end - start))
+    return it.izip(*[span(a, start, end) for a in als])
 
 def alzipnarrow(*als):
     """Zip *als* over the intersection of their supports."""
@@ -1,12 +1,14 @@
 import os
 import ConfigParser
+import align
 
 def read_configuration(handle):
     default = \
         {'target_path': None, 'inbox_path': None,
          'db_server': None, 'db_username': None,
          'db_port': '3306', 'db_credentials': None,
-         'db_name': None}
+         'db_name': None, 'compression': None,
+         'aligner': 'ssearch36', 'cache_path': None}
 
     scp = ConfigParser.SafeConfigParser(default)
     scp.readfp(handle)
@@ -16,13 +18,20 @@ def read_configuration(handle):
             'inbox_path': scp.get('default','inbox_path'),
             'db_server': scp.get('default','db_server'),
             'db_username': scp.get('default','db_username'),
-            'db_credentials': scp.get('default', 'db_credentials')}
+            'db_credentials': scp.get('default', 'db_credentials'),
+            'compression': scp.get('default', 'compression') or None,
+            'aligner': scp.get('default', 'aligner'),
+            'cache_path': scp.get('default', 'cache_path') or None}
     if not(os.path.isdir(conf['target_path'])):
         raise ValueError("No such path: %s" % conf['target_path'])
     if not(os.path.isdir(conf['inbox_path'])):
         raise ValueError("No such path: %s" % conf['inbox_path'])
     if not(os.path.exists(conf['db_credentials'])):
         raise ValueError("No such path: %s" % conf['db_credentials'])
+    if conf['compression'] not in (None, 'gz', 'xz'):
+        raise ValueError("compression must be gz or xz, not %s" % conf['compression'])
+    if conf['aligner'] not in align.aligners:
+        raise ValueError("No such aligner: %s" % conf['aligner'])
     conf['inbox_path'] = os.path.abspath(conf['inbox_path'])
     try:
         with open(conf['db_credentials']) as h:
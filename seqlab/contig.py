@@ -1,9 +1,10 @@
 import numpy
 import re
-import collections
 import align
 
 from assembly import *
+from traces import TraceArray
+import nucleotide
 import ab1
 
 iupac = {('A','C'): 'M',
@@ -22,46 +23,79 @@ iupac = {('A','C'): 'M',
          ('C','G','T'): 'B',
          ('A','C','G','T'): 'N'}
 
-pacui = dict([(y, set(x)) for x,y in iupac.iteritems()])
 
-def as_key(s):
-    return tuple(sorted(set(s)))
+def highqualityinterval(confs, threshold=40, boundarywidth=10, mode='window',
+                        limit=0.05):
+    """Find the largest interval in *confs* with high quality.
+
+    In the default 'window' mode, high quality is defined as having
+    at least *boundarywidth* values over *threshold* at each end.
+    Returns a HalfOpenInterval of such a region, or EmptyInterval if
+    there is no such region.
 
-iupac_table = {}
-for k1,v1 in iupac.iteritems():
-    for k2,v2 in iupac.iteritems():
-        new_key = as_key([v1,v2])
-        new_base = iupac[as_key(set(k1).union(k2))]
-        iupac_table[new_key] = new_base
-for i in iupac.itervalues():
-    iupac_table[(i,)] = i
-    iupac_table[('-',i)] = i
-iupac_table[('-',)] = '-'
-iupac_table[tuple()] = 'N'
+    In 'mott' mode, the read is trimmed with Mott's algorithm
+    instead: each base scores *limit* minus its probability of error,
+    and the interval is the stretch with the highest total score.
+    *threshold* and *boundarywidth* are then ignored.
+    """
+    if mode == 'mott':
+        return motttrim(confs, limit)
+    elif mode != 'window':
+        raise ValueError("Unknown trimming mode: %s" % (mode,))
+    if len(confs) < boundarywidth:
+        raise ValueError("Confidences must be at least boundarywidth wide.")
+    starts = goodwindows(confs, threshold, boundarywidth)
+    if len(starts) == 0:
+        return EmptyInterval()
+    return ProperInterval(int(starts[0]), int(starts[-1]) + boundarywidth)
 
 
-def highqualityinterval(confs, threshold=40, boundarywidth=10):
-    """Find the largest interval in *confs* with high quality.
+def highqualityintervals(confs, threshold=40, boundarywidth=10):
+    """Return every candidate interval of high quality in *confs*.
 
-    High quality is defined as having at least *boundarywidth* values
-    over *threshold* at each end. Returns a HalfOpenInterval of such a
-    region, or None if there is no such region.
+    These are the maximal runs of at least *boundarywidth* values
+    over *threshold*, in order. highqualityinterval returns the span
+    from the start of the first to the end of the last.
     """
+    starts = goodwindows(confs, threshold, boundarywidth)
+    if len(starts) == 0:
+        return []
+    breaks = numpy.flatnonzero(numpy.diff(starts) > 1)
+    firsts = numpy.concatenate([starts[:1], starts[breaks+1]])
+    lasts = numpy.concatenate([starts[breaks], starts[-1:]])
+    return [ProperInterval(int(f), int(l) + boundarywidth)
+            for f, l in zip(firsts, lasts)]
+
+
+def goodwindows(confs, threshold, boundarywidth):
+    """Return the starts of the *boundarywidth* wide windows of *confs* all over *threshold*."""
+    low = numpy.zeros(len(confs) + 1, dtype=numpy.int_)
+    numpy.cumsum(numpy.asarray(confs) < threshold, out=low[1:])
     if len(confs) < boundarywidth:
-        raise ValueError("Confidences must be at least boundarywidth wide.")
-    left = 0
-    while any([c < threshold for c in confs[left:left+boundarywidth]]):
-        if left+boundarywidth < len(confs):
-            left += 1
-        else:
-            return EmptyInterval()
-    right = len(confs)
-    while any([c < threshold for c in confs[right-boundarywidth:right]]):
-        if right-boundarywidth > 0:
-            right -= 1
-        else:
-            return EmptyInterval()
-    return ProperInterval(left,right)
+        return numpy.zeros(0, dtype=numpy.int_)
+    return numpy.flatnonzero(low[boundarywidth:] == low[:len(low)-boundarywidth])
+
+
+def motttrim(confs, limit=0.05):
+    """Return the interval of *confs* kept by Mott's trimming algorithm.
+
+    Each base scores *limit* minus its error probability 10^(-q/10),
+    and the interval is the one with the greatest total score, or
+    EmptyInterval if no base scores above zero.
+    """
+    if len(confs) == 0:
+        return EmptyInterval()
+    scores = limit - 10.0 ** (-numpy.asarray(confs, dtype=numpy.float64) / 10)
+    total = numpy.zeros(len(confs) + 1)
+    numpy.cumsum(scores, out=total[1:])
+    # The best interval ending at r starts at the lowest prefix sum
+    # before it.
+    lowest = numpy.minimum.accumulate(total)
+    right = int(numpy.argmax(total - lowest))
+    if total[right] - lowest[right] <= 0:
+        return EmptyInterval()
+    left = int(numpy.argmax(total[:right+1] == lowest[right]))
+    return ProperInterval(left, right)
     
 
 def extend(segment, interval, template):
@@ -70,59 +104,109 @@ def extend(segment, interval, template):
     *segment* and *template* should be ProperLists. *interval*
     specifies a space in *template* where *segment* should replace
     whatever is there. The offset of the resulting ProperList is
-    adjusted to be in the same coordinates as *segment*.
+    adjusted to be in the same coordinates as *segment*. If both are
+    ArrayLists, so is the result, and the pieces are joined as arrays.
     """
     if interval.isempty():
         return template
-    lefttail = list(template.iter(template.left(), interval.left()))
-    righttail = list(template.iter(interval.right(), template.right()))
+    lefttail = span(template, template.left(), interval.left())
+    righttail = span(template, interval.right(), template.right())
     offset = segment.left() - len(lefttail)
-    body = lefttail + list(segment) + righttail
+    cls = ArrayList if isinstance(template, ArrayList) and \
+        isinstance(segment, ArrayList) else ProperList
+    if cls is ArrayList and segment.isgap is None and \
+            isinstance(lefttail, numpy.ndarray) and isinstance(righttail, numpy.ndarray):
+        body = numpy.concatenate([lefttail, segment.values, righttail])
+    else:
+        body = list(lefttail) + list(segment) + list(righttail)
     if len(body) == 0:
         return EmptyList(segment.gap)
     else:
-        return ProperList(offset, body, segment.gap, **dictunion(segment.metadata))
+        return cls(offset, body, segment.gap, **dictunion(segment.metadata))
 
 
 def combine(*tracks):
+    """Call the consensus of *tracks*, each an aligned (bases, confidences) pair."""
     if len(tracks) == 0:
         return EmptyList()
-    n = alzipsupport(*[alzipsupport(t[0],t[1]) for t in tracks])
+    columns = support(*[x for t in tracks for x in t])
+    if columns.isempty():
+        return EmptyList('-')
+    start, width = columns.left(), columns.width()
+    masks = numpy.empty((len(tracks), width), dtype=numpy.intp)
+    masks[:] = absent
+    confs = numpy.empty((len(tracks), width))
+    for k, (bases, confidences) in enumerate(tracks):
+        if not bases.support().isempty():
+            left = bases.left() - start
+            masks[k, left:left+bases.width()] = nucleotide.tomasks(bases.values)
+        confs[k] = numpy.array(span(confidences, start, start+width, fill=0), dtype=numpy.float64)
     s = closure(*[t[0].support() for t in tracks])
-    return aflist(s.left(), [combinebase(*q) for q in n], gap='-')
+    return arraylist(s.left(), consensus(masks, confs), gap='-')
 
 
 def combinebase(*pairs):
-    if len(pairs) == 0:
-        return 'N'
-    threshold = 20
-    d = collections.defaultdict(lambda: 0)
-    for p in pairs:
-        if p == None:
-            continue
-        else:
-            b,c = p
-            if b:
-                d[b] += c
-    key = tuple(sorted(k for k,v in d.iteritems() if v >= threshold))
-    return iupac_table[key]
+    """Call the consensus of one column of (base, confidence) pairs."""
+    pairs = [p for p in pairs if p is not None and p[0]]
+    masks = numpy.array([[nucleotide.tomasks(b)[0]] for b, _ in pairs],
+                        dtype=numpy.intp).reshape(len(pairs), 1)
+    confs = numpy.array([[c] for _, c in pairs], dtype=numpy.float64).reshape(len(pairs), 1)
+    return consensus(masks, confs)
+
+
+# Mask marking where a read does not cover a column in consensus.
+absent = 16
+
+def consensus(masks, confidences, threshold=20):
+    """Call the consensus base of each column of aligned reads.
 
+    *masks* is an (N, L) array of the IUPAC masks (see nucleotide) of
+    N reads over L columns, with ``absent`` where a read does not
+    cover a column, and *confidences* the matching (N, L) array of
+    confidences. In each column, the confidences of each distinct
+    code are summed. Gaps have no confidence (NaN or anything else)
+    and count as *threshold*. The codes whose sums reach *threshold*
+    are combined into one IUPAC code, which is 'N' if none do and '-'
+    if only gaps do. Returns a string of the L consensus codes.
+    """
+    masks = numpy.asarray(masks, dtype=numpy.intp)
+    n, width = masks.shape
+    weights = numpy.where(masks == nucleotide.GAP, threshold,
+                          numpy.nan_to_num(numpy.asarray(confidences, dtype=numpy.float64)))
+    # Scatter each read's confidence into its column's bin for its code.
+    bins = numpy.arange(width) * (absent+1) + masks
+    sums = numpy.bincount(bins.ravel(), weights.ravel(), minlength=width*(absent+1))
+    passed = sums.reshape(width, absent+1)[:, :absent] >= threshold
+    called = numpy.bitwise_or.reduce(numpy.where(passed, numpy.arange(absent), 0), axis=1)
+    called[~passed.any(axis=1)] = 15
+    return numpy.frombuffer(nucleotide.letters, dtype=numpy.uint8)[called].tostring()
+
+
+def segments(seq1, conf1, seq2, conf2):
+    """Return the high quality segments of two reads, which assemble aligns."""
+    hqint1, hqint2 = highqualityinterval(conf1), highqualityinterval(conf2)
+    segment1 = seq1[hqint1.left():hqint1.right()] if hqint1.isproper() else ""
+    segment2 = seq2[hqint2.left():hqint2.right()] if hqint2.isproper() else ""
+    return segment1, segment2
 
-def assemble(seq1, conf1, traces1, seq2, conf2, traces2):
+def assemble(seq1, conf1, traces1, seq2, conf2, traces2, alignment=None):
     """Combine two reads into a contig.
 
     Returns an Assembly with the reads (with used sections marked),
     and a string specifying fate: 'both', 'strand 1', 'strand 2',
     'none'. If the fate is not 'none', then there will be a key
     'contig' in the Assembly.
+
+    *alignment* is the alignment of ``segments(seq1, conf1, seq2,
+    conf2)``, if the caller has already made it, for instance with
+    align.submit. Otherwise they are aligned here.
     """
     assert len(seq1) == len(conf1)
     assert len(seq2) == len(conf2)
 
     # Pull out high quality segments
     hqint1, hqint2 = highqualityinterval(conf1), highqualityinterval(conf2)
-    segment1 = seq1[hqint1.left():hqint1.right()] if hqint1.isproper() else ""
-    segment2 = seq2[hqint2.left():hqint2.right()] if hqint2.isproper() else ""
+    segment1, segment2 = segments(seq1, conf1, seq2, conf2)
     # Align them
     # If you were going to add assembly against a template, the major
     # change would be to write a function that took segment1,
@@ -135,16 +219,19 @@ def assemble(seq1, conf1, traces1, seq2, conf2, traces2):
     # segments against the template, and then go through the two
     # alignments to combine them (inserting -'s appropriately, etc.).
     # For a very similar algorithm that may help in writing that, see assembly.conform_gaps.
-    (offset1, rawalsegment1), (offset2, rawalsegment2) = align.ssearch36(segment1, segment2)
-    alsegment1, alsegment2 = aflist(offset1, rawalsegment1, gap='-', trackclass='nucleotide'), \
-        aflist(offset2, rawalsegment2, gap='-', trackclass='nucleotide')
+    if alignment is None:
+        alignment = align.align(segment1, segment2)
+    (offset1, rawalsegment1), (offset2, rawalsegment2) = alignment
+    alsegment1, alsegment2 = arraylist(offset1, rawalsegment1, gap='-', trackclass='nucleotide'), \
+        arraylist(offset2, rawalsegment2, gap='-', trackclass='nucleotide')
     alhqint1 = ProperInterval(offset1, offset1+alsegment1.width())
     alhqint2 = ProperInterval(offset2, offset2+alsegment2.width())
-    alseq1, alseq2 = extend(alsegment1, hqint1, aflist(0,seq1,'-')), \
-        extend(alsegment2, hqint2, aflist(0,seq2,'-'))
-    alconf1, alconf2 = tracealong(conf1, alseq1), tracealong(conf2, alseq2)
-    altraces1, altraces2 = tracealong(traces1, alseq1) if traces1 else None, \
-        tracealong(traces2, alseq2) if traces2 else None
+    alseq1, alseq2 = extend(alsegment1, hqint1, arraylist(0,seq1,'-')), \
+        extend(alsegment2, hqint2, arraylist(0,seq2,'-'))
+    gaps1, gaps2 = GapMap.fromtrack(alseq1), GapMap.fromtrack(alseq2)
+    alconf1, alconf2 = gaps1.trace(conf1), gaps2.trace(conf2)
+    altraces1, altraces2 = gaps1.trace(traces1) if traces1 else None, \
+        gaps2.trace(traces2) if traces2 else None
 
     for i,s in (alhqint1, alseq1), (alhqint1, alconf1), (alhqint1, altraces1), \
             (alhqint2, alseq2), (alhqint2, alconf2), (alhqint2, altraces2):
@@ -199,16 +286,16 @@ def assemble(seq1, conf1, traces1, seq2, conf2, traces2):
                                        features=[interval(neginf, posinf, 
                                                           name='unused', red=0, green=0,
                                                           blue=0, alpha=0.5)]) >> alconf1.left()
-        a['confidences 2'] = ProperList(0, conf2, 
-                                        gap=None,
-                                        trackclass='integer',
-                                        features=[interval(neginf, posinf, 
-                                                           name='unused', red=0, green=0,
-                                                           blue=0, alpha=0.5)]) >> alconf1.left()
-        a['bases 2'] = ProperList(0, seq2, gap='-',
-                                  trackclass='nucleotide', 
-                                  features=[interval(neginf, posinf, name='unused', 
-                                                     red=0, green=0, blue=0, alpha=0.5)]) >> alconf1.left()
+        a['confidences 2'] = ArrayList(0, conf2, 
+                                       gap=None,
+                                       trackclass='integer',
+                                       features=[interval(neginf, posinf, 
+                                                          name='unused', red=0, green=0,
+                                                          blue=0, alpha=0.5)]) >> alconf1.left()
+        a['bases 2'] = ArrayList(0, seq2, gap='-',
+                                 trackclass='nucleotide', 
+                                 features=[interval(neginf, posinf, name='unused', 
+                                                    red=0, green=0, blue=0, alpha=0.5)]) >> alconf1.left()
         if altraces1:
             a['traces 1'] = altraces1
         a['confidences 1'] = alconf1
@@ -222,14 +309,14 @@ def assemble(seq1, conf1, traces1, seq2, conf2, traces2):
                                        trackclass='svg', 
                                        features=[interval(neginf, posinf, name='unused',
                                                           red=0, green=0, blue=0, alpha=0.5)]) >> alconf2.left()
-        a['confidences 1'] = ProperList(0, conf1, 
-                                        gap=None, trackclass='integer',
-                                        features=[interval(neginf, posinf, name='unused',
-                                                           red=0, green=0, blue=0, alpha=0.5)]) >> alconf2.left()
-        a['bases 1'] = ProperList(0, seq1, gap='-',
-                                  trackclass='nucleotide',
-                                  features=[interval(neginf, posinf, name='unused', 
-                                                     red=0, green=0, blue=0, alpha=0.5)]) >> alconf2.left()
+        a['confidences 1'] = ArrayList(0, conf1, 
+                                       gap=None, trackclass='integer',
+                                       features=[interval(neginf, posinf, name='unused',
+                                                          red=0, green=0, blue=0, alpha=0.5)]) >> alconf2.left()
+        a['bases 1'] = ArrayList(0, seq1, gap='-',
+                                 trackclass='nucleotide',
+                                 features=[interval(neginf, posinf, name='unused', 
+                                                    red=0, green=0, blue=0, alpha=0.5)]) >> alconf2.left()
         if altraces2:
             a['traces 2'] = altraces2
         a['confidences 2'] = alconf2
@@ -241,39 +328,55 @@ def assemble(seq1, conf1, traces1, seq2, conf2, traces2):
         if traces1:
             a['traces 1'] = ProperList(0, traces1, gap=None, trackclass='svg',
                                        features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
-        a['confidences 1'] = ProperList(0, conf1, gap=None, trackclass='integer', 
-                                        features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
-        a['bases 1'] = ProperList(0, seq1, gap='-', trackclass='nucleotide',
-                                  features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
+        a['confidences 1'] = ArrayList(0, conf1, gap=None, trackclass='integer', 
+                                       features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
+        a['bases 1'] = ArrayList(0, seq1, gap='-', trackclass='nucleotide',
+                                 features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
         if traces2:
             a['traces 2'] = ProperList(0, traces2, gap=None, trackclass='svg',
                                        features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
-        a['confidences 2'] = ProperList(0, conf2, gap=None, trackclass='integer',
-                                        features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
-        a['bases 2'] = ProperList(0, seq2, gap='-', trackclass='nucleotide',
-                                  features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
+        a['confidences 2'] = ArrayList(0, conf2, gap=None, trackclass='integer',
+                                       features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
+        a['bases 2'] = ArrayList(0, seq2, gap='-', trackclass='nucleotide',
+                                 features=[interval(neginf, posinf, name='unused', red=0, green=0, blue=0, alpha=0.5)])
         return a
 
 basecomplements = {'M': 'K', 'R': 'Y', 'W': 'W', 'S': 'S', 'Y': 'R', 'K': 'M', 'A': 'T', 'C': 'G',
                    'T': 'A', 'G': 'C', 'V': 'B', 'H': 'D', 'D': 'H', 'B': 'V', 'N': 'N'}
 
 def rcbases(bases):
-    def f(x):
-        return basecomplements[x]
-    return [f(x) for x in bases[::-1]]
+    """Return the reverse complement of *bases* as a string."""
+    return nucleotide.reverse_complement(bases)
 
 def rcconfidences(confs):
-    return [x for x in confs[::-1]]
+    """Return *confs* reversed: a reversed view if it is an array."""
+    return confs[::-1]
 
 def rctraces(traces):
+    """Return the reverse complement of *traces*.
+
+    A TraceArray is reversed by flipping its index and marking it
+    complemented, sharing its point buffer, so this takes the same
+    time however many points there are. Lists of trace dictionaries
+    are rebuilt point by point.
+    """
+    if isinstance(traces, TraceArray):
+        return traces.reverse_complement()
     def f(x):
         return dict([(basecomplements[base], [(1-x,y) for x,y in trace]) for base,trace in x.iteritems()])
     return [f(x) for x in traces[::-1]]
 
-def ab1toassembly(filename1, filename2):
-    """Takes two AB1 filenames and returns an Assembly of them."""
-    read1 = ab1.read(filename1)
-    read2 = ab1.read(filename2)
-    return assemble(read1['sequence'], read1['confidences'], read1['traces'],
-                    rcbases(read2['sequence']), rcconfidences(read2['confidences']), rctraces(read2['traces']))
+def ab1toassembly(filename1, filename2, traces=True):
+    """Takes two AB1 filenames and returns an Assembly of them.
+
+    If *traces* is false, the trace channels of the AB1 files are
+    never decoded, and the Assembly has no trace tracks.
+    """
+    fields = ab1.all_fields if traces else ('sequence', 'confidences')
+    read1 = ab1.cached_read(filename1, fields)
+    read2 = ab1.cached_read(filename2, fields)
+    return assemble(read1['sequence'], read1['confidences'],
+                    read1['traces'] if traces else None,
+                    rcbases(read2['sequence']), rcconfidences(read2['confidences']),
+                    rctraces(read2['traces']) if traces else None)
 
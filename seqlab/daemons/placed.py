@@ -33,7 +33,8 @@ class PlacementDaemon(pydaemonize.Daemon):
                 exit(0)
             def process_default(self, event):
                 syslog.syslog(syslog.LOG_NOTICE, "File %s created...processing." % (event.pathname,))
-                seqlab.place.placewrapper(db, event.pathname, config['target_path'])
+                seqlab.place.placewrapper(db, event.pathname, config['target_path'],
+                                          config['compression'])
     
         wm = pyinotify.WatchManager()
         notifier = pyinotify.Notifier(wm, Handler())
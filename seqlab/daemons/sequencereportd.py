@@ -1,7 +1,7 @@
 """
 Daemon to monitor a file hierarchy and create sequence reports.
 
-Any time 'workup.json' or any .ab1 file is added to a directory, check
+Any time 'workup.json' or any .ab1 file (possibly compressed) is added to a directory, check
 if there is a usable set of files in that directory. If so, generate a
 sequence report for them.
 """
@@ -11,32 +11,63 @@ import pyinotify
 import syslog
 import json
 import seqlab.sequence_report as sr
+import seqlab.ab1 as ab1
+import seqlab.align as align
 import seqlab.config as cf
+import seqlab.diskcache as diskcache
 
-def try_report(path, omit_blast):
+# Seconds an alignment may run before ssearch36 is killed and the
+# report is abandoned.
+alignment_timeout = 600
+
+def start_report(path, pool):
+    """Start the alignment for a sequence report in *path* in *pool*.
+
+    Returns (True, pending), where pending is passed to finish_report
+    once its job is done, or (False, reason) if there is nothing to do.
+    """
     files = os.listdir(path)
-    ab1s = [x for x in files if x.endswith('.ab1')]
+    ab1s = [x for x in files if ab1.is_ab1(x)]
     if 'workup.json' in files and len(ab1s) >= 2:
         with open(os.path.join(path,'workup.json')) as h:
             workup = json.load(h)
+        read1path, read2path = os.path.join(path,ab1s[0]), os.path.join(path, ab1s[1])
         try:
             syslog.syslog(syslog.LOG_NOTICE, 'Building sequence report in %s' % (path,))
-            fate, body = sr.sequence_report((workup, \
-                                             os.path.join(path,ab1s[0]),
-                                             os.path.join(path, ab1s[1])),
-                                            omit_blast)
+            job = sr.submit_alignment(read1path, read2path, pool, alignment_timeout)
         except Exception, ex:
             return False, str(ex)
-        if fate == 'assembled':
-            output_filename = os.path.join(path, 'assembly_report.html')
-        elif fate == 'strandwise':
-            output_filename = os.path.join(path, 'assembly_report.html')
-        with open(output_filename, 'w') as output:
-            print >>output, body
-        return True, output_filename
+        return True, (path, (workup, read1path, read2path), job)
     else:
         return False, 'Not a full complement of files.'
 
+def finish_report(pending, omit_blast):
+    """Write the sequence report started by start_report.
+
+    Returns (True, filename) or (False, reason).
+    """
+    path, files, job = pending
+    try:
+        fate, body = sr.sequence_report(files, omit_blast, alignment=job.result())
+    except Exception, ex:
+        return False, str(ex)
+    if fate == 'assembled':
+        output_filename = os.path.join(path, 'assembly_report.html')
+    elif fate == 'strandwise':
+        output_filename = os.path.join(path, 'assembly_report.html')
+    with open(output_filename, 'w') as output:
+        print >>output, body
+    return True, output_filename
+
+def try_report(path, omit_blast, pool=None):
+    if pool is None:
+        pool = align.AlignmentPool(1)
+    started, pending = start_report(path, pool)
+    if not started:
+        return False, pending
+    pool.wait([pending[2]])
+    return finish_report(pending, omit_blast)
+
 
 class SequenceReportDaemon(pydaemonize.Daemon):
     def __init__(self, config_path='/etc/seqlab.conf', omit_blast=False, 
@@ -48,7 +79,14 @@ class SequenceReportDaemon(pydaemonize.Daemon):
         omit_blast = self.omit_blast
         with open(self.config_path) as h:
             config = cf.read_configuration(h)
+        align.set_default(config['aligner'])
+        diskcache.set_root(config['cache_path'])
         monitor_path = config['target_path']
+        # Alignments run in the background while the loop below goes
+        # on handling events, and each report is finished once its
+        # alignment is done.
+        pool = align.AlignmentPool()
+        pending = []
         syslog.syslog(syslog.LOG_NOTICE, "sequencereportd monitoring %s for runs to process." % monitor_path)
         class Handler(pyinotify.ProcessEvent):
             def process_IN_UNMOUNT(self, event):
@@ -58,18 +96,32 @@ class SequenceReportDaemon(pydaemonize.Daemon):
             def process_default(self, event):
                 syslog.syslog(syslog.LOG_NOTICE, "Event on %s in monitored share." % (event.pathname,))
                 if event.name != 'workup.json' and \
-                        not event.name.endswith('.ab1'):
+                        not ab1.is_ab1(event.name):
                     syslog.syslog(syslog.LOG_NOTICE, "Ignoring event on %s." % (event.pathname,))
                     return
 
-                wrote, result = try_report(event.path, omit_blast)
-                if not wrote:
+                if any(p[0] == event.path for p in pending):
+                    syslog.syslog(syslog.LOG_NOTICE, "Report in %s already underway." % (event.path,))
+                    return
+                started, result = start_report(event.path, pool)
+                if not started:
                     syslog.syslog(syslog.LOG_NOTICE, "No action in %s: %s" % \
                                       (event.path,result))
+                else:
+                    pending.append(result)
+        def finish_ready(notifier):
+            pool.poll()
+            for p in [p for p in pending if p[2].done()]:
+                pending.remove(p)
+                wrote, result = finish_report(p, omit_blast)
+                if not wrote:
+                    syslog.syslog(syslog.LOG_NOTICE, "No action in %s: %s" % \
+                                      (p[0],result))
                 else:
                     syslog.syslog(syslog.LOG_NOTICE, "Wrote report in %s." % (result,))
         wm = pyinotify.WatchManager()
-        notifier = pyinotify.Notifier(wm, Handler())
+        # Wake every 100ms to check on running alignments.
+        notifier = pyinotify.Notifier(wm, Handler(), timeout=100)
         wm.add_watch(monitor_path,
                      pyinotify.IN_CREATE |
                      pyinotify.IN_DELETE |
@@ -77,7 +129,7 @@ class SequenceReportDaemon(pydaemonize.Daemon):
                      pyinotify.IN_ATTRIB | 
                      pyinotify.IN_MODIFY,
                      rec=True)
-        notifier.loop()
+        notifier.loop(callback=finish_ready)
 
 
 def main(args=None):
@@ -0,0 +1,206 @@
+"""
+diskcache.py - A directory of files with a size cap
+
+A DiskCache maps keys to files in one directory, named by a hash of
+the key. Callers write and read the files themselves; the cache only
+decides where they live and which to throw away. Every hit touches
+the file's mtime, and whenever a write takes the directory over its
+size cap, the least recently used files are removed until it fits.
+The cache keeps a running total of its size, so the directory is only
+scanned when the total goes over the cap, not on every write.
+
+Files are written under a temporary name and renamed into place, so
+several processes can share a cache directory without ever seeing a
+partial entry.
+"""
+import os
+import hashlib
+import tempfile
+
+# Caching is off unless a root directory is given, either by the
+# cache_path key of the configuration file (see set_root) or by the
+# SEQLAB_CACHE environment variable, which takes precedence. Setting
+# SEQLAB_CACHE to the empty string turns caching off even when the
+# configuration file asks for it.
+root = None
+default_max_bytes = 256 * 1024 * 1024
+
+
+def set_root(path):
+    """Keep caches under *path* from now on, or turn caching off if *path* is None.
+
+    This sets process-wide state, like ``align.set_default``.
+    """
+    global root
+    root = path or None
+
+def cache_root():
+    """Return the directory caches are kept in, or None if caching is off."""
+    return os.environ.get('SEQLAB_CACHE', root) or None
+
+def named_cache(name, suffix=''):
+    """Return a DiskCache in directory *name* under ``cache_root()``, or None.
+
+    Returns None if caching is off, or if the directory cannot be
+    created, so an unwritable cache location means no caching rather
+    than a failed analysis.
+    """
+    base = cache_root()
+    if base is None:
+        return None
+    path = os.path.join(base, name)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            return None
+    return DiskCache(path, suffix=suffix)
+
+
+class DiskCache(object):
+    """Files in directory *path*, keyed by strings, totalling at most *max_bytes*.
+
+    ``hits`` and ``misses`` count the lookups made through this
+    object. They are not shared with other processes using the same
+    directory.
+    """
+    def __init__(self, path, max_bytes=default_max_bytes, suffix=''):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        # Bytes in the directory as of the last scan, plus what this
+        # object has written and removed since. None until the first
+        # write. Other processes' writes only show up at the next scan.
+        self.total = None
+
+    def filename(self, key):
+        """Return the file that holds *key*, whether or not it exists."""
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest() + self.suffix)
+
+    def get(self, key, load):
+        """Return ``load(filename)`` for the file of *key*, or None.
+
+        If there is no such file, or *load* raises an exception on it
+        (a corrupt or stale entry), counts a miss and returns None.
+        Corrupt entries are removed. A successful load counts a hit
+        and marks the entry as recently used.
+        """
+        filename = self.filename(key)
+        try:
+            value = load(filename)
+        except (IOError, OSError):
+            value = None
+        except Exception:
+            self._remove(filename)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, save):
+        """Write the entry for *key* by calling ``save(handle)``.
+
+        *handle* is a file open for binary writing. The entry replaces
+        any existing one for *key*. Least recently used entries are
+        evicted afterwards if the cache is over its size cap.
+        """
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        filename = self.filename(key)
+        try:
+            with os.fdopen(fd, 'wb') as h:
+                save(h)
+            replaced = self._bytes(filename)
+            os.rename(tmp, filename)
+        except:
+            self._remove(tmp)
+            raise
+        if self.total is None:
+            self.evict()
+        else:
+            self.total += self._bytes(filename) - replaced
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        """Return (filename, bytes, mtime) of every entry, least recently used first."""
+        if not os.path.isdir(self.path):
+            return []
+        result = []
+        for name in os.listdir(self.path):
+            if name.startswith('.tmp') or not name.endswith(self.suffix):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            result.append((filename, st.st_size, st.st_mtime))
+        result.sort(key=lambda e: e[2])
+        return result
+
+    def size(self):
+        """Return the total bytes in the cache."""
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used entries until at most *max_bytes* remain.
+
+        *max_bytes* defaults to the cache's cap. Returns the number of
+        entries removed.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        removed = 0
+        for filename, nbytes, _ in entries:
+            if total <= max_bytes:
+                break
+            self._remove(filename)
+            total -= nbytes
+            removed += 1
+        self.total = total
+        return removed
+
+    def purge(self):
+        """Remove every entry. Returns the number removed."""
+        entries = self.entries()
+        for filename, _, _ in entries:
+            self._remove(filename)
+        self.total = 0
+        return len(entries)
+
+    def _bytes(self, filename):
+        try:
+            return os.stat(filename).st_size
+        except OSError:
+            return 0
+
+    def _remove(self, filename):
+        nbytes = self._bytes(filename)
+        try:
+            os.remove(filename)
+        except OSError:
+            return
+        if self.total is not None and not os.path.basename(filename).startswith('.tmp'):
+            self.total -= nbytes
+
+    def __repr__(self):
+        return 'DiskCache(%s, max_bytes=%d)' % (repr(self.path), self.max_bytes)
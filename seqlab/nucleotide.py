@@ -0,0 +1,84 @@
+"""
+nucleotide.py - Nucleotides as IUPAC bit masks
+
+Each base is a 4-bit mask of the bases it could be: A=1, C=2, G=4,
+T=8, so that an ambiguity code is the union of its bases (M = A|C =
+3, N = 15) and a gap is 0. Comparing and combining sequences then
+becomes bitwise arithmetic on a uint8 array of masks, made by tomasks,
+instead of set and dictionary lookups on every character. Tracks keep
+their bases as characters; only code that compares or combines them,
+such as contig.combine and statistics, converts them to masks.
+"""
+import numpy
+import string
+
+GAP = 0
+A, C, G, T = 1, 2, 4, 8
+
+# The IUPAC code of each mask, indexed by mask.
+letters = '-ACMGRSVTWYHKDBN'
+
+# The mask of each character, indexed by its byte value. Characters
+# that are not nucleotides are marked invalid.
+invalid = 255
+masks = numpy.empty(256, dtype=numpy.uint8)
+masks[:] = invalid
+for _m, _c in enumerate(letters):
+    masks[ord(_c)] = _m
+    masks[ord(_c.lower())] = _m
+masks[ord('U')] = masks[ord('u')] = T
+
+# The same for uppercase IUPAC codes and '-' only, as tomasks uses
+# when *strict*.
+strictmasks = numpy.empty(256, dtype=numpy.uint8)
+strictmasks[:] = invalid
+for _m, _c in enumerate(letters):
+    strictmasks[ord(_c)] = _m
+
+# The mask of the complement of each mask: A and T swap, as do C and G.
+complements = numpy.array([((m & A) << 3) | ((m & T) >> 3) | ((m & C) << 1) | ((m & G) >> 1)
+                           for m in range(16)], dtype=numpy.uint8)
+
+# A str.translate table taking each IUPAC character to its complement.
+translation = string.maketrans(
+    letters + letters.lower() + 'Uu',
+    ''.join(letters[m] for m in complements) + ''.join(letters[m] for m in complements).lower() + 'Aa')
+
+# How many bases each mask could be.
+counts = numpy.array([bin(m).count('1') for m in range(16)], dtype=numpy.uint8)
+
+
+def reverse_complement(seq):
+    """Return the reverse complement of *seq*, a string or list of characters, as a string.
+
+    Works on the string with ``str.translate`` rather than going
+    through masks. Characters that are not IUPAC codes are left alone.
+    """
+    if not isinstance(seq, basestring):
+        seq = ''.join(seq)
+    if isinstance(seq, unicode):
+        seq = seq.encode('ascii')
+    return seq[::-1].translate(translation)
+
+
+def tomasks(seq, strict=False):
+    """Return the masks of *seq*, a string or sequence of characters, as a uint8 array.
+
+    Lowercase codes and 'U' are read as their uppercase bases, and
+    anything else raises ValueError. If *strict*, only uppercase
+    IUPAC codes and '-' are nucleotides, and anything else gets the
+    mask ``invalid`` instead of raising.
+    """
+    if isinstance(seq, numpy.ndarray) and seq.dtype == numpy.dtype('S1'):
+        seq = seq.tostring()
+    elif isinstance(seq, unicode):
+        seq = seq.encode('ascii', 'replace' if strict else 'strict')
+    elif not isinstance(seq, str):
+        seq = ''.join(seq)
+        if isinstance(seq, unicode):
+            seq = seq.encode('ascii', 'replace' if strict else 'strict')
+    m = (strictmasks if strict else masks)[numpy.frombuffer(seq, dtype=numpy.uint8)]
+    if not strict and (m == invalid).any():
+        bad = seq[numpy.flatnonzero(m == invalid)[0]]
+        raise ValueError("Not a nucleotide: %r" % (bad,))
+    return m
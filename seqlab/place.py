@@ -11,10 +11,12 @@ import time
 import os
 import re
 import py.path
+import ab1
 
 
 
-def place(filepath, keyfun, metadatafun, pathgenfun, basepath, postplacefun):
+def place(filepath, keyfun, metadatafun, pathgenfun, basepath, postplacefun,
+          compression=None):
     """Generic function to place files.
 
     In summary, puts *filepath* in the proper subdirectory of
@@ -41,6 +43,9 @@ def place(filepath, keyfun, metadatafun, pathgenfun, basepath, postplacefun):
         file was written to and the metadata dictionary and does any
         post-placement actions necessary.
 
+    If *compression* is 'gz' or 'xz', the file is stored compressed,
+    with that suffix added to its name, instead of being moved.
+
     This generic setup is to make testing simple. For production use,
     its use looks like::
 
@@ -61,15 +66,21 @@ def place(filepath, keyfun, metadatafun, pathgenfun, basepath, postplacefun):
     metadata = metadatafun(key, current_time)
     targetpath = pathgenfun(basepath, metadata, current_time)
     targetpath.ensure(dir=True)
-    finalpath = targetpath.join(filepath.basename)
-    filepath.move(finalpath)
+    if compression:
+        finalpath = targetpath.join(filepath.basename + '.' + compression)
+        ab1.compress(str(filepath), str(finalpath))
+        filepath.remove()
+    else:
+        finalpath = targetpath.join(filepath.basename)
+        filepath.move(finalpath)
     targetpath.join('metadata.json').write(json.dumps(metadata))
     postplacefun(finalpath, metadata)
     return (finalpath, metadata)
 
-def placewrapper(db, filepath, basepath):
+def placewrapper(db, filepath, basepath, compression=None):
     return place(filepath, seqkey, functools.partial(metadata, db),
-                 genpath, basepath, functools.partial(updatepath, db))
+                 genpath, basepath, functools.partial(updatepath, db),
+                 compression)
 
 def seqkey(filepath):
     """Extracts a key from *filepath*.
@@ -11,6 +11,7 @@ import Bio.Blast.NCBIXML
 
 import assembly
 import ab1
+import align
 import contig
 
 def blast_seq(seq, save_path, ncbi_db='nr', json_path=None, json_limit=None):
@@ -97,16 +98,34 @@ def is_unclassified(s):
     return re.search(unclassified_regex, s) and True or False
 
 
+def read_pair(read1path, read2path):
+    """Return the parsed AB1 files *read1path* and *read2path*."""
+    reads = dict(ab1.read_many([read1path, read2path], workers=2, threads=True,
+                               cache=ab1.default_cache()))
+    return reads[read1path], reads[read2path]
+
+def submit_alignment(read1path, read2path, pool, timeout=None):
+    """Start the alignment a report on two AB1 files needs in *pool*.
+
+    Returns an align.AlignmentJob, whose result can be passed to a
+    report function as *alignment* once it is done.
+    """
+    read1, read2 = read_pair(read1path, read2path)
+    segment1, segment2 = contig.segments(read1['sequence'], read1['confidences'],
+                                         read2['sequence'], read2['confidences'])
+    return align.submit(pool, segment1, segment2, timeout=timeout)
+
 # workup should be a dictionary with the keys "accession", "workup",
 # "pat_name", "amp_name", "seq_key", as selected directly from the
 # workups view of the database. In production, it will be found in a
-# JSON file written in the directory.
+# JSON file written in the directory. alignment is the result of the
+# job from submit_alignment, if the reads have already been aligned.
 def generate_report(lookup_fun, assembled_render, strandwise_render):
-    def f((workup, read1path, read2path), omit_blast=False):
-        read1 = ab1.read(read1path)
-        read2 = ab1.read(read2path)
+    def f((workup, read1path, read2path), omit_blast=False, alignment=None):
+        read1, read2 = read_pair(read1path, read2path)
         assembly = contig.assemble(read1['sequence'], read1['confidences'], read1['traces'],
-                                   read2['sequence'], read2['confidences'], read2['traces'])
+                                   read2['sequence'], read2['confidences'], read2['traces'],
+                                   alignment)
         if 'contig' in assembly:
             if not omit_blast:
                 v = lookup_fun(''.join(assembly['contig'].values), save_path=os.path.join(workup['path'], 'blast.xml'),
@@ -1,6 +1,6 @@
 import assembly
 import itertools
-import contig
+import nucleotide
 
 def _onboth(f):
     def wrapper(asm, key1, key2):
@@ -29,18 +29,32 @@ def identities(xs):
     """Number of exact matches between bases."""
     return len([(x,y) for (x,y) in xs if x==y])
 
-def _base_inclusion(x, y):
-    if x == '-' or y == '-':
-        return False
-    else:
-        kx = contig.pacui[x]
-        ky = contig.pacui[y]
-        return kx.issubset(ky) or ky.issubset(kx)
+# Only uppercase IUPAC codes and '-' are read as nucleotides.
+# Anything else, lowercase bases and 'U' included, is unknown:
+# compatible with nothing, and counted as an ambiguity.
+unknown = nucleotide.invalid
+
+def _codes(xs):
+    # The masks of a sequence of single characters.
+    return nucleotide.tomasks(xs, strict=True)
+
+def _unzip(xs):
+    # The masks of the two sequences of zipped pairs xs.
+    return _codes([x for x,_ in xs]), _codes([y for _,y in xs])
+
+def _compatible(x, y):
+    both = x & y
+    return (x != unknown) & (y != unknown) & (both != nucleotide.GAP) & \
+        ((both == x) | (both == y))
+
+def _ambiguous(x):
+    return (x == unknown) | (nucleotide.counts[x & 15] > 1)
 
 @_onboth
 def compatibles(xs):
     """The number of compatible bases (A and N, for example)."""
-    return len([1 for x,y in xs if _base_inclusion(x, y)])
+    x, y = _unzip(xs)
+    return int(_compatible(x, y).sum())
 
 @_onboth
 def bases(xs):
@@ -75,7 +89,8 @@ def homopolymers2(xs):
 @_onboth
 def conflicts(xs):
     """Positions where IUPAC characters are incompatible (ignoring indels)."""
-    return len([(x,y) for (x,y) in xs if not _base_inclusion(x,y) and x != '-' and y != '-'])
+    x, y = _unzip(xs)
+    return int((~_compatible(x, y) & (x != nucleotide.GAP) & (y != nucleotide.GAP)).sum())
 
 @_onboth
 def mismatches(xs):
@@ -100,17 +115,18 @@ def insertions2(xs):
 @_onboth
 def ambiguities(xs):
     """Number of positions where there is an IUPAC ambiguity code in at least one position (will count gaps in the opposite strand)"""
-    return len([1 for x,y in xs if x not in "ACTG-" or y not in "ACTG-"])
+    x, y = _unzip(xs)
+    return int((_ambiguous(x) | _ambiguous(y)).sum())
 
 @_onfirst
 def ambiguities1(xs):
     """Number of positions in first reads which are IUPAC ambiguity codes."""
-    return len([1 for x in xs if x not in "ACTG-"])
+    return int(_ambiguous(_codes(xs)).sum())
 
 @_onsecond
 def ambiguities2(xs):
     """Number of positions in second read which are IUPAC ambiguity codes."""
-    return len([1 for x in xs if x not in "ACTG-"])
+    return int(_ambiguous(_codes(xs)).sum())
 
 def fracoverlap(asm, key1, key2):
     """Length difference divided by mean length of the two sequences."""
@@ -4,6 +4,7 @@ import logging
 import Bio.SeqIO
 
 import seqlab.assembly
+import seqlab.align
 
 log = logging.getLogger(__name__)
 
@@ -16,6 +17,8 @@ def build_parser(parser):
         help="Don't try to align new sequences, just add them at offset 0.")
     parser.add_argument('-a','--align-to', default='contig',
         help='Sequence to align new sequences to')                        
+    parser.add_argument('--aligner', default=None, choices=sorted(seqlab.align.aligners),
+        help='Aligner to use (default: %s)' % (seqlab.align.default_aligner,))
     parser.add_argument('fastas', nargs='+', 
                         metavar='seq.fasta ...',
                         help='FASTA files of additional sequences to include')
@@ -26,12 +29,13 @@ def action(args):
     for f in args.fastas:
         if not os.path.exists(f):
             raise ValueError("No such file: %s" % (f,))
+    if args.aligner:
+        seqlab.align.set_default(args.aligner)
 
     assembly = seqlab.assembly.deserialize(args.assembly)
-    for f in args.fastas:
-        with open(f):
-            for seq in Bio.SeqIO.parse(f, 'fasta'):
-                assembly.add_sequence(seq.description, seq.seq.tostring(),
+    sequences = [(seq.description, str(seq.seq))
+                 for f in args.fastas for seq in Bio.SeqIO.parse(f, 'fasta')]
+    assembly = assembly.add_sequences(sequences,
                                       align_to=args.align_to if not args.no_alignment else None)
     assembly.serialize(args.output if args.output else args.assembly)
     return 0 
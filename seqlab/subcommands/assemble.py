@@ -7,6 +7,7 @@ import Bio.SeqIO
 
 import seqlab.contig
 import seqlab.assembly
+import seqlab.align
 
 log = logging.getLogger(__name__)
 
@@ -22,6 +23,10 @@ def build_parser(parser):
     parser.add_argument('-a', '--additional-sequences', nargs='+', 
                         metavar='seq.fasta ...',
                         help='FASTA files of additional sequences to include')
+    parser.add_argument('--omit-traces', action='store_true',
+        help="Don't decode or store the chromatogram traces.")
+    parser.add_argument('--aligner', default=None, choices=sorted(seqlab.align.aligners),
+        help='Aligner to use (default: %s)' % (seqlab.align.default_aligner,))
 
 def action(args):
     if not os.path.exists(args.first_ab1):
@@ -33,15 +38,16 @@ def action(args):
     for f in args.additional_sequences:
         if not os.path.exists(f):
             raise ValueError("No such file: %s" % (f,))
+    if args.aligner:
+        seqlab.align.set_default(args.aligner)
 
-    assembly = seqlab.contig.ab1toassembly(args.first_ab1, args.second_ab1)
+    assembly = seqlab.contig.ab1toassembly(args.first_ab1, args.second_ab1,
+                                           traces=not args.omit_traces)
     if args.metadata:
         with open(args.metadata) as h:
             assembly.metadata = json.load(h)
-    for f in args.additional_sequences:
-        with open(f):
-            for seq in Bio.SeqIO.parse(f, 'fasta'):
-                assembly.add_sequence(seq.description, seq.seq.tostring(),
-                                      align_to='contig')
+    sequences = [(seq.description, str(seq.seq))
+                 for f in args.additional_sequences for seq in Bio.SeqIO.parse(f, 'fasta')]
+    assembly = assembly.add_sequences(sequences, align_to='contig')
     assembly.serialize(args.output)
     return 0 
@@ -0,0 +1,42 @@
+"""Inspect or purge seqlab's on-disk caches.
+
+Caching is off unless $SEQLAB_CACHE names a directory to keep caches
+in. The daemons instead take the cache_path key of the configuration
+file, which SEQLAB_CACHE overrides.
+"""
+
+import logging
+import seqlab.ab1
+import seqlab.align
+
+log = logging.getLogger(__name__)
+
+def caches():
+    """Return (name, DiskCache) for each cache, omitting those turned off."""
+    return [(name, c) for name, c in [('ab1', seqlab.ab1.default_cache()),
+                                      ('align', seqlab.align.default_cache())]
+            if c is not None]
+
+def build_parser(parser):
+    parser.add_argument('--purge',
+        action='store_true', default=False,
+        help='remove every entry')
+    parser.add_argument('--max-bytes',
+        action='store', type=int, default=None,
+        help='evict least recently used entries until each cache is at most this size')
+
+def action(args):
+    cs = caches()
+    if cs == []:
+        print "Caching is turned off."
+        return 0
+    for name, c in cs:
+        if args.purge:
+            log.info('Purged %d entries from %s' % (c.purge(), c.path))
+        elif args.max_bytes is not None:
+            log.info('Evicted %d entries from %s' % (c.evict(args.max_bytes), c.path))
+        entries = c.entries()
+        print "%s: %s" % (name, c.path)
+        print "  %d entries, %d bytes (limit %d bytes)" % \
+            (len(entries), sum(e[1] for e in entries), c.max_bytes)
+    return 0
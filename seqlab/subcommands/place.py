@@ -55,7 +55,8 @@ def action(args):
                           db=config['db_name'],
                           port=config['db_port'])
     try:
-        seqlab.place.placewrapper(conn, args.file, config['target_path'])
+        seqlab.place.placewrapper(conn, args.file, config['target_path'],
+                                  config['compression'])
     except Exception, e:
         print "Failure: " + str(e)
         return 1
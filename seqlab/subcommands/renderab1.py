@@ -7,19 +7,25 @@ import shutil
 import os
 import sys
 import seqlab.ab1
-from seqlab.assembly import ab1tohtml
+from seqlab.assembly import ab1tohtml, recordtohtml
 
 log = logging.getLogger(__name__)
 
 def build_parser(parser):
     parser.add_argument('ab1',
-        help='AB1 of file to render')
+        help='AB1 of file to render, a directory of them, or - to read one from stdin')
     parser.add_argument('-o', '--output',
         action='store', default=None,
-        help='filename to write HTML to')
+        help='filename to write HTML to, or directory when rendering a directory')
+    parser.add_argument('-j', '--workers',
+        action='store', type=int, default=None,
+        help='number of processes to read a directory with (default: number of CPUs)')
 
 def action(args):
-    s = ab1tohtml(args.ab1)
+    if os.path.isdir(args.ab1):
+        return render_directory(args.ab1, args.output or args.ab1,
+                                getattr(args, 'workers', None))
+    s = ab1tohtml(sys.stdin if args.ab1 == '-' else args.ab1)
     if args.output:
         with open(args.output, 'w') as out:
             print >>out, s
@@ -27,3 +33,19 @@ def action(args):
         print s
     return 0
 
+def render_directory(path, output, workers=None):
+    """Render every AB1 file in *path*, compressed or not, to a .html file in *output*."""
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    filenames = sorted(os.path.join(path, f) for f in os.listdir(path)
+                       if seqlab.ab1.is_ab1(f))
+    for filename, record in seqlab.ab1.read_many(filenames, workers=workers,
+                                                 cache=seqlab.ab1.default_cache()):
+        name = os.path.basename(filename)
+        if seqlab.ab1.iscompressed(name):
+            name = os.path.splitext(name)[0]
+        target = os.path.join(output, os.path.splitext(name)[0] + '.html')
+        log.info('Rendering %s to %s' % (filename, target))
+        with open(target, 'w') as out:
+            print >>out, recordtohtml(record)
+    return 0
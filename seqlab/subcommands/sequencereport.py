@@ -9,6 +9,8 @@ import json
 import sys
 
 import seqlab.sequence_report
+import seqlab.ab1
+import seqlab.align
 
 log = logging.getLogger(__name__)
 
@@ -25,19 +27,22 @@ def build_parser(parser):
         help="Assembly, but don't run BLAST.")
     parser.add_argument('-o', '--output', default=None,
         help='File to write HTML to (default: stdout)')
+    parser.add_argument('--aligner', default=None, choices=sorted(seqlab.align.aligners),
+        help='Aligner to use (default: %s)' % (seqlab.align.default_aligner,))
 
 
 def workup_files(path):
     """Return the absolute path to workup.json in *path*, and AB1 files.
 
-    If there are more than 2 .ab1 files in the directory, raises an
+    If there are more than 2 AB1 files (.ab1, .ab1.gz, or .ab1.xz) in
+    the directory, raises an
     error. Otherwise, the returned value is a 3-tuple of workup.json
     and the two AB1s.
     """
     if not(os.path.isfile(os.path.join(path, 'workup.json'))):
         raise ValueError("No workup.json in %s" % (path,))
     workup = os.path.abspath(os.path.join(path, 'workup.json'))
-    ab1files = [f for f in os.listdir(path) if f.endswith('.ab1')]
+    ab1files = [f for f in os.listdir(path) if seqlab.ab1.is_ab1(f)]
     if len(ab1files) != 2:
         raise ValueError("Could not find precisely 2 .ab1 files in %s" % (path,))
     else:
@@ -68,6 +73,8 @@ def action(args):
         if not(os.path.exists(ab1file2)):
             raise ValueError("Argument to -2 %s does not exist" % (ab1file2,))
 
+    if args.aligner:
+        seqlab.align.set_default(args.aligner)
     with open(workup) as workuph:
         w = json.load(workuph)
         fate, body = \
@@ -0,0 +1,312 @@
+"""
+swalign.pyx - In-process Smith-Waterman alignment of nucleotide sequences
+
+This is a replacement for running ssearch36 on every pair of reads,
+which costs a fork, two temporary FASTA files, and parsing text for
+every alignment. It does local alignment with affine gaps, scoring
+IUPAC ambiguity codes by how likely they are to match, and can
+restrict the alignment to a band of diagonals.
+"""
+import numpy
+cimport numpy
+cimport cython
+
+# Default scores, the same as ssearch36's defaults for DNA. A gap of
+# length k costs gap_open + k*gap_extend.
+default_match = 5
+default_mismatch = -4
+default_gap_open = 12
+default_gap_extend = 4
+
+# Each IUPAC code as a mask of the bases it stands for: A=1, C=2,
+# G=4, T=8. Anything else, including '-', is 0 and matches nothing.
+iupac = {'A': 1, 'C': 2, 'G': 4, 'T': 8, 'U': 8,
+         'R': 5, 'Y': 10, 'S': 6, 'W': 9, 'K': 12, 'M': 3,
+         'B': 14, 'D': 13, 'H': 11, 'V': 7, 'N': 15}
+
+codes = numpy.zeros(256, dtype=numpy.uint8)
+for _c, _m in iupac.items():
+    codes[ord(_c)] = _m
+    codes[ord(_c.lower())] = _m
+
+def popcount(int x):
+    return bin(x).count('1')
+
+def score_matrix(int match=default_match, int mismatch=default_mismatch):
+    """Return the 16x16 matrix of scores between base masks.
+
+    Two masks score the expected score of the bases they could stand
+    for, rounded: *match* times the chance that they are the same base
+    plus *mismatch* times the chance that they are not. So A against
+    A scores *match*, A against C scores *mismatch*, and A against N
+    scores in between. A mask of 0 scores *mismatch* against anything.
+    """
+    m = numpy.empty((16, 16), dtype=numpy.intc)
+    for a in range(16):
+        for b in range(16):
+            if a == 0 or b == 0:
+                m[a, b] = mismatch
+            else:
+                p = popcount(a & b) / float(popcount(a) * popcount(b))
+                m[a, b] = int(round(match*p + mismatch*(1-p)))
+    return m
+
+# Traceback bits. The low two bits give where H came from; the next
+# two say whether E and F extended a gap or opened it from H.
+DEF FROM_ZERO = 0
+DEF FROM_DIAG = 1
+DEF FROM_E = 2
+DEF FROM_F = 3
+DEF E_EXTENDS = 4
+DEF F_EXTENDS = 8
+
+DEF NEG = -1000000000
+
+def align(seq1, seq2, band=None, diagonal=0, int match=default_match,
+          int mismatch=default_mismatch, int gap_open=default_gap_open,
+          int gap_extend=default_gap_extend):
+    """Align *seq1* and *seq2* with Smith-Waterman.
+
+    Returns ((offset1, aligned1), (offset2, aligned2)) like
+    ``align.ssearch36``: the whole of each sequence, with gaps
+    inserted in the aligned region, and the offsets placing the two
+    so that the aligned regions line up. Unaligned ends are not
+    padded with gaps.
+
+    If *band* is given, only alignments within *band* diagonals of
+    *diagonal* are considered, where *diagonal* is the position in
+    *seq1* at which *seq2* is expected to start. Time and memory then
+    grow with the band instead of the product of the lengths.
+    """
+    seq1, seq2 = asbytes(seq1), asbytes(seq2)
+    cdef Py_ssize_t n = len(seq1), m = len(seq2)
+    if n == 0:
+        return (0, ''), (0, seq2)
+    if m == 0:
+        return (0, seq1), (0, '')
+    cdef Py_ssize_t lo, hi
+    cdef bint banded
+    if band is None:
+        lo, hi = -m, n
+    else:
+        if band < 0:
+            raise ValueError("band must be nonnegative, not %d" % (band,))
+        lo, hi = diagonal - band, diagonal + band
+    # A band narrower than seq2 keeps only its own diagonals of each
+    # row of the traceback; otherwise rows are whole.
+    banded = hi - lo + 1 < m + 1
+    cdef unsigned char[:] a = codes[numpy.frombuffer(seq1, dtype=numpy.uint8)]
+    cdef unsigned char[:] b = codes[numpy.frombuffer(seq2, dtype=numpy.uint8)]
+    cdef int[:, ::1] scores = score_matrix(match, mismatch)
+    trace = numpy.zeros((n+1, hi - lo + 1 if banded else m+1), dtype=numpy.uint8)
+    cdef unsigned char[:, ::1] tv = trace
+    cdef int[:] hrow = numpy.zeros(m+1, dtype=numpy.intc)
+    cdef int[:] frow = numpy.empty(m+1, dtype=numpy.intc)
+    cdef int best = 0
+    cdef Py_ssize_t besti = 0, bestj = 0
+    with nogil:
+        best = fill(a, b, scores, gap_open, gap_extend, lo, hi, banded, tv,
+                    hrow, frow, &besti, &bestj)
+    if best <= 0:
+        return (0, seq1), (0, seq2)
+    return traceback(seq1, seq2, trace, hi if banded else None, besti, bestj)
+
+# Seeding: k-mers of this length shared by the two sequences vote for
+# the diagonal they lie on, and a diagonal needs at least
+# default_min_hits votes to be believed.
+default_k = 12
+default_min_hits = 3
+default_band = 16
+
+# Each unambiguous base as two bits, and 4 for anything else.
+twobit = numpy.empty(256, dtype=numpy.int64)
+twobit[:] = 4
+for _i, _c in enumerate('ACGT'):
+    twobit[ord(_c)] = _i
+    twobit[ord(_c.lower())] = _i
+twobit[ord('U')] = twobit[ord('u')] = 3
+
+def kmers(seq, int k=default_k):
+    """Return (positions, values) of the unambiguous *k*-mers of *seq*.
+
+    Each k-mer is packed two bits per base into an integer. k-mers
+    containing an ambiguity code or gap are left out.
+    """
+    seq = asbytes(seq)
+    n = len(seq) - k + 1
+    if n <= 0:
+        return numpy.zeros(0, dtype=numpy.int_), numpy.zeros(0, dtype=numpy.int64)
+    bits = twobit[numpy.frombuffer(seq, dtype=numpy.uint8)]
+    bad = numpy.zeros(len(seq) + 1, dtype=numpy.int_)
+    numpy.cumsum(bits == 4, out=bad[1:])
+    values = numpy.zeros(n, dtype=numpy.int64)
+    for t in range(k):
+        values <<= 2
+        values |= bits[t:t+n] & 3
+    positions = numpy.flatnonzero(bad[k:] == bad[:n])
+    return positions, values[positions]
+
+def seed_diagonal(seq1, seq2, int k=default_k, int min_hits=default_min_hits):
+    """Return the diagonal on which *seq1* and *seq2* share the most *k*-mers.
+
+    The diagonal is the position in *seq1* at which *seq2* starts, as
+    for ``align``, and may be negative. Returns None if no diagonal
+    has at least *min_hits* shared k-mers.
+    """
+    pos1, val1 = kmers(seq1, k)
+    pos2, val2 = kmers(seq2, k)
+    if len(val1) == 0 or len(val2) == 0:
+        return None
+    order = numpy.argsort(val1, kind='mergesort')
+    sorted1 = val1[order]
+    lo = numpy.searchsorted(sorted1, val2, 'left')
+    counts = numpy.searchsorted(sorted1, val2, 'right') - lo
+    total = counts.sum()
+    if total < min_hits:
+        return None
+    # Every (i, j) with the same k-mer at i in seq1 and j in seq2.
+    starts = numpy.cumsum(counts) - counts
+    within = numpy.arange(total) - numpy.repeat(starts, counts)
+    i = pos1[order[numpy.repeat(lo, counts) + within]]
+    j = numpy.repeat(pos2, counts)
+    m = len(seq2)
+    votes = numpy.bincount(i - j + m)
+    best = votes.argmax()
+    if votes[best] < min_hits:
+        return None
+    return int(best) - m
+
+def seeded_align(seq1, seq2, band=default_band, int k=default_k,
+                 int min_hits=default_min_hits, **kwargs):
+    """Align *seq1* and *seq2* in a band around their best k-mer diagonal.
+
+    Forward and reverse reads of one amplicon overlap on a single
+    diagonal, which ``seed_diagonal`` finds in time linear in their
+    lengths. Only *band* diagonals either side of it are then
+    aligned. Without a seed, falls back to aligning the whole of
+    both. Other keyword arguments are passed to ``align``.
+    """
+    diagonal = seed_diagonal(seq1, seq2, k, min_hits)
+    if diagonal is None:
+        return align(seq1, seq2, **kwargs)
+    return align(seq1, seq2, band=band, diagonal=diagonal, **kwargs)
+
+def asbytes(seq):
+    # Sequences arrive as strings, unicode from JSON, or lists of bases.
+    if not isinstance(seq, basestring):
+        seq = ''.join(seq)
+    if isinstance(seq, unicode):
+        seq = seq.encode('ascii')
+    return seq
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int fill(unsigned char[:] a, unsigned char[:] b, int[:, ::1] scores,
+              int gap_open, int gap_extend, Py_ssize_t lo, Py_ssize_t hi,
+              bint banded, unsigned char[:, ::1] tv, int[:] hrow, int[:] frow,
+              Py_ssize_t* besti, Py_ssize_t* bestj) noexcept nogil:
+    # Fill in the traceback matrix tv with Gotoh's recurrences. Cell
+    # (i,j) is in the band if lo <= i - j <= hi, and only cells in the
+    # band are computed. If *banded*, tv holds only the band, with
+    # cell (i,j) at tv[i, j-i+hi]; otherwise it is at tv[i, j].
+    # hrow and frow hold H and F of the previous
+    # row where it was in the band; entries outside it are stale and
+    # never read. Row 0 and column 0 are 0, where local alignments
+    # can start. Returns the best score and sets its cell.
+    cdef Py_ssize_t n = a.shape[0], m = b.shape[0], i, j, jlo, jhi, shift
+    cdef int h, e, f, diag, up, t, best = 0
+    cdef unsigned char bits
+    for j in range(m+1):
+        hrow[j] = 0
+        frow[j] = NEG
+    for i in range(1, n+1):
+        jlo = i - hi if i - hi > 1 else 1
+        jhi = i - lo if i - lo < m else m
+        if jlo > jhi:
+            continue
+        shift = i - hi if banded else 0
+        # H of (i-1, jlo-1) and (i, jlo-1), and E of (i, jlo-1).
+        diag = hrow[jlo-1]
+        h = 0 if jlo == 1 else NEG
+        e = NEG
+        for j in range(jlo, jhi+1):
+            if j <= i - 1 - lo:
+                up = hrow[j]
+                f = frow[j]
+            else:
+                up = NEG
+                f = NEG
+            bits = 0
+            # E: a gap in seq1, coming from the left.
+            t = h - gap_open - gap_extend
+            if e - gap_extend > t:
+                e = e - gap_extend
+                bits |= E_EXTENDS
+            else:
+                e = t
+            # F: a gap in seq2, coming from above.
+            t = up - gap_open - gap_extend
+            if f - gap_extend > t:
+                f = f - gap_extend
+                bits |= F_EXTENDS
+            else:
+                f = t
+            h = diag + scores[a[i-1], b[j-1]]
+            bits |= FROM_DIAG
+            if e > h:
+                h = e
+                bits = (bits & ~3) | FROM_E
+            if f > h:
+                h = f
+                bits = (bits & ~3) | FROM_F
+            if h <= 0:
+                h = 0
+                bits = bits & ~3
+            tv[i, j - shift] = bits
+            if h > best:
+                best = h
+                besti[0] = i
+                bestj[0] = j
+            diag = up
+            hrow[j] = h
+            frow[j] = f
+    return best
+
+def traceback(seq1, seq2, trace, hi, Py_ssize_t i, Py_ssize_t j):
+    # Walk back from cell (i, j) of trace to the start of the local
+    # alignment, then attach the unaligned ends of both sequences.
+    # *hi* is the band's upper diagonal if trace holds only the band,
+    # as fill lays it out, or None if it holds whole rows.
+    cdef Py_ssize_t endi = i, endj = j
+    cdef Py_ssize_t top = 0 if hi is None else hi
+    cdef bint banded = hi is not None
+    cdef int state = 0
+    cdef unsigned char bits
+    al1, al2 = [], []
+    while i > 0 and j > 0:
+        bits = trace[i, j - i + top] if banded else trace[i, j]
+        if state == 0:
+            if bits & 3 == FROM_ZERO:
+                break
+            elif bits & 3 == FROM_DIAG:
+                al1.append(seq1[i-1])
+                al2.append(seq2[j-1])
+                i -= 1
+                j -= 1
+                continue
+            state = bits & 3
+        if state == FROM_E:
+            al1.append('-')
+            al2.append(seq2[j-1])
+            if not bits & E_EXTENDS:
+                state = 0
+            j -= 1
+        else:
+            al1.append(seq1[i-1])
+            al2.append('-')
+            if not bits & F_EXTENDS:
+                state = 0
+            i -= 1
+    aligned1 = seq1[:i] + ''.join(reversed(al1)) + seq1[endi:]
+    aligned2 = seq2[:j] + ''.join(reversed(al2)) + seq2[endj:]
+    return (max(0, j - i), aligned1), (max(0, i - j), aligned2)
@@ -0,0 +1,168 @@
+"""
+traces.py - Compact storage for chromatogram traces
+
+The traces of a read are four polylines (one per channel) for every
+base. Storing them as lists of dictionaries of lists of (x,y) tuples
+makes each read hundreds of thousands of small Python objects, which
+are then copied again by every operation on the assembly. A
+TraceArray keeps all the points of a read in one float32 buffer, with
+a table of offsets giving where each base's channels lie in it.
+"""
+import numpy
+
+# Order of the channels in a TraceArray's offset table.
+channels = 'ACTG'
+complements = {'A': 'T', 'C': 'G', 'T': 'A', 'G': 'C'}
+
+
+class TraceArray(object):
+    """Sequence of per-base traces backed by a single point buffer.
+
+    ``points`` is a float32 array of shape (n,2) holding every (x,y)
+    point of the read. The points of channel c (in the order 'ACTG')
+    of base row r are ``points[offsets[4*r+c]:offsets[4*r+c+1]]``.
+    ``index`` maps each position of the TraceArray to a base row, or
+    to -1 for a gap.
+
+    Indexing a position returns the same thing a list of traces would:
+    ``None`` for a gap, otherwise a dictionary from channel to a list
+    of (x,y) tuples. Slicing, reversing, and inserting gaps only ever
+    build a new index array. The point buffer and offset table are
+    shared, never copied. A TraceArray with ``flipped`` set is the
+    reverse complement of its rows: channels are complemented and x is
+    mirrored as 1-x when the points are read out.
+    """
+    __slots__ = ('points', 'offsets', 'index', 'flipped')
+
+    def __init__(self, points, offsets, index=None, flipped=False):
+        self.points = points
+        self.offsets = offsets
+        if index is None:
+            index = numpy.arange((len(offsets)-1) // len(channels))
+        self.index = index
+        self.flipped = flipped
+
+    @classmethod
+    def fromlist(cls, traces):
+        """Build a TraceArray from a list of trace dictionaries.
+
+        *traces* is in the format returned by indexing a TraceArray,
+        or read back from JSON, with ``None`` for gaps.
+        """
+        rows = [t for t in traces if t is not None]
+        lengths = [len(t[b]) for t in rows for b in channels]
+        offsets = numpy.zeros(len(lengths)+1, dtype=numpy.int_)
+        numpy.cumsum(lengths, out=offsets[1:])
+        points = numpy.empty((offsets[-1], 2), dtype=numpy.float32)
+        for k, ps in enumerate(t[b] for t in rows for b in channels):
+            if len(ps) > 0:
+                points[offsets[k]:offsets[k+1]] = ps
+        present = numpy.array([t is not None for t in traces], dtype=bool)
+        index = numpy.where(present, numpy.cumsum(present) - 1, -1)
+        return cls(points, offsets, index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def channel(self, i, base):
+        """Return the points of *base* at position *i* as an (n,2) array.
+
+        Returns ``None`` if position *i* is a gap.
+        """
+        row = self.index[i]
+        if row < 0:
+            return None
+        if self.flipped:
+            base = complements[base]
+        c = 4*row + channels.index(base)
+        ps = self.points[self.offsets[c]:self.offsets[c+1]]
+        if self.flipped:
+            ps = ps.copy()
+            ps[:,0] = 1 - ps[:,0]
+        return ps
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TraceArray(self.points, self.offsets, self.index[i], self.flipped)
+        if self.index[i] < 0:
+            return None
+        return dict((b, map(tuple, self.channel(i, b).tolist())) for b in channels)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def tolist(self):
+        """Return the traces as a list of dictionaries, as for JSON."""
+        return list(self)
+
+    def reverse_complement(self):
+        """Return the reverse complement of these traces, sharing the buffer."""
+        return TraceArray(self.points, self.offsets, self.index[::-1], not self.flipped)
+
+    def view(self):
+        """Return a TraceArray of the same traces that changes independently of this one.
+
+        The point buffer and index are shared. Neither is ever written
+        in place, so only the object needs to be new.
+        """
+        return TraceArray(self.points, self.offsets, self.index, self.flipped)
+
+    def take(self, positions):
+        """Return a TraceArray of the positions in *positions*.
+
+        A position of -1 gives a gap.
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int_)
+        index = numpy.where(positions >= 0, self.index[positions], -1) \
+            if len(positions) else numpy.zeros(0, dtype=numpy.int_)
+        return TraceArray(self.points, self.offsets, index, self.flipped)
+
+    def insert(self, i, x):
+        """Insert a gap at position *i*, in place as for a list."""
+        if x is not None:
+            raise ValueError("Only gaps (None) can be inserted into a TraceArray.")
+        self.index = numpy.insert(self.index, i, -1)
+
+    def _shares(self, other):
+        return isinstance(other, TraceArray) and other.points is self.points and \
+            other.flipped == self.flipped
+
+    def _gaps(self, n):
+        return -numpy.ones(n, dtype=numpy.int_)
+
+    def __add__(self, other):
+        if self._shares(other):
+            index = numpy.concatenate([self.index, other.index])
+        elif all(x is None for x in other):
+            index = numpy.concatenate([self.index, self._gaps(len(other))])
+        else:
+            return self.tolist() + list(other)
+        return TraceArray(self.points, self.offsets, index, self.flipped)
+
+    def __radd__(self, other):
+        if all(x is None for x in other):
+            index = numpy.concatenate([self._gaps(len(other)), self.index])
+        else:
+            return list(other) + self.tolist()
+        return TraceArray(self.points, self.offsets, index, self.flipped)
+
+    def __eq__(self, other):
+        if self._shares(other):
+            return numpy.array_equal(self.index, other.index)
+        try:
+            return len(self) == len(other) and self.tolist() == list(other)
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not(self == other)
+
+    def __repr__(self):
+        return 'TraceArray(%d bases, %d points)' % (len(self), len(self.points))
+
+    def __getstate__(self):
+        return (self.points, self.offsets, self.index, self.flipped)
+
+    def __setstate__(self, state):
+        self.points, self.offsets, self.index, self.flipped = state
@@ -14,7 +14,8 @@ setup(name='seqlabd',
       packages=['seqlab', 'seqlab.subcommands', 'seqlab.daemons'],
       install_requires=['pydaemonize','pyinotify'],
       cmdclass = {'build_ext': build_ext},
-      ext_modules = [Extension("seqlab.ab1", ["seqlab/ab1.pyx"])],
+      ext_modules = [Extension("seqlab.ab1", ["seqlab/ab1.pyx"]),
+                     Extension("seqlab.swalign", ["seqlab/swalign.pyx"])],
       include_dirs = [numpy.get_include(),],
       scripts=['bin/sequencereportd', 'bin/dailysummaryd',
                'bin/seqlab']
@@ -1,4 +1,7 @@
 import sys; sys.path.append('../')
+# Keep the tests from filling the user's cache. Tests of caching pass
+# their own DiskCache.
+import os; os.environ['SEQLAB_CACHE'] = ''
 data_path = 'data'
 
 import py.test
@@ -1,14 +1,164 @@
 import common
+import py.test
+import datetime
+import io
 from seqlab.ab1 import *
+from seqlab import diskcache
 
 def test_sparsify():
     xs = numpy.arange(14)
     ys = numpy.arange(14)/5.0
-    assert psparsify(xs,ys) == [(0,0), (11,11/5.0), (13,13/5.0)]
+    assert numpy.allclose(sparsify(xs,ys), [(0,0), (11,11/5.0), (13,13/5.0)])
+    assert sparsify(xs,ys).dtype == numpy.float32
     xs = numpy.arange(4)
     ys = numpy.arange(4)
-    assert psparsify(xs,ys) == [(0,0), (3,3)]
+    assert numpy.allclose(sparsify(xs,ys), [(0,0), (3,3)])
+    assert sparsify([], []).shape == (0,2)
 
+def test_sparsify_windows():
+    scaled = numpy.vstack([numpy.arange(14)/5.0, numpy.arange(14)])
+    points, offsets = sparsify_windows(scaled, [0, 10], [11, 14])
+    assert list(offsets) == [0, 2, 4, 6, 8]
+    for i, (l, r) in enumerate([(0, 11), (10, 14)]):
+        xs = numpy.arange(r-l) / float(r-l-1)
+        for c in range(2):
+            k = 2*i + c
+            assert numpy.array_equal(points[offsets[k]:offsets[k+1]],
+                                     sparsify(xs, scaled[c,l:r]))
+
+
+def test_sparsify_windows_degenerate(capfd):
+    scaled = numpy.vstack([numpy.arange(6)/5.0])
+    points, offsets = sparsify_windows(scaled, [0, 2, 3], [2, 3, 3])
+    assert list(offsets) == [0, 2, 3, 3]
+    assert numpy.allclose(points, [(0, 0), (1, 0.2), (0, 0.4)])
+    assert capfd.readouterr()[1] == ''
+
+def test_read():
+    r = read('data/10h9BE-1.ab1')
+    assert len(r['sequence']) == 577
+    assert len(r['confidences']) == 577
+    assert r._traces is None
+    assert len(r['traces']) == 577
+    assert r.traces is r['traces']
+    assert all(isinstance(c, int) for c in r['confidences'])
+    with py.test.raises(ValueError):
+        read('data/place_file/source/279.22708_G02_014.ab1')
+
+def test_read_buffer():
+    r = read('data/10h9BE-1.ab1')
+    with open('data/10h9BE-1.ab1', 'rb') as h:
+        data = h.read()
+    with open('data/10h9BE-1.ab1', 'rb') as h:
+        sources = [data, bytearray(data), memoryview(data), buffer(data),
+                   io.BytesIO(data), h]
+        for source in sources:
+            b = read(source)
+            assert b['sequence'] == r['sequence']
+            assert b['confidences'] == r['confidences']
+            assert b.traces == r.traces
+    assert index(data).sample_name == '89'
+    assert not isfilename(data)
+    assert isfilename('ABIF.ab1')
+    with py.test.raises(ValueError):
+        read(42)
+
+def test_read_compressed(tmpdir):
+    r = read('data/10h9BE-1.ab1')
+    suffixes = ['.gz', '.xz'] if lzma is not None else ['.gz']
+    for suffix in suffixes:
+        filename = str(tmpdir.join('10h9BE-1.ab1' + suffix))
+        compress('data/10h9BE-1.ab1', filename)
+        assert is_ab1(filename)
+        c = read(filename)
+        assert c['sequence'] == r['sequence']
+        assert c.traces == r.traces
+        assert index(filename).sample_name == '89'
+    with open(str(tmpdir.join('bad.ab1.gz')), 'wb') as h:
+        h.write('not compressed')
+    with py.test.raises(ValueError):
+        read(str(tmpdir.join('bad.ab1.gz')))
+
+def test_read_fields():
+    r = read('data/10h9BE-1.ab1', fields=('sequence', 'confidences'))
+    assert sorted(r.keys()) == ['confidences', 'sequence']
+    assert r['sequence'] == read('data/10h9BE-1.ab1')['sequence']
+    assert r.traces is None
+    with py.test.raises(KeyError):
+        r['traces']
+    assert read('data/10h9BE-1.ab1', fields=()).keys() == []
+    with py.test.raises(ValueError):
+        read('data/10h9BE-1.ab1', fields=('bases',))
+
+def test_read_many():
+    filenames = ['data/10h9BE-1.ab1', 'data/10h9BE-2.ab1', 'data/tmpzRpKiy-1.ab1']
+    for workers, threads in [(1, False), (2, False), (2, True)]:
+        records = dict(read_many(filenames, workers=workers, threads=threads))
+        assert sorted(records.keys()) == sorted(filenames)
+        for f in filenames:
+            r = read(f)
+            assert records[f]['sequence'] == r['sequence']
+            assert records[f]['confidences'] == r['confidences']
+            assert records[f].traces == r.traces
+    with py.test.raises(ValueError):
+        list(read_many(filenames + ['data/place_file/source/279.22708_G02_014.ab1'],
+                       workers=2))
+
+def test_cached_read(tmpdir):
+    cache = diskcache.DiskCache(str(tmpdir))
+    r = read('data/10h9BE-1.ab1')
+    for i in range(2):
+        c = cached_read('data/10h9BE-1.ab1', cache=cache)
+        assert c['sequence'] == r['sequence']
+        assert c['confidences'] == r['confidences']
+        assert c.traces == r.traces
+    assert (cache.hits, cache.misses) == (1, 1)
+    c = cached_read('data/10h9BE-1.ab1', fields=('sequence',), cache=cache)
+    assert c.keys() == ['sequence']
+    assert len(cache.entries()) == 2
+
+def test_cached_read_stale(tmpdir):
+    cache = diskcache.DiskCache(str(tmpdir))
+    tmpdir.mkdir('reads')
+    filename = str(tmpdir.join('reads', 'a.ab1'))
+    with open('data/10h9BE-1.ab1', 'rb') as h, open(filename, 'wb') as out:
+        out.write(h.read())
+    cached_read(filename, cache=cache)
+    with open('data/tmpzRpKiy-1.ab1', 'rb') as h, open(filename, 'wb') as out:
+        out.write(h.read())
+    assert cached_read(filename, cache=cache)['sequence'] == \
+        read('data/tmpzRpKiy-1.ab1')['sequence']
+    assert (cache.hits, cache.misses) == (0, 2)
+
+def test_decode_errors():
+    with open('data/10h9BE-1.ab1', 'rb') as h:
+        data = h.read()
+    assert decode(data)['sequence'] == read('data/10h9BE-1.ab1')['sequence']
+    for bad in ['', 'ABIF', 'XBIF' + data[4:], data[:4] + '\x00\x00' + data[6:],
+                data[:len(data)//2]]:
+        with py.test.raises(ValueError):
+            decode(bad)
+
+def test_index():
+    i = index('data/10h9BE-1.ab1')
+    assert len(i) == 127
+    assert i.sample_name == '89'
+    assert i.well == 'A3'
+    assert i.instrument == '3130xl-1344-009'
+    assert i.model == '3100'
+    assert i.run_start == datetime.datetime(2011, 7, 26, 23, 36, 36)
+    assert i.run_stop == datetime.datetime(2011, 7, 27, 0, 39, 46)
+    assert i.value('S/N%') == [107, 83, 44, 72]
+    assert i.value('FWO_') == 'GATC'
+    assert ('DATA', 9) in i
+    assert i.entry('PBAS', 2).numelements == 577
+    with py.test.raises(ValueError):
+        i.value('DATA', 9)
+    with py.test.raises(KeyError):
+        i.value('XXXX')
+    assert i.get('XXXX') is None
+    with py.test.raises(ValueError):
+        index('data/place_file/source/279.22708_G02_014.ab1')
 
 def test_cutoff():
     xs = numpy.arange(50)
@@ -1,12 +1,211 @@
 import common
+import pytest
+import os
+import distutils.spawn
 from seqlab.align import *
+import seqlab.swalign as swalign
+
+s1 = 'CTCAGGATGAACGCTGGCGGCGTGCCTAATACATGCMAGTCGAGCGAACAGATAAGGAGCTTGCTCCTTTGACGTTAGCGGCGGACGGGTGAGTAACACGTGGGTAACCTACCTATAAGACTGGGACAACTTCGGGAAACCGGAGCTAATACCGGATAATATGTTGAACCGCATGGTTCAATAGTGAAAGATGGTTTTGCTATCACTTATAGATGGACCCGCGCCGTATTAGCTAGTTGGTGAGGTAACGGCTCACCAAGGCAACGATACGTAGCCGACCTGAGAGGGTGATCGGCCACACTGGAACTGAGACACGGTCCAGACTCCTACGGGAGGCAGCAGTAGGGAATCTTCCGCAATGGGCGAAAGCCTGACGGAGCAACGCCGCGTGAGTGATGAAGGTCTTAGGATCGTAAAACTCTGTTATTAGGGAAGAACAAACGTGTAAGTAACTGTGCACGTCTTGACGGTACCTAATCAGAAAGCCACGGCTAACTACG'
+s2 = 'GATGAACGCTGGCGGCGTGCCTAATACATGCAAGTCGAGCGAACAGATAAGGAGCTTGCTCCTTTGACGTTAGCGGCGGACGGGTGAGTAACACGTGGGTAACCTACCTATAAGACTGGGACAACTTCGGGAAACCGGAGCTAATACCGGATAATATGTTGAACCGCATGGTTCAATAGTGAAAGATGGTTTTGCTATCACTTATAGATGGACCCGCGCCGTATTAGCTAGTTGGTGAGGTAACGGCTCACCAAGGCAACGATACGTAGCCGACCTGAGAGGGTGATCGGCCACACTGGAACTGAGACACGGTCCAGACTCCTACGGGAGGCAGCAGTAGGGAATCTTCCGCAATGGGCGAAAGCCTGACGGAGCAACGCCGCGTGAGTGATGAAGGTCTTAGGATCGTAAAACTCTGTTATTAGGGAAGAACAAACGTGTAAGTAACTGTGCACGTCTTGACGGTACCTAATCAGAAAGCCACGGCTAACTA'
 
 def test_ssearch():
-    s1 = 'CTCAGGATGAACGCTGGCGGCGTGCCTAATACATGCMAGTCGAGCGAACAGATAAGGAGCTTGCTCCTTTGACGTTAGCGGCGGACGGGTGAGTAACACGTGGGTAACCTACCTATAAGACTGGGACAACTTCGGGAAACCGGAGCTAATACCGGATAATATGTTGAACCGCATGGTTCAATAGTGAAAGATGGTTTTGCTATCACTTATAGATGGACCCGCGCCGTATTAGCTAGTTGGTGAGGTAACGGCTCACCAAGGCAACGATACGTAGCCGACCTGAGAGGGTGATCGGCCACACTGGAACTGAGACACGGTCCAGACTCCTACGGGAGGCAGCAGTAGGGAATCTTCCGCAATGGGCGAAAGCCTGACGGAGCAACGCCGCGTGAGTGATGAAGGTCTTAGGATCGTAAAACTCTGTTATTAGGGAAGAACAAACGTGTAAGTAACTGTGCACGTCTTGACGGTACCTAATCAGAAAGCCACGGCTAACTACG'
-    s2 = 'GATGAACGCTGGCGGCGTGCCTAATACATGCAAGTCGAGCGAACAGATAAGGAGCTTGCTCCTTTGACGTTAGCGGCGGACGGGTGAGTAACACGTGGGTAACCTACCTATAAGACTGGGACAACTTCGGGAAACCGGAGCTAATACCGGATAATATGTTGAACCGCATGGTTCAATAGTGAAAGATGGTTTTGCTATCACTTATAGATGGACCCGCGCCGTATTAGCTAGTTGGTGAGGTAACGGCTCACCAAGGCAACGATACGTAGCCGACCTGAGAGGGTGATCGGCCACACTGGAACTGAGACACGGTCCAGACTCCTACGGGAGGCAGCAGTAGGGAATCTTCCGCAATGGGCGAAAGCCTGACGGAGCAACGCCGCGTGAGTGATGAAGGTCTTAGGATCGTAAAACTCTGTTATTAGGGAAGAACAAACGTGTAAGTAACTGTGCACGTCTTGACGGTACCTAATCAGAAAGCCACGGCTAACTA'
     (offset1,seq1),(offset2,seq2) = ssearch36(s1,s2)
     assert offset1 == 0
     assert offset2 == 5
     assert seq1 == s1
     assert seq2 == s2
 
+def test_smithwaterman():
+    (offset1,seq1),(offset2,seq2) = align(s1, s2, 'smithwaterman')
+    assert offset1 == 0
+    assert offset2 == 5
+    assert seq1 == s1
+    assert seq2 == s2
+    assert swalign.align(s2, s1) == ((5, s2), (0, s1))
+    assert swalign.align(list(s1), unicode(s2)) == ((0, s1), (5, s2))
+    assert swalign.align('', s2) == ((0, ''), (0, s2))
+
+def test_smithwaterman_gaps():
+    deleted = s1[:100] + s1[103:]
+    (offset1,seq1),(offset2,seq2) = swalign.align(s1, deleted)
+    assert (offset1, offset2) == (0, 0)
+    assert seq1 == s1
+    assert seq2.replace('-', '') == deleted
+    assert seq2.count('-') == 3
+    assert len(seq2) == len(s1)
+
+def test_smithwaterman_band():
+    assert swalign.align(s1, s2, band=3, diagonal=5) == ((0, s1), (5, s2))
+    # A band that excludes the true diagonal finds no overlap worth having.
+    (_, seq1), (_, seq2) = swalign.align(s1, s2, band=3, diagonal=200)
+    assert seq1 == s1 and seq2 == s2
+    with pytest.raises(ValueError):
+        swalign.align(s1, s2, band=-1)
+
+def test_smithwaterman_band_memory():
+    # The whole traceback of these would be a terabyte, so this only
+    # finishes if the band alone is stored.
+    seq = (s1 * (10**6 // len(s1) + 1))[:10**6]
+    (offset1, seq1), (offset2, seq2) = swalign.align(seq, seq[5:], band=4, diagonal=5)
+    assert (offset1, offset2) == (0, 5)
+    assert seq1 == seq and seq2 == seq[5:]
+
+def test_iupac_scores():
+    m = swalign.score_matrix()
+    a, c, n, mm = [swalign.iupac[b] for b in 'ACNM']
+    assert m[a, a] == swalign.default_match
+    assert m[a, c] == swalign.default_mismatch
+    assert m[a, c] < m[a, n] < m[a, a]
+    assert m[a, mm] == m[c, mm] > m[a, n]
+
+@pytest.mark.skipif(distutils.spawn.find_executable('ssearch36') is None,
+                    reason='ssearch36 is not installed')
+def test_smithwaterman_matches_ssearch36():
+    deleted = s1[:100] + s1[103:]
+    for a, b in [(s1, s2), (s2, s1), (s1, deleted), (s1[50:], s2[:300])]:
+        assert swalign.align(a, b) == ssearch36(a, b)
+
+def test_align_default():
+    try:
+        set_default('smithwaterman')
+        assert align(s1, s2) == ((0, s1), (5, s2))
+        with pytest.raises(ValueError):
+            set_default('blastn')
+    finally:
+        set_default('ssearch36')
+    with pytest.raises(ValueError):
+        align(s1, s2, 'blastn')
+
+
+def test_split_ssearch36m10():
+    with open('data/read_alignments.txt') as h:
+        output = h.read()
+    sections = split_ssearch36m10(output)
+    assert len(sections) == 175
+    assert '98-reverse' in sections and '427-reverse' in sections
+    assert parse_ssearch36m10(sections['98-reverse']) == parse_ssearch36m10(output)
+    (offset1, seq1), (offset2, seq2) = parse_ssearch36m10(sections['427-reverse'])
+    assert (offset1, offset2) == (0, 29)
+
+@pytest.mark.skipif(distutils.spawn.find_executable('ssearch36') is None,
+                    reason='ssearch36 is not installed')
+def test_ssearch36_batch():
+    deleted = s1[:100] + s1[103:]
+    pairs = [(s1, s2), (s1, deleted), (s1, s2[:300]), (s2, s1), ('', s1)]
+    assert ssearch36_batch(pairs, workers=2) == [ssearch36(a, b) for a, b in pairs]
+
+def test_align_many():
+    deleted = s1[:100] + s1[103:]
+    pairs = [(s1, s2), (s1, deleted), (s2, s1)]
+    assert align_many(pairs, 'smithwaterman') == \
+        [swalign.align(a, b) for a, b in pairs]
+
+def test_align_cache(tmpdir):
+    from seqlab.diskcache import DiskCache
+    cache = DiskCache(str(tmpdir))
+    expected = swalign.align(s1, s2)
+    assert align(s1, s2, 'smithwaterman', cache) == expected
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert align(s1, s2, 'smithwaterman', cache) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert align_many([(s2, s1), (s1, s2)], 'smithwaterman', cache) == \
+        [swalign.align(s2, s1), expected]
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert len(cache.entries()) == 2
+    assert cache_key('smithwaterman', s1, s2) == cache_key('smithwaterman', list(s1), s2)
+    assert cache_key('smithwaterman', s1, s2) != cache_key('ssearch36', s1, s2)
+
+def fake_ssearch36(tmpdir, body):
+    # A stand in for ssearch36 that runs the shell commands in body.
+    script = tmpdir.join('ssearch36')
+    script.write('#!/bin/sh\n' + body + '\n')
+    script.chmod(0755)
+    return str(script)
+
+def test_alignment_pool(tmpdir):
+    path = fake_ssearch36(tmpdir, "sed 's/^>>>98-reverse/>>>q0/' %s" %
+                          os.path.abspath('data/read_alignments.txt'))
+    pool = AlignmentPool(limit=2, ssearch36_path=path, tmpdir=str(tmpdir))
+    jobs = [pool.submit(s1, s2) for _ in range(3)]
+    assert len(pool.running) == 2 and len(pool.queued) == 1
+    assert pool.wait() == jobs
+    with open('data/read_alignments.txt') as h:
+        expected = parse_ssearch36m10(h.read())
+    assert [j.result() for j in jobs] == [expected]*3
+    assert pool.submit('', s2).result() == ((0, ''), (0, s2))
+    assert tmpdir.listdir() == [tmpdir.join('ssearch36')]
+
+def test_alignment_pool_failures(tmpdir):
+    pool = AlignmentPool(timeout=0.2, ssearch36_path=fake_ssearch36(tmpdir, 'sleep 10'),
+                         tmpdir=str(tmpdir))
+    slow = pool.submit(s1, s2)
+    assert not slow.done()
+    with pytest.raises(ValueError):
+        slow.result()
+    pool.wait([slow])
+    with pytest.raises(ValueError):
+        slow.result()
+    pool.ssearch36_path = fake_ssearch36(tmpdir, 'exit 3')
+    with pytest.raises(ValueError):
+        pool.wait([pool.submit(s1, s2)])[0].result()
+    pool.ssearch36_path = str(tmpdir.join('nonexistent'))
+    with pytest.raises(ValueError):
+        pool.wait([pool.submit(s1, s2)])[0].result()
+
+def test_timeouts(tmpdir, monkeypatch):
+    path = fake_ssearch36(tmpdir, 'sleep 10')
+    with pytest.raises(ValueError):
+        ssearch36_batch([(s1, s2)], path, str(tmpdir), timeout=0.2)
+    calls = []
+    monkeypatch.setitem(batch_aligners, 'ssearch36',
+                        lambda pairs, timeout=None: calls.append(timeout) or [(0, 'A')]*len(pairs))
+    align_many([(s1, s2)], 'ssearch36', timeout=5)
+    align(s1, s2, 'ssearch36', timeout=7)
+    assert calls == [5, 7]
+
+def test_submit(tmpdir):
+    from seqlab.diskcache import DiskCache
+    cache = DiskCache(str(tmpdir.join('cache')))
+    path = fake_ssearch36(tmpdir, "sed 's/^>>>98-reverse/>>>q0/' %s" %
+                          os.path.abspath('data/read_alignments.txt'))
+    pool = AlignmentPool(ssearch36_path=path, tmpdir=str(tmpdir))
+    with open('data/read_alignments.txt') as h:
+        expected = parse_ssearch36m10(h.read())
+    job = submit(pool, s1, s2, 'ssearch36', cache)
+    assert not job.done()
+    pool.wait([job])
+    assert job.result() == expected
+    # Finished jobs are cached, and cached ones are done at once.
+    job = submit(pool, s1, s2, 'ssearch36', cache)
+    assert job.done() and job.result() == expected
+    assert (cache.hits, len(cache.entries())) == (1, 1)
+    job = submit(pool, s1, s2, 'smithwaterman', cache)
+    assert job.done() and job.result() == swalign.align(s1, s2)
+
+def test_ssearch36_batch_demultiplexes(tmpdir):
+    path = fake_ssearch36(tmpdir, "sed -e 's/^>>>98-reverse/>>>q0/' -e 's/^>>>427-reverse/>>>q1/' %s" %
+                          os.path.abspath('data/read_alignments.txt'))
+    with open('data/read_alignments.txt') as h:
+        sections = split_ssearch36m10(h.read())
+    # Both pairs share s1, so it is the library and results come back swapped.
+    results = ssearch36_batch([(s1, s2), (s1, s2[:200]), ('', s2)],
+                              ssearch36_path=path, tmpdir=str(tmpdir))
+    assert results == [parse_ssearch36m10(sections['98-reverse'])[::-1],
+                       parse_ssearch36m10(sections['427-reverse'])[::-1],
+                       ((0, ''), (0, s2))]
+
+def test_seed_diagonal():
+    assert swalign.seed_diagonal(s1, s2) == 5
+    assert swalign.seed_diagonal(s2, s1) == -5
+    assert swalign.seed_diagonal(s1, 'ACGTTTGACCA'*3) is None
+    assert swalign.seed_diagonal(s1, 'N'*50) is None
+    positions, values = swalign.kmers('ACGTNACGTACGT', 4)
+    assert positions.tolist() == [0, 5, 6, 7, 8, 9]
+    assert values[0] == values[1] == values[5] == 0b00011011
+
+def test_seeded_align():
+    deleted = s1[:100] + s1[103:]
+    for a, b in [(s1, s2), (s2, s1), (s1, deleted), (s1[200:], s2)]:
+        assert align(a, b, 'seeded') == swalign.align(a, b)
+    # No seed, so the whole of both sequences is aligned.
+    assert swalign.seeded_align(s1, 'GATGAACG') == swalign.align(s1, 'GATGAACG')
@@ -249,6 +249,107 @@ def test_tracealong():
     assert tracealong([1]*9, template) == ProperList(3, [1,1,1,1,None,1,1,None,None,1,1,1])
     assert tracealong([1]*12, template) == ProperList(3, [1,1,1,1,None,1,1,None,None,1,1,1,1,1,1])
 
+def test_shared_traces():
+    t = {'A': [(0.0, 1.0)], 'C': [], 'T': [], 'G': []}
+    p = ProperList(0, TraceArray.fromlist([t]*4))
+    q = p >> 3
+    q.insert(q.offset+1, None)
+    assert len(p) == 4 and p[1] == t
+    assert len(q) == 5 and q[4] is None
+    r = p[1:3]
+    r.insertgap(2)
+    r.append(None)
+    r[1] = None
+    assert p == ProperList(0, [t]*4)
+    assert r == ProperList(1, [None, None, t, None])
+    p.extend([t])
+    assert len(p) == 5 and p[4] == t
+
+def test_gapmap():
+    template = ProperList(3, 'ACTG-TT--GGG')
+    g = GapMap.fromtrack(template)
+    assert len(g) == 12
+    assert [g.toalignment(j) for j in range(11)] == [3, 4, 5, 6, 8, 9, 12, 13, 14, 15, 16]
+    assert list(g.toalignment([0, 4])) == [3, 8]
+    assert [g.toread(i) for i in range(2, 16)] == \
+        [-1, 0, 1, 2, 3, -1, 4, 5, -1, -1, 6, 7, 8, 9]
+    assert list(g.positions(5)) == [0, 1, 2, 3, -1, 4]
+    assert list(g.positions(0)) == []
+    assert GapMap.fromtrack(ProperList(0, list('AC-T'))).toread(2) == -1
+    assert GapMap.fromtrack(ProperList(0, [u'A', u'-', u'C'])).toalignment(1) == 2
+    assert GapMap.fromtrack(ProperList(0, [1, None, 2]), None).toread(2) == 1
+
+def test_gapmap_trace():
+    g = GapMap.fromtrack(ProperList(3, 'ACTG-TT--GGG'))
+    for target in [[1]*9, range(9), 'ACGTACGTA', [{'A': i} for i in range(9)]]:
+        assert g.trace(target) == tracealong(target, ProperList(3, 'ACTG-TT--GGG'))
+    assert g.trace(numpy.arange(9)) == ProperList(3, [0,1,2,3,None,4,5,None,None,6,7,8])
+    t = g.trace(numpy.arange(9))
+    assert t.values.dtype.kind == 'i'
+    assert t[7] is None and t[8] == 4 and list(t[6:9]) == [3, None, 4]
+    assert span(t, 6, 9, fill=0) == [3, None, 4]
+    t.insertgaps([4])
+    assert t.values.dtype.kind == 'i'
+    assert t == ProperList(3, [0,None,1,2,3,None,4,5,None,None,6,7,8])
+    assert (t >> 1)[5] is None
+    t.append(9)
+    assert t[-1 + t.right()] == 9 and t[4] is None
+    assert g.trace(TraceArray.fromlist([None]*3)) == ProperList(3, [None]*3)
+    assert g.trace([1]*2, gap=0) == ProperList(3, [1, 1])
+
+def test_arraylist():
+    a = ArrayList(3, 'ACTG')
+    assert a == ProperList(3, 'ACTG')
+    assert a[4] == 'C' and a[2] is None and a[7] is None
+    assert list(a) == ['A', 'C', 'T', 'G']
+    assert a[4:6] == ProperList(4, 'CT')
+    assert a[4:6].values.base is a.values
+    assert (a >> 2).values is a.values
+    assert (a >> 2) == ArrayList(5, 'ACTG')
+    assert a[ProperInterval(5, 9)] == ProperList(5, 'TG')
+    assert isinstance(a[4:6], ArrayList)
+    b = ArrayList(0, [1, 2, 3])
+    assert b[1] == 2 and isinstance(b[1], int)
+    assert b.values.dtype.kind == 'i'
+    assert ArrayList(0, [(1, 2), (3, 4)])[1] == (3, 4)
+    assert arraylist(0, '', '-').isempty()
+
+def test_arraylist_writes():
+    a = ArrayList(3, 'ACTG', gap='-')
+    view = a[3:5]
+    a.insertgap(4)
+    assert a == ProperList(3, 'A-CTG')
+    a[3] = 'T'
+    assert a == ProperList(3, 'T-CTG')
+    assert view == ProperList(3, 'AC')
+    b = ArrayList(2, [1, 2])
+    b.insert(0, 5)
+    assert b == ProperList(0, [5, None, 1, 2])
+    b.append(7)
+    b[7] = 8
+    assert b == ProperList(0, [5, None, 1, 2, 7, None, None, 8])
+
+def test_arraylist_serialize():
+    a = Assembly([('bases', ArrayList(2, 'ACG', gap='-', trackclass='nucleotide')),
+                  ('confidences', ArrayList(2, [1, None, 3]))])
+    assert '__ArrayList' not in a.serialize()
+    b = deserializes(a.serialize())
+    assert b['bases'] == a['bases']
+    assert b['confidences'] == a['confidences']
+    # Files written with __ArrayList still load.
+    c = deserializes(a.serialize().replace('__ProperList', '__ArrayList'))
+    assert isinstance(c['confidences'], ArrayList)
+    assert c['confidences'].values.dtype.kind == 'i'
+    assert c == a
+
+def test_span():
+    a = ArrayList(2, 'ACG')
+    assert span(a, 3, 5).base is a.values
+    assert list(span(a, 0, 4, fill='-')) == ['-', '-', 'A', 'C']
+    assert list(span(a, 4, 7)) == ['G', None, None]
+    assert list(span(a, 6, 8)) == [None, None]
+    assert span(EmptyList(), 0, 2, fill=0) == [0, 0]
+
 def test_alzip():
     a = ProperList(2, [1]*3)
     b = ProperList(0, [1]*6)
@@ -269,6 +370,20 @@ def test_insertgap():
     assert a.insertgap(7) == ProperList(4, [1,2,3])
     assert a.insertgap(5) == ProperList(4, [1,None,2,3])
 
+def test_insertgaps():
+    random.seed(3)
+    for trial in range(200):
+        values = [random.choice('ACGT') for _ in range(random.randint(1, 10))]
+        offset = random.randint(-3, 3)
+        coords = sorted(random.sample(range(-5, 15), random.randint(0, 8)))
+        expected = ProperList(offset, values, '-')
+        for i in coords:
+            expected.insertgap(i)
+        assert ProperList(offset, values, '-').insertgaps(coords) == expected
+        assert ArrayList(offset, values, '-').insertgaps(coords) == expected
+    assert ArrayList(0, [1, 2, 3]).insertgaps([1, 2]) == ProperList(0, [1, None, None, 2, 3])
+    assert EmptyList('-').insertgaps([0, 1]).isempty()
+
 def test_conform_gaps():
     assert conform_gaps(Assembly([('a', aflist(0, [], None))]), 'a',
                      aflist(0, [], None), 
@@ -301,5 +416,47 @@ def test_add_sequence():
                                ('b', aflist(2, 'AG-CCTAGGGA','-')),
                                ('c', aflist(0, 'ATAT-CCTGACCCATG', '-'))]))
 
+def test_add_sequences():
+    import seqlab.align
+    def start():
+        return Assembly([('a', aflist(0, 'ATAGCCTGACCCATGGATTACAGATTACA', '-')),
+                         ('b', aflist(2, 'AGCCTAGGGA','-'))])
+    seqs = [('c', 'ATAGCCTGACCCTTTATGGATTACAGATTACA'),
+            ('d', 'CCTGACCCATGGATTAGAGATTACA'),
+            ('e', 'ATAGCCTGACCCATGGATTACAGCCCATTACA')]
+    seqlab.align.set_default('smithwaterman')
+    try:
+        one_by_one = start()
+        for label, seq in seqs:
+            one_by_one = one_by_one.add_sequence(label, seq, align_to='a')
+        batched = start().add_sequences(seqs, align_to='a')
+    finally:
+        seqlab.align.set_default('ssearch36')
+    assertassemblies(batched, one_by_one)
+    assert ''.join(batched['a'].values) == 'ATAGCCTGACCC---ATGGATTACAG---ATTACA'
+    assert ''.join(batched['d'].values) == 'CCTGACCC---ATGGATTAGAG---ATTACA'
+    assert start().add_sequences(seqs)['c'] == aflist(0, seqs[0][1], '-')
+
+def test_add_sequences_shared_insertion():
+    import seqlab.align
+    seqs = [('c', 'ATAGCCTGACCCTTTATGGATTACAGATTACA'),
+            ('d', 'ATAGCCTGACCCTTATGGATTACAGATTACA')]
+    seqlab.align.set_default('smithwaterman')
+    try:
+        one_by_one = Assembly([('a', aflist(0, 'ATAGCCTGACCCATGGATTACAGATTACA', '-'))])
+        for label, seq in seqs:
+            one_by_one = one_by_one.add_sequence(label, seq, align_to='a')
+        batched = Assembly([('a', aflist(0, 'ATAGCCTGACCCATGGATTACAGATTACA', '-'))]) \
+            .add_sequences(seqs, align_to='a')
+    finally:
+        seqlab.align.set_default('ssearch36')
+    # Both insert the same columns, but place the shorter read's gap
+    # differently within them.
+    for a in one_by_one, batched:
+        assert ''.join(a['a'].values) == 'ATAGCCTGACCC---ATGGATTACAGATTACA'
+        assert ''.join(a['c'].values) == 'ATAGCCTGACCCTTTATGGATTACAGATTACA'
+    assert ''.join(one_by_one['d'].values) == 'ATAGCCTGACCC-TTATGGATTACAGATTACA'
+    assert ''.join(batched['d'].values) == 'ATAGCCTGACCCTT-ATGGATTACAGATTACA'
+
 if __name__=='__main__':
     test_add_sequence()
@@ -22,13 +22,32 @@ def test_good_config_works():
          'inbox_path': '/usr/bin', 
          'db_port': 5432, 'db_name': 'mdx', 
          'db_server': 'localhost', 'db_username': 'boris', 
-         'db_credentials': 'data/dbcredential', 'db_password': 'root'}
+         'db_credentials': 'data/dbcredential', 'db_password': 'root',
+         'compression': None, 'aligner': 'ssearch36',
+         'cache_path': None}
 
 
 
+def test_compression():
+    lines = conf_lines + ["compression = gz"]
+    h = cStringIO.StringIO('\n'.join(lines))
+    assert config.read_configuration(h)['compression'] == 'gz'
+
+def test_aligner():
+    lines = conf_lines + ["aligner = smithwaterman"]
+    h = cStringIO.StringIO('\n'.join(lines))
+    assert config.read_configuration(h)['aligner'] == 'smithwaterman'
+
+def test_cache_path():
+    lines = conf_lines + ["cache_path = /var/cache/seqlab"]
+    h = cStringIO.StringIO('\n'.join(lines))
+    assert config.read_configuration(h)['cache_path'] == '/var/cache/seqlab'
+
 def test_bad_values_fail():
     for i,s in [(4,"target_path = /wasdfkshdf"),
-                (6,"inbox_path = /dfsdfhljfwe/wefsdfh")]:
+                (6,"inbox_path = /dfsdfhljfwe/wefsdfh"),
+                (7,"db_name = mdx\ncompression = zip"),
+                (7,"db_name = mdx\naligner = needle")]:
         new_lines = copy.copy(conf_lines)
         new_lines[i] = s
         h = cStringIO.StringIO('\n'.join(new_lines))
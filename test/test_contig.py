@@ -9,6 +9,25 @@ def test_highqualityinterval():
     assert highqualityinterval([1,1,5,5,1,1], 2, 2) == ProperInterval(2,4)
     assert highqualityinterval([1,1,5,5,3,5,1,5,5,1,1], 2, 2) == ProperInterval(2,9)
     assert highqualityinterval([1,1,1,1,1], 2, 2) == EmptyInterval()
+    assert highqualityinterval([5,5,1], 2, 3) == EmptyInterval()
+    with py.test.raises(ValueError):
+        highqualityinterval([5,5,5], 2, 2, mode='phred')
+
+def test_highqualityintervals():
+    assert highqualityintervals([1,1,5,5,3,5,1,5,5,1,1], 2, 2) == \
+        [ProperInterval(2,6), ProperInterval(7,9)]
+    assert highqualityintervals([5,5,5,5], 2, 2) == [ProperInterval(0,4)]
+    assert highqualityintervals([1,5,1,5], 2, 2) == []
+    assert highqualityintervals([], 2, 2) == []
+
+def test_motttrim():
+    # Q10 has error probability 0.1, Q20 0.01, Q40 0.0001.
+    assert motttrim([10,10,40,40,40,20,40,10]) == ProperInterval(2,7)
+    assert motttrim([10,10,40,40,40,10,40,10]) == ProperInterval(2,5)
+    assert motttrim([10,10,10]) == EmptyInterval()
+    assert motttrim([]) == EmptyInterval()
+    assert highqualityinterval([10,40,40,10], mode='mott') == ProperInterval(1,3)
+    assert highqualityinterval([10,40,40,10], mode='mott', limit=0.2) == ProperInterval(0,4)
 
 def test_extend():
     assert extend(ProperList(3, [1,2,3]), ProperInterval(0,3), ProperList(3, [1,2,3])) == \
@@ -19,6 +38,8 @@ def test_extend():
         ProperList(3, [1,2,3,None,None,1,2,3])
     assert extend(ProperList(3, [1,2,3]), ProperInterval(6,12), ProperList(3, [1,2,3])) == \
         ProperList(0, [1,2,3,1,2,3])
+    e = extend(ArrayList(3, 'AC'), ProperInterval(1,3), ArrayList(0, 'GTTGG'))
+    assert isinstance(e, ArrayList) and e == ProperList(2, 'GACGG')
     assert extend(ProperList(3, [1,2,3]), EmptyInterval(), ProperList(5, [1,2])) == \
         ProperList(5, [1,2])
 
@@ -31,6 +52,8 @@ def test_combinebase():
     assert combinebase(('A', 20), ('T', 20)) == 'W'
     assert combinebase(('A', 20), (None, None)) == 'A'
     assert combinebase(('A', 20), ('T', 10), ('T', 20)) == 'W'
+    assert combinebase(('A', 50), ('-', None)) == 'A'
+    assert combinebase(('A', 10), ('-', None)) == '-'
 
 def test_combine():
     assert combine() == EmptyList()
@@ -45,6 +68,26 @@ def test_combine():
                    (ProperList(3, 'ATACC'), ProperList(3, [20,20,20,20,20]))) == \
                    ProperList(1, 'TTATACC')
 
+def test_consensus():
+    a, c, m, gap = 1, 2, 3, 0
+    masks = [[a, a, a, gap, absent, m],
+             [a, c, c, a,   absent, absent]]
+    confs = [[10, 20, 10, None, 0, 30],
+             [10, 20, 10, 10,   0, 0]]
+    assert consensus(masks, confs) == 'AMN-NM'
+    assert consensus(masks, confs, threshold=40) == 'NNN-NN'
+    assert consensus([[a], [c]], [[5], [5]], threshold=5) == 'M'
+    assert consensus(numpy.zeros((0, 3)), numpy.zeros((0, 3))) == 'NNN'
+
+def test_reverse_complement():
+    assert rcbases('AACGTN-M') == 'K-NACGTT'
+    assert rcconfidences([1, 2, 3]) == [3, 2, 1]
+    confs = numpy.array([1, 2, 3])
+    assert rcconfidences(confs).base is confs
+    traces = TraceArray.fromlist([{'A': [(0.0, 0.5)], 'C': [], 'G': [], 'T': [(1.0, 0.25)]}])
+    assert rctraces(traces).points is traces.points
+    assert rctraces(traces) == rctraces(traces.tolist())
+
 def assertassemblies(a, b):
     assert a.keys() == b.keys()
     for k in a.keys():
@@ -128,6 +171,19 @@ def test_assemble():
                                                       features=[ProperInterval(NegInf(), PosInf(), blue=0,
                                                                                alpha=0.5, green=0, name='unused', red=0)]))]))
 
+def test_assemble_gapped():
+    import seqlab.align
+    s = 'TTAATTCCTTGGTTAATTCCTTGGACGTACGATCGATCGTAGCTAGCTAGTCGATCGAC'
+    d = s[:30] + s[33:]
+    for aligner in ['smithwaterman', 'seeded']:
+        seqlab.align.set_default(aligner)
+        try:
+            a = assemble(s, [50]*len(s), None, d, [50]*len(d), None)
+        finally:
+            seqlab.align.set_default('ssearch36')
+        assert ''.join(a['bases 2'].values) == d[:30] + '---' + d[30:]
+        assert ''.join(a['contig'].values) == s
+
 
 def test_ab1toassembly():
     a = ab1toassembly('data/no_assembly-1.ab1', 'data/no_assembly-2.ab1')
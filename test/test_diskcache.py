@@ -0,0 +1,71 @@
+import common
+import os
+import time
+from seqlab.diskcache import *
+
+def write(s):
+    return lambda h: h.write(s)
+
+def read(filename):
+    with open(filename) as h:
+        return h.read()
+
+def test_get_put(tmpdir):
+    c = DiskCache(str(tmpdir.join('cache')))
+    assert c.get('a', read) is None
+    c.put('a', write('abc'))
+    assert c.get('a', read) == 'abc'
+    c.put('a', write('def'))
+    assert c.get('a', read) == 'def'
+    assert (c.hits, c.misses) == (2, 1)
+    assert len(c.entries()) == 1
+
+def test_corrupt(tmpdir):
+    c = DiskCache(str(tmpdir))
+    c.put('a', write('abc'))
+    def bad(filename):
+        raise ValueError(filename)
+    assert c.get('a', bad) is None
+    assert c.entries() == []
+
+def test_evict(tmpdir):
+    c = DiskCache(str(tmpdir), max_bytes=10)
+    c.put('a', write('0123'))
+    c.put('b', write('0123'))
+    # Make 'a' the most recently used.
+    os.utime(c.filename('b'), (time.time() - 10, time.time() - 10))
+    assert c.get('a', read) == '0123'
+    c.put('c', write('0123'))
+    assert c.get('b', read) is None
+    assert c.get('a', read) == '0123'
+    assert c.size() == 8
+    assert c.purge() == 2
+    assert c.entries() == []
+
+def test_scans_only_over_cap(tmpdir):
+    c = DiskCache(str(tmpdir), max_bytes=10)
+    scans = []
+    entries = c.entries
+    c.entries = lambda: scans.append(1) or entries()
+    c.put('a', write('0123'))
+    assert (len(scans), c.total) == (1, 4)
+    c.put('b', write('0123'))
+    c.put('b', write('012'))
+    assert (len(scans), c.total) == (1, 7)
+    c.put('c', write('0123'))
+    assert len(scans) == 2
+    assert c.total == c.size() == 7
+    c.purge()
+    assert c.total == 0
+
+def test_named_cache(tmpdir, monkeypatch):
+    monkeypatch.delenv('SEQLAB_CACHE', raising=False)
+    assert named_cache('x') is None
+    monkeypatch.setattr('seqlab.diskcache.root', str(tmpdir))
+    assert named_cache('x').path == str(tmpdir.join('x'))
+    monkeypatch.setenv('SEQLAB_CACHE', '')
+    assert named_cache('x') is None
+    # A file where the directory should go.
+    tmpdir.join('blocked').write('')
+    monkeypatch.setenv('SEQLAB_CACHE', str(tmpdir.join('blocked')))
+    assert named_cache('x') is None
@@ -0,0 +1,30 @@
+import common
+import numpy
+import pytest
+from seqlab.nucleotide import *
+
+def test_tomasks():
+    assert tomasks('ACGTMN-').tolist() == [A, C, G, T, A|C, A|C|G|T, GAP]
+    assert tomasks(u'acgu').tolist() == [A, C, G, T]
+    assert tomasks(list('AC')).tolist() == [A, C]
+    assert tomasks(numpy.frombuffer('GT', dtype='S1')).tolist() == [G, T]
+    assert tomasks('').tolist() == []
+    assert ''.join(letters[m] for m in tomasks('ACGTMRWSYKVHDBN-')) == 'ACGTMRWSYKVHDBN-'
+    with pytest.raises(ValueError):
+        tomasks('ACXT')
+
+def test_tomasks_strict():
+    assert tomasks('AcUX-', strict=True).tolist() == [A, invalid, invalid, invalid, GAP]
+    assert tomasks(u'A\xe9', strict=True).tolist() == [A, invalid]
+
+def test_reverse_complement_string():
+    assert reverse_complement('ACGTMRWSYKVHDBN-') == '-NVHDBMRSWYKACGT'
+    assert reverse_complement('acgu') == 'acgt'
+    assert reverse_complement(list('AAC')) == 'GTT'
+    assert reverse_complement('') == ''
+
+def test_tables():
+    x, y = tomasks('AAMN-CR'), tomasks('AMCA-GY')
+    assert (counts[x] > 1).tolist() == [False, False, True, True, False, False, True]
+    assert complements[x].tolist() == tomasks('TTKN-GY').tolist()
+    assert ''.join(letters[m] for m in x | y) == 'AMMN-SN'
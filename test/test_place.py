@@ -2,6 +2,8 @@ import sqlite3
 import time
 
 import common
+import py.path
+import seqlab.ab1
 from seqlab.place import *
 
 
@@ -23,6 +25,19 @@ def test_place(tmpdir):
     assert targetdir.join('boris/hilda/metadata.json').check(exists=1, file=1)
 
 
+def test_place_compressed(tmpdir):
+    tmpdir.mkdir('source')
+    targetdir = tmpdir.mkdir('target')
+    sourcefile = tmpdir.join('source/280.22708_H02_016.ab1')
+    py.path.local('data/10h9BE-1.ab1').copy(sourcefile)
+    finalpath, metadata = place(sourcefile, seqkey, lambda k, ct: {}, 
+                                lambda basepath, metadata, currenttime: basepath,
+                                targetdir, lambda p, m: None, compression='gz')
+    assert finalpath == targetdir.join('280.22708_H02_016.ab1.gz')
+    assert not sourcefile.check(exists=1)
+    assert seqlab.ab1.read(str(finalpath))['sequence'] == \
+        seqlab.ab1.read('data/10h9BE-1.ab1')['sequence']
+
 def test_seqkey_to_workup():
     db = sqlite3.connect(':memory:')
     db.execute("""create table workups (
@@ -3,6 +3,7 @@ import os
 import common
 from seqlab.sequence_report import *
 import seqlab.assembly
+import seqlab.align
 
 def test_pprint_seq():
     s = seqlab.assembly.ProperList(5, ''.join(["TAGGATCAACATGCGTTTCAGCAAACAACCCATCAATCCCCACCGCCGCCGCAGCTCTCGCT",
@@ -42,6 +43,15 @@ def test_generate_report():
                'path': 'data/workups/2011-06-11/TH3_MOZART'},
               'data/tmpzRpKiy-1.ab1', 'data/tmpzRpKiy-2.ab1')) == ('assembled', "beta")
 
+def test_report_with_alignment(monkeypatch):
+    monkeypatch.setattr('seqlab.align.default_aligner', 'smithwaterman')
+    w = {'path': 'data/workups/2011-06-11/TH3_MOZART'}
+    files = ('data/tmpzRpKiy-1.ab1', 'data/tmpzRpKiy-2.ab1')
+    job = submit_alignment(files[0], files[1], seqlab.align.AlignmentPool(1))
+    f = generate_report(None, lambda w, a, v, omit_blast: a, None)
+    assert f((w,) + files, omit_blast=True, alignment=job.result())[1]['contig'] == \
+        f((w,) + files, omit_blast=True)[1]['contig']
+
 def test_render_assembled():
     w = {'accession':'W01325', 'workup':'F22501', 'pat_name':'JENKINS, JOHN H.', 'amp_name':'rpoB', 'path':'data/workups/2011-06-11/W01_JENKINS',
          'date': '2011-06-23', 'tests': [['BACTSEQ','Bacterial sequencing']],
@@ -27,3 +27,14 @@ def test_stats():
     assert overlap(a, 'a', 'b') == 9
     assert lengthdiff(a, 'a', 'b') == 2
     assert lengthdiff(a, 'b', 'a') == -2
+
+def test_unknown_characters():
+    # Characters other than uppercase IUPAC codes and '-' are
+    # compatible with nothing and count as ambiguities.
+    a = Assembly([('a', aflist(0, 'AXGa-U*', '-')),
+                  ('b', aflist(0, 'AAGA-TN', '-'))])
+    assert compatibles(a, 'a', 'b') == 2
+    assert conflicts(a, 'a', 'b') == 4
+    assert ambiguities(a, 'a', 'b') == 4
+    assert ambiguities1(a, 'a', 'b') == 4
+    assert ambiguities2(a, 'a', 'b') == 1
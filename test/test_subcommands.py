@@ -94,6 +94,29 @@ def test_renderab1():
         output = 'data/renderedab1.html'
     assert renderab1.action(Args()) == 0
 
+def test_renderab1_directory(tmpdir):
+    class Args:
+        ab1 = 'data/seqreport_scratch/assembly'
+        output = str(tmpdir)
+        workers = 2
+    assert renderab1.action(Args()) == 0
+    assert sorted(os.listdir(str(tmpdir))) == ['tmpzRpKiy-1.html', 'tmpzRpKiy-2.html']
+
+def test_renderab1_compressed_directory(tmpdir):
+    import gzip
+    source = tmpdir.mkdir('source')
+    shutil.copy('data/no_assembly-1.ab1', str(source))
+    with open('data/no_assembly-2.ab1', 'rb') as i:
+        with gzip.open(str(source.join('no_assembly-2.ab1.gz')), 'wb') as o:
+            o.write(i.read())
+    source.join('notes.txt').write('not an AB1 file')
+    class Args:
+        ab1 = str(source)
+        output = str(tmpdir.join('html'))
+        workers = 1
+    assert renderab1.action(Args()) == 0
+    assert sorted(os.listdir(Args.output)) == ['no_assembly-1.html', 'no_assembly-2.html']
+
 
 
 from seqlab.subcommands import sequencereport
@@ -122,6 +145,7 @@ def test_sequencereport():
         read2='data/tmpzRpKiy-2.ab1'
         verbose=False
         omit_blast=True
+        aligner=None
         output='data/sequencereport_command_output.html'
     assert sequencereport.action(Args()) == 0
     
@@ -142,6 +166,8 @@ def test_assemble():
         second_ab1 = 'data/10h9BE-2.ab1'
         metadata = 'data/workup.json'
         additional_sequences = []
+        omit_traces = False
+        aligner = None
     assert seqlab.subcommands.assemble.action(Args()) == 0
     assert os.path.exists('data/assembly.json.bz2')
 
@@ -158,6 +184,7 @@ def test_addsequences(tmpdir):
         align_to='a'
         fastas=[str(tmpdir.join('a.fasta'))]
         no_alignment=False
+        aligner=None
     assert seqlab.subcommands.addsequence.action(Args()) == 0
     assert os.path.exists(str(tmpdir.join('output.json.bz2')))
     asm2 = asm.deserialize(str(tmpdir.join('output.json.bz2')))
@@ -225,3 +252,20 @@ def test_blast(tmpdir):
 
     
 
+
+import seqlab.ab1
+import seqlab.align
+import seqlab.subcommands.cache
+
+def test_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('SEQLAB_CACHE', str(tmpdir))
+    seqlab.ab1.cached_read('data/10h9BE-1.ab1')
+    seqlab.align.align('ACGTTGCA', 'ACGTTGCA', 'smithwaterman')
+    assert len(seqlab.ab1.default_cache().entries()) == 1
+    assert len(seqlab.align.default_cache().entries()) == 1
+    class Args:
+        purge = True
+        max_bytes = None
+    assert seqlab.subcommands.cache.action(Args()) == 0
+    assert seqlab.ab1.default_cache().entries() == []
+    assert seqlab.align.default_cache().entries() == []
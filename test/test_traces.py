@@ -0,0 +1,43 @@
+import common
+import pickle
+from seqlab.traces import *
+
+traces = [{'A': [(0.0, 0.5), (1.0, 0.25)], 'C': [(0.0, 1.0), (1.0, 1.0)],
+           'T': [(0.0, 0.75), (0.5, 0.5), (1.0, 0.75)], 'G': [(0.0, 1.0), (1.0, 0.5)]},
+          {'A': [(0.0, 1.0), (1.0, 1.0)], 'C': [(0.0, 0.25), (1.0, 0.5)],
+           'T': [(0.0, 1.0), (1.0, 1.0)], 'G': [(0.0, 0.5), (1.0, 0.5)]},
+          {'A': [(0.0, 0.5), (1.0, 0.5)], 'C': [(0.0, 0.5), (1.0, 0.5)],
+           'T': [(0.0, 0.5), (1.0, 0.5)], 'G': [(0.0, 0.25), (1.0, 0.75)]}]
+
+def test_fromlist():
+    t = TraceArray.fromlist(traces)
+    assert len(t) == 3
+    assert t.tolist() == traces
+    assert t == traces
+    assert t[1] == traces[1]
+    assert t[-1] == traces[-1]
+    assert TraceArray.fromlist([None, traces[0]]).tolist() == [None, traces[0]]
+
+def test_slicing():
+    t = TraceArray.fromlist(traces)
+    assert t[1:] == traces[1:]
+    assert t[::-1] == traces[::-1]
+    assert t[1:2].points is t.points
+
+def test_reverse_complement():
+    t = TraceArray.fromlist(traces)
+    expected = [dict([(complements[b], [(1-x, y) for x, y in tr]) for b, tr in d.iteritems()])
+                for d in traces[::-1]]
+    assert t.reverse_complement() == expected
+    assert t.reverse_complement().reverse_complement() == t
+
+def test_gaps():
+    t = TraceArray.fromlist(traces)
+    t.insert(1, None)
+    assert t == [traces[0], None, traces[1], traces[2]]
+    assert [None] + t[:1] + [None, None] == [None, traces[0], None, None]
+    assert t.take([3, -1, 0]) == [traces[2], None, traces[0]]
+
+def test_pickle():
+    t = TraceArray.fromlist(traces).reverse_complement()
+    assert pickle.loads(pickle.dumps(t, 2)) == t.tolist()